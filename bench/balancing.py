@@ -0,0 +1,144 @@
+"""
+Бенчмарк стратегий балансировки: один быстрый и один медленный апстрим.
+
+Для каждой стратегии поднимает прокси отдельным процессом, гоняет запросы с нескольких
+keep-alive соединений и печатает RPS, p50 и p99 задержки.
+
+    python bench/balancing.py [--concurrency 16] [--seconds 5] [--slow-ms 200]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROXY_PORT = 9300
+FAST_PORT, SLOW_PORT = 9301, 9302
+STRATEGIES = ('round_robin', 'least_outstanding', 'p2c_ewma')
+
+
+class DelayedUpstreamProtocol(asyncio.Protocol):
+    """Отвечает 200 OK на каждый запрос без тела через delay_s секунд."""
+
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        while (head_end := self.buffer.find(b'\r\n\r\n')) != -1:
+            self.buffer = self.buffer[head_end + 4:]
+            asyncio.get_running_loop().call_later(self.delay_s, self.respond)
+
+    def respond(self):
+        if not self.transport.is_closing():
+            self.transport.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+
+def run_upstream(port: int, delay_s: float) -> None:
+    async def serve():
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: DelayedUpstreamProtocol(delay_s), '127.0.0.1', port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def start_proxy(strategy: str) -> tuple[subprocess.Popen, str]:
+    config = {
+        'listen': f'127.0.0.1:{PROXY_PORT}',
+        'upstreams': [{'host': '127.0.0.1', 'port': FAST_PORT}, {'host': '127.0.0.1', 'port': SLOW_PORT}],
+        'timeouts': {'connect_ms': 5000, 'read_ms': 5000, 'write_ms': 5000, 'total_ms': 600000},
+        'limits': {'max_client_conns': 1000, 'max_conns_per_upstream': 50},
+        'balancing': {'strategy': strategy},
+    }
+    fd, path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'proxy', 'main.py'), path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, path
+
+
+async def wait_port(port: int, timeout_s: float = 30) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'port {port} is not listening')
+
+
+async def client(deadline: float, latencies: list[float]) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', PROXY_PORT)
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        start = loop.time()
+        writer.write(b'GET /balance HTTP/1.1\r\nHost: bench\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+        await reader.readexactly(2)
+        latencies.append(loop.time() - start)
+    writer.close()
+
+
+async def measure(concurrency: int, seconds: float) -> tuple[float, float, float]:
+    await wait_port(PROXY_PORT)
+    latencies: list[float] = []
+    deadline = asyncio.get_running_loop().time() + seconds
+    await asyncio.gather(*(client(deadline, latencies) for _ in range(concurrency)))
+    latencies.sort()
+    return (
+        len(latencies) / seconds,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--fast-ms', type=float, default=1.0)
+    parser.add_argument('--slow-ms', type=float, default=200.0)
+    args = parser.parse_args()
+
+    upstreams = [
+        multiprocessing.Process(target=run_upstream, args=(FAST_PORT, args.fast_ms / 1000), daemon=True),
+        multiprocessing.Process(target=run_upstream, args=(SLOW_PORT, args.slow_ms / 1000), daemon=True),
+    ]
+    for upstream in upstreams:
+        upstream.start()
+
+    try:
+        for strategy in STRATEGIES:
+            proxy, config_path = start_proxy(strategy)
+            try:
+                rps, p50, p99 = asyncio.run(measure(args.concurrency, args.seconds))
+                print(f'{strategy:>18}: {rps:8.1f} req/s  p50={p50 * 1000:7.1f}ms  p99={p99 * 1000:7.1f}ms')
+            finally:
+                proxy.terminate()
+                proxy.wait()
+                os.remove(config_path)
+    finally:
+        for upstream in upstreams:
+            upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Микробенчмарк таймаутов: CPU на ожидание с asyncio.wait_for и со сроком на общем TimerWheel.
+
+На каждый проксируемый запрос приходится как минимум чтение запроса клиента, чтение ответа апстрима
+и ожидание соединения в пуле, бенчмарк меряет эти три ожидания по отдельности и в сумме.
+
+    python bench/deadlines.py --requests 50000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
+
+from deadline import Deadline, wait_future  # noqa: E402
+from http_utils.protocol import HTTPRequestProtocol, HTTPResponseProtocol  # noqa: E402
+
+TIMEOUT_S = 5
+REQUEST = b'GET /bench HTTP/1.1\r\nHost: bench\r\nUser-Agent: bench\r\n\r\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+
+class NullTransport(asyncio.Transport):
+    def is_closing(self) -> bool:
+        return False
+
+    def pause_reading(self) -> None:
+        pass
+
+    def resume_reading(self) -> None:
+        pass
+
+
+def make_protocol(protocol_class: type) -> HTTPRequestProtocol | HTTPResponseProtocol:
+    protocol = protocol_class()
+    protocol.connection_made(NullTransport())
+    return protocol
+
+
+async def wait_for_read(protocol, data: bytes) -> None:
+    asyncio.get_running_loop().call_soon(protocol.data_received, data)
+    await asyncio.wait_for(protocol.read_chunk(), TIMEOUT_S)
+
+
+async def deadline_read(protocol, data: bytes, deadline: Deadline) -> None:
+    asyncio.get_running_loop().call_soon(protocol.data_received, data)
+    deadline.start(TIMEOUT_S)
+    try:
+        await protocol.read_chunk(deadline)
+    finally:
+        deadline.stop()
+
+
+async def wait_for_future() -> None:
+    future = asyncio.get_running_loop().create_future()
+    asyncio.get_running_loop().call_soon(future.set_result, None)
+    await asyncio.wait_for(future, TIMEOUT_S)
+
+
+async def deadline_future() -> None:
+    future = asyncio.get_running_loop().create_future()
+    asyncio.get_running_loop().call_soon(future.set_result, None)
+    await wait_future(future, TIMEOUT_S)
+
+
+async def measure(requests: int) -> dict[str, tuple[float, float]]:
+    client, upstream = make_protocol(HTTPRequestProtocol), make_protocol(HTTPResponseProtocol)
+    client_deadline, upstream_deadline = Deadline(), Deadline()
+    cases = {
+        'client read': (
+            lambda: wait_for_read(client, REQUEST),
+            lambda: deadline_read(client, REQUEST, client_deadline),
+        ),
+        'upstream read': (
+            lambda: wait_for_read(upstream, RESPONSE),
+            lambda: deadline_read(upstream, RESPONSE, upstream_deadline),
+        ),
+        'pool wait': (wait_for_future, deadline_future),
+    }
+    results = {}
+    for name, (legacy, current) in cases.items():
+        timings = []
+        for operation in (legacy, current):
+            start = time.process_time()
+            for _ in range(requests):
+                await operation()
+            timings.append((time.process_time() - start) / requests)
+        results[name] = (timings[0], timings[1])
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+
+    results = asyncio.run(measure(args.requests))
+    print(f'{"":>14}  {"wait_for":>10}  {"deadline":>10}')
+    for name, (legacy, current) in results.items():
+        print(f'{name:>14}: {legacy * 1e6:7.2f} us  {current * 1e6:7.2f} us')
+    legacy_total = sum(legacy for legacy, _ in results.values())
+    current_total = sum(current for _, current in results.values())
+    print(f'{"per request":>14}: {legacy_total * 1e6:7.2f} us  {current_total * 1e6:7.2f} us  '
+          f'(-{(1 - current_total / legacy_total) * 100:.0f}% CPU)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Генератор нагрузки с открытой моделью: запросы отправляются с постоянной частотой rate,
+не дожидаясь ответов на предыдущие.
+
+Задержка считается от запланированного момента отправки, а не от фактического, так что очередь
+на стороне генератора (нет свободного соединения, event loop не успевает) попадает в задержку
+и не прячет медленные ответы (поправка на coordinated omission).
+С keep_alive запрос берет свободное соединение или открывает новое, пока их меньше max_connections,
+без keep_alive на каждый запрос открывается новое соединение.
+
+    python bench/loadgen.py --port 8080 --rate 2000 --seconds 10 [--no-keep-alive]
+"""
+import argparse
+import asyncio
+import json
+from array import array
+from collections import Counter
+
+
+def percentile(ordered: array, ratio: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+class OpenLoopGenerator:
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            rate: float,
+            seconds: float,
+            keep_alive: bool = True,
+            path: str = '/bench',
+            max_connections: int = 1000,
+            timeout_s: float = 10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.seconds = seconds
+        self.keep_alive = keep_alive
+        self.max_connections = max_connections
+        self.timeout_s = timeout_s
+        connection = b'keep-alive' if keep_alive else b'close'
+        self.request = b'GET %s HTTP/1.1\r\nHost: bench\r\nConnection: %s\r\n\r\n' % (path.encode(), connection)
+        self.idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.connections = 0
+        self.connection_freed: asyncio.Event | None = None
+        self.latencies = array('d')
+        self.statuses: Counter[str] = Counter()
+        self.max_send_lag_s = 0.0
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        self.connection_freed = asyncio.Event()
+        tasks = set()
+        total = int(self.rate * self.seconds)
+        started_at = loop.time()
+        for index in range(total):
+            intended_at = started_at + index / self.rate
+            delay_s = intended_at - loop.time()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            else:
+                self.max_send_lag_s = max(self.max_send_lag_s, -delay_s)
+            task = asyncio.create_task(self.send(intended_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        elapsed_s = loop.time() - started_at
+        for _, writer in self.idle:
+            writer.close()
+        return self.summary(elapsed_s)
+
+    def summary(self, elapsed_s: float) -> dict:
+        ordered = array('d', sorted(self.latencies))
+        return {
+            'rate': self.rate,
+            'requests': sum(self.statuses.values()),
+            'rps': round(len(ordered) / elapsed_s, 1),
+            'p50_ms': round(percentile(ordered, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+            'p999_ms': round(percentile(ordered, 0.999) * 1000, 3),
+            'max_ms': round((ordered[-1] if ordered else 0) * 1000, 3),
+            'statuses': dict(self.statuses),
+            'max_send_lag_ms': round(self.max_send_lag_s * 1000, 3),
+        }
+
+    async def send(self, intended_at: float) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            status = await asyncio.wait_for(self.exchange(), self.timeout_s)
+        except TimeoutError:
+            status = 'timeout'
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status = 'error'
+        self.statuses[status] += 1
+        if status == '200':
+            self.latencies.append(loop.time() - intended_at)
+
+    async def exchange(self) -> str:
+        reader, writer = await self.get_connection()
+        reusable = False
+        try:
+            writer.write(self.request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = head[9:12].decode()
+            content_length, close = 0, not self.keep_alive
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name == b'content-length':
+                    content_length = int(value)
+                elif name == b'connection' and value.strip().lower() == b'close':
+                    close = True
+            await reader.readexactly(content_length)
+            reusable = not close
+            return status
+        finally:
+            self.put_connection(reader, writer, reusable)
+
+    async def get_connection(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        while True:
+            if self.keep_alive and self.idle:
+                return self.idle.pop()
+            if self.connections < self.max_connections:
+                self.connections += 1
+                try:
+                    return await asyncio.open_connection(self.host, self.port)
+                except BaseException:
+                    self.connections -= 1
+                    self.connection_freed.set()
+                    raise
+            self.connection_freed.clear()
+            await self.connection_freed.wait()
+
+    def put_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reusable: bool) -> None:
+        if reusable:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+            self.connections -= 1
+        self.connection_freed.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false')
+    parser.add_argument('--path', default='/bench')
+    parser.add_argument('--max-connections', type=int, default=1000)
+    args = parser.parse_args()
+
+    generator = OpenLoopGenerator(
+        args.host, args.port, args.rate, args.seconds, args.keep_alive, args.path, args.max_connections
+    )
+    print(json.dumps(asyncio.run(generator.run()), indent=2))
+
+
+if __name__ == '__main__':
+    main()
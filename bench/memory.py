@@ -0,0 +1,147 @@
+"""
+Память прокси на простаивающее keep-alive соединение.
+
+Поднимает апстрим-заглушку и прокси отдельными процессами, открывает --connections клиентских соединений,
+на каждом делает один запрос и оставляет соединение открытым. RSS прокси меряется до и после,
+разница делится на число соединений.
+
+    python bench/memory.py [--connections 100000]
+
+Каждое соединение занимает дескриптор и в бенчмарке, и в прокси: мягкий лимит RLIMIT_NOFILE поднимается
+до жесткого, для 100k соединений жесткий лимит должен быть больше (ulimit -Hn). Адресов источника
+берется несколько (127.0.0.x), чтобы не упереться в диапазон эфемерных портов.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+import yaml
+
+from stub_upstream import run_upstream
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+UPSTREAM_PORT = 9301
+PROXY_PORT = 9300
+CONNECTIONS_PER_SOURCE = 20000
+BATCH = 100
+REQUEST = b'GET /idle HTTP/1.1\r\nHost: bench\r\n\r\n'
+
+
+def start_proxy(connections: int) -> tuple[subprocess.Popen, str]:
+    config = {
+        'listen': f'127.0.0.1:{PROXY_PORT}',
+        'upstreams': [{'host': '127.0.0.1', 'port': UPSTREAM_PORT}],
+        # Соединения простаивают весь замер: таймауты сессии и keep-alive больше его длительности.
+        'timeouts': {
+            'connect_ms': 2000, 'read_ms': 10000, 'write_ms': 10000, 'total_ms': 3600000, 'keepalive_ms': 3600000
+        },
+        'limits': {'max_client_conns': connections + 100, 'max_conns_per_upstream': 50},
+        'pool': {'min_idle': 1},
+        'logging': {'level': 'warning', 'access_log': False},
+    }
+    fd, path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'proxy', 'main.py'), path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, path
+
+
+def wait_port(port: int, timeout_s: float = 30) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'port {port} is not listening')
+
+
+def read_response(sock: socket.socket) -> None:
+    response = b''
+    while b'\r\n\r\n' not in response:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError('proxy closed connection')
+        response += data
+
+
+def open_idle_connections(count: int) -> list[socket.socket]:
+    """Соединения открываются пачками: сначала connect и запрос на всей пачке, потом чтение ответов."""
+    sockets = []
+    for batch_start in range(0, count, BATCH):
+        batch = []
+        for index in range(batch_start, min(batch_start + BATCH, count)):
+            sock = socket.socket()
+            sock.bind((f'127.0.0.{2 + index // CONNECTIONS_PER_SOURCE}', 0))
+            sock.connect(('127.0.0.1', PROXY_PORT))
+            sock.sendall(REQUEST)
+            batch.append(sock)
+        for sock in batch:
+            read_response(sock)
+        sockets.extend(batch)
+    return sockets
+
+
+def raise_fd_limit(connections: int) -> None:
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < connections + 1000:
+        raise SystemExit(f'RLIMIT_NOFILE hard limit {hard} is too low for {connections} connections')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--settle', type=float, default=2.0, help='пауза перед замером RSS, секунд')
+    args = parser.parse_args()
+    raise_fd_limit(args.connections)
+
+    upstream = multiprocessing.Process(target=run_upstream, args=(UPSTREAM_PORT,), daemon=True)
+    upstream.start()
+    wait_port(UPSTREAM_PORT)
+    proxy, config_path = start_proxy(args.connections)
+    try:
+        wait_port(PROXY_PORT)
+        # Первый запрос прогревает пул и ленивые структуры прокси, они не относятся к соединениям.
+        warmup = socket.create_connection(('127.0.0.1', PROXY_PORT))
+        warmup.sendall(REQUEST)
+        read_response(warmup)
+        warmup.close()
+        time.sleep(args.settle)
+        process = psutil.Process(proxy.pid)
+        rss_before = process.memory_info().rss
+
+        started_at = time.perf_counter()
+        sockets = open_idle_connections(args.connections)
+        opened_s = time.perf_counter() - started_at
+        time.sleep(args.settle)
+        rss_after = process.memory_info().rss
+
+        print(f'connections:     {len(sockets)} (opened in {opened_s:.1f}s)')
+        print(f'rss before:      {rss_before / 2 ** 20:.1f} MB')
+        print(f'rss after:       {rss_after / 2 ** 20:.1f} MB')
+        print(f'rss/connection:  {(rss_after - rss_before) / len(sockets):.0f} B')
+        for sock in sockets:
+            sock.close()
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        os.remove(config_path)
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Микробенчмарк разбора HTTP запросов: стоимость на один запрос для инкрементального
+парсера (HTTPRequestParser) и для прежнего пайплайна StreamReader.readuntil.
+
+    python bench/parser.py --requests 20000 --body-size 128
+"""
+import argparse
+import asyncio
+import http
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
+
+from http_utils.http_reader import HTTPRequestParser  # noqa: E402
+
+
+class LegacyRequestReader:
+    """Прежний BaseHTTPReader + BaseHTTPIterator: readuntil, словарь заголовков, чанки по 512 байт, wait_for."""
+
+    def __init__(self, reader: asyncio.StreamReader, read_timeout_s: float = 5):
+        self.reader = reader
+        self.read_timeout = read_timeout_s
+        self.http_iterator = self._chunk_iterator()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.reader.at_eof():
+            raise StopAsyncIteration
+        return await asyncio.wait_for(anext(self.http_iterator), self.read_timeout)
+
+    async def _chunk_iterator(self):
+        while True:
+            start_line = await self.reader.readuntil(b'\r\n')
+            method, path, version = start_line[:-2].split(b' ')
+            if http.HTTPMethod(method.decode()) not in http.HTTPMethod:
+                raise ValueError(method)
+            headers = await self.reader.readuntil(b'\r\n\r\n')
+            yield start_line + headers, True, False
+            parsed = {}
+            for header_line in headers[:-4].split(b'\r\n'):
+                name, value = header_line.split(b':', 1)
+                parsed[name.lower()] = value.strip()
+            if content_length := int(parsed.get(b'content-length', 0)):
+                bytes_read = 0
+                while bytes_read < content_length:
+                    to_read = min(512, content_length - bytes_read)
+                    chunk = await self.reader.readexactly(to_read)
+                    bytes_read += to_read
+                    yield chunk, False, bytes_read == content_length
+            else:
+                yield b'', False, True
+
+
+def build_request(body_size: int) -> bytes:
+    body = b'x' * body_size
+    return (
+        b'POST /events HTTP/1.1\r\n'
+        b'Host: localhost:8080\r\n'
+        b'User-Agent: k6/0.50.0 (https://k6.io/)\r\n'
+        b'Content-Type: application/json\r\n'
+        b'Accept-Encoding: gzip\r\n'
+        b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body
+    )
+
+
+def packets(data: bytes, size: int) -> list[bytes]:
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+async def bench_legacy(stream: list[bytes], requests: int) -> float:
+    reader = asyncio.StreamReader(limit=2 ** 32)
+    for packet in stream:
+        reader.feed_data(packet)
+    reader.feed_eof()
+    messages = 0
+    start = time.perf_counter()
+    try:
+        async for _, _, is_message_end in LegacyRequestReader(reader):
+            messages += is_message_end
+    except asyncio.IncompleteReadError:
+        pass
+    elapsed = time.perf_counter() - start
+    assert messages == requests, messages
+    return elapsed
+
+
+def bench_parser(stream: list[bytes], requests: int) -> float:
+    parser = HTTPRequestParser()
+    messages = 0
+    start = time.perf_counter()
+    for packet in stream:
+        for chunk in parser.feed(packet):
+            messages += chunk.is_message_end
+    elapsed = time.perf_counter() - start
+    assert messages == requests, messages
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--body-size', type=int, default=128)
+    parser.add_argument('--packet-size', type=int, default=16 * 1024, help='размер порции из data_received')
+    args = parser.parse_args()
+
+    stream = packets(build_request(args.body_size) * args.requests, args.packet_size)
+    legacy = asyncio.run(bench_legacy(stream, args.requests))
+    parser_time = bench_parser(stream, args.requests)
+
+    print(f'requests={args.requests} body={args.body_size}B packet={args.packet_size}B')
+    print(f'legacy readuntil pipeline: {legacy / args.requests * 1e6:8.2f} us/request')
+    print(f'incremental parser:        {parser_time / args.requests * 1e6:8.2f} us/request')
+
+
+if __name__ == '__main__':
+    main()
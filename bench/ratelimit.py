@@ -0,0 +1,78 @@
+"""
+Микробенчмарк rate limiter: стоимость проверки запроса и память на клиента.
+
+Сценарии: один активный клиент, клиенты по закону Ципфа (несколько тяжелых и длинный хвост)
+и поток уникальных адресов, переполняющий таблицу (каждая проверка - вставка с вытеснением).
+
+    python bench/ratelimit.py [--requests 1000000] [--clients 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
+
+from ratelimit import RateLimiter  # noqa: E402
+
+SHARDS = 64
+
+
+def make_limiter(max_keys: int) -> RateLimiter:
+    return RateLimiter(rate=100, burst=200, max_keys=max_keys, shards=SHARDS)
+
+
+def measure(limiter: RateLimiter, keys: list[str]) -> float:
+    """Среднее время acquire в микросекундах, время запроса растет на 10 мкс за шаг, как при потоке запросов."""
+    acquire = limiter.acquire
+    start = time.perf_counter()
+    now = 0.0
+    for key in keys:
+        now += 0.00001
+        acquire(key, now)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def random_ips(count: int) -> list[str]:
+    return [f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}' for n in random.sample(range(1 << 24), count)]
+
+
+def memory_per_key(clients: int) -> float:
+    keys = random_ips(clients)
+    tracemalloc.start()
+    limiter = make_limiter(clients)
+    for index, key in enumerate(keys):
+        limiter.acquire(key, index * 0.00001)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Сами строки адресов созданы до замера, считается только таблица.
+    return used / len(limiter)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1_000_000)
+    parser.add_argument('--clients', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    hot = ['10.0.0.1'] * args.requests
+    population = random_ips(min(args.clients, 100_000))
+    weights = [1 / rank for rank in range(1, len(population) + 1)]
+    zipf = random.choices(population, weights, k=args.requests)
+    unique = random_ips(args.requests)
+
+    results = {
+        'one client': measure(make_limiter(args.clients), hot),
+        'zipf clients': measure(make_limiter(args.clients), zipf),
+        # Таблица в 10 раз меньше потока адресов: почти каждая проверка вытесняет чужой бакет.
+        'unique, evicting': measure(make_limiter(args.requests // 10), unique),
+    }
+    for name, us in results.items():
+        print(f'{name:>18}: {us:6.2f} us/request')
+    print(f'{"memory":>18}: {memory_per_key(args.clients):6.0f} bytes/client')
+
+
+if __name__ == '__main__':
+    main()
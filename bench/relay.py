@@ -0,0 +1,242 @@
+"""
+Бенчмарк пересылки тел запросов и ответов через прокси: прежний путь, потоковый режим и splice.
+
+Поднимает эхо-апстрим и прокси отдельными процессами, шлет POST с телами 1 KB, 1 MB и 100 MB
+и меряет пропускную способность (апстрим возвращает тело целиком, так что оно проходит прокси дважды).
+legacy - прежний путь пересылки (LegacyRelay): StreamReader, тело по 512 байт через readexactly,
+wait_for на каждое чтение и drain на каждую запись; stream и splice - прокси из proxy/main.py.
+
+    python bench/relay.py [--sizes 1024 1048576 104857600]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+UPSTREAM_PORT = 9301
+PROXY_PORT = 9300
+
+
+class EchoUpstreamProtocol(asyncio.Protocol):
+    """Возвращает тело запроса по мере поступления, не накапливая его в памяти."""
+
+    def __init__(self):
+        self.buffer = b''
+        self.body_left = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        while data:
+            if self.body_left:
+                part, data = data[:self.body_left], data[self.body_left:]
+                self.body_left -= len(part)
+                self.transport.write(part)
+                continue
+            self.buffer += data
+            head_end = self.buffer.find(b'\r\n\r\n')
+            if head_end == -1:
+                return
+            head, data, self.buffer = self.buffer[:head_end], self.buffer[head_end + 4:], b''
+            content_length = 0
+            for line in head.split(b'\r\n')[1:]:
+                name, value = line.split(b':', 1)
+                if name.strip().lower() == b'content-length':
+                    content_length = int(value)
+            self.body_left = content_length
+            self.transport.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % content_length)
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+
+def run_upstream(port: int) -> None:
+    async def serve():
+        server = await asyncio.get_running_loop().create_server(EchoUpstreamProtocol, '127.0.0.1', port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+class LegacyRelay:
+    """
+    Прежний путь пересылки тел (BaseHTTPReader + BaseConnection.write до окон и splice): заголовки через readuntil,
+    тело через readexactly по 512 байт, каждый кусок пишется отдельно с drain. Одно соединение к апстриму
+    на клиентское соединение, запрос и ответ пересылаются параллельно, как в proxy_client и upstream_to_client.
+    """
+    CHUNK_SIZE = 512
+    TIMEOUT_S = 30
+
+    def __init__(self, upstream_port: int):
+        self.upstream_port = upstream_port
+
+    async def read_messages(self, reader: asyncio.StreamReader):
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.TIMEOUT_S)
+            except asyncio.IncompleteReadError:
+                return
+            yield head
+            headers = {}
+            for line in head[:-4].split(b'\r\n')[1:]:
+                name, value = line.split(b':', 1)
+                headers[name.lower()] = value.strip()
+            content_length, bytes_read = int(headers.get(b'content-length', 0)), 0
+            while bytes_read < content_length:
+                to_read = min(self.CHUNK_SIZE, content_length - bytes_read)
+                yield await asyncio.wait_for(reader.readexactly(to_read), self.TIMEOUT_S)
+                bytes_read += to_read
+
+    async def relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            async for chunk in self.read_messages(reader):
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), self.TIMEOUT_S)
+        finally:
+            # Одна сторона закрылась: закрываем другую, чтобы встречная пересылка тоже завершилась.
+            writer.close()
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', self.upstream_port)
+        try:
+            await asyncio.gather(
+                self.relay(client_reader, upstream_writer), self.relay(upstream_reader, client_writer)
+            )
+        except (ConnectionError, asyncio.IncompleteReadError, TimeoutError):
+            pass
+
+    async def serve(self, port: int) -> None:
+        server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+        await server.serve_forever()
+
+
+def run_legacy_relay(port: int, upstream_port: int) -> None:
+    asyncio.run(LegacyRelay(upstream_port).serve(port))
+
+
+def start_legacy_relay() -> multiprocessing.Process:
+    process = multiprocessing.Process(target=run_legacy_relay, args=(PROXY_PORT, UPSTREAM_PORT), daemon=True)
+    process.start()
+    wait_port(PROXY_PORT)
+    return process
+
+
+def start_proxy(splice_threshold: int) -> tuple[subprocess.Popen, str]:
+    config = {
+        'listen': f'127.0.0.1:{PROXY_PORT}',
+        'upstreams': [{'host': '127.0.0.1', 'port': UPSTREAM_PORT}],
+        'timeouts': {'connect_ms': 2000, 'read_ms': 30000, 'write_ms': 30000, 'total_ms': 600000},
+        'limits': {'max_client_conns': 100, 'max_conns_per_upstream': 4},
+        'relay': {'splice_threshold_bytes': splice_threshold},
+    }
+    fd, path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'proxy', 'main.py'), path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    wait_port(PROXY_PORT)
+    return process, path
+
+
+def wait_port(port: int, timeout_s: float = 30) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'port {port} is not listening')
+
+
+def post(sock: socket.socket, size: int) -> None:
+    payload = b'x' * min(size, 1024 * 1024)
+
+    def send_body():
+        sock.sendall(b'POST /relay HTTP/1.1\r\nHost: bench\r\nContent-Length: %d\r\n\r\n' % size)
+        left = size
+        while left:
+            sent = sock.send(payload[:left])
+            left -= sent
+
+    sender = threading.Thread(target=send_body)
+    sender.start()
+    head = b''
+    while b'\r\n\r\n' not in head:
+        head += sock.recv(65536)
+    head, body = head.split(b'\r\n\r\n', 1)
+    left = size - len(body)
+    buffer = bytearray(1024 * 1024)
+    while left:
+        received = sock.recv_into(buffer, min(left, len(buffer)))
+        if not received:
+            raise ConnectionError('proxy closed connection')
+        left -= received
+    sender.join()
+
+
+def measure(size: int, seconds: float) -> tuple[int, float]:
+    sock = socket.create_connection(('127.0.0.1', PROXY_PORT))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    post(sock, size)
+    requests, start = 0, time.perf_counter()
+    while not requests or time.perf_counter() - start < seconds:
+        post(sock, size)
+        requests += 1
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return requests, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 1024 * 1024, 100 * 1024 * 1024])
+    parser.add_argument('--seconds', type=float, default=3.0, help='длительность замера на каждый размер')
+    args = parser.parse_args()
+
+    upstream = multiprocessing.Process(target=run_upstream, args=(UPSTREAM_PORT,), daemon=True)
+    upstream.start()
+    wait_port(UPSTREAM_PORT)
+
+    modes = [('legacy', None), ('stream', 0), ('splice', 256 * 1024)]
+    try:
+        for mode, threshold in modes:
+            if threshold is None:
+                proxy, config_path = start_legacy_relay(), None
+            else:
+                proxy, config_path = start_proxy(threshold)
+            try:
+                for size in args.sizes:
+                    requests, elapsed = measure(size, args.seconds)
+                    mb_per_s = requests * size * 2 / elapsed / 2 ** 20
+                    print(f'{mode:>6} size={size:>10}B  {requests / elapsed:9.1f} req/s  {mb_per_s:9.1f} MB/s')
+            finally:
+                proxy.terminate()
+                if config_path is None:
+                    proxy.join()
+                else:
+                    proxy.wait()
+                    os.remove(config_path)
+    finally:
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
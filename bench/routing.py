@@ -0,0 +1,122 @@
+"""
+Микробенчмарк выбора группы апстримов (Router.route) в зависимости от числа маршрутов.
+
+Маршруты: точные Host, "*.example.com", префиксы пути без Host и несколько регулярных выражений.
+Запросы попадают в точный Host, в поддомен, в префикс и мимо всех маршрутов (в группу default).
+Для сравнения тот же набор проверяется линейным перебором маршрутов по порядку.
+
+    python bench/routing.py [--routes 10 1000 10000] [--lookups 200000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
+
+from config import RouteConfig  # noqa: E402
+from http_utils.http_reader import HTTPMessageHead, HTTPRequestParser  # noqa: E402
+from routing import Router  # noqa: E402
+
+REGEX_ROUTES = 5
+
+
+def make_routes(count: int) -> list[RouteConfig]:
+    routes = []
+    for index in range(count):
+        group = f'group{index % 16}'
+        kind = index % 3
+        if kind == 0:
+            routes.append(RouteConfig(group=group, host=f'host{index}.example.com'))
+        elif kind == 1:
+            routes.append(RouteConfig(group=group, host=f'*.zone{index}.example.net', path_prefix='/api'))
+        else:
+            routes.append(RouteConfig(group=group, path_prefix=f'/service{index}/v1'))
+    for index in range(REGEX_ROUTES):
+        routes.append(RouteConfig(group='regex', path_regex=f'^/items{index}/[0-9]+$'))
+    return routes
+
+
+def make_heads(count: int, routes: int) -> list[HTTPMessageHead]:
+    """Запросы в случайные маршруты и мимо них, разобранные тем же парсером, что и в прокси."""
+    requests = []
+    for _ in range(count):
+        index = random.randrange(routes)
+        kind = random.randrange(4)
+        if kind == 0:
+            host, path = f'host{index - index % 3}.example.com', '/anything?x=1'
+        elif kind == 1:
+            host, path = f'a.b.zone{index - index % 3 + 1}.example.net:8080', '/api/users/42'
+        elif kind == 2:
+            host, path = 'unknown.org', f'/service{index - index % 3 + 2}/v1/orders/7'
+        else:
+            host, path = 'unknown.org', '/static/app.js'
+        requests.append(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: bench\r\n\r\n'.encode())
+    parser = HTTPRequestParser()
+    return [chunk.head for chunk in parser.feed(b''.join(requests))]
+
+
+class LinearRouter:
+    """Маршруты по порядку, как при проверке каждого location подряд."""
+
+    def __init__(self, routes: list[RouteConfig]):
+        self.routes = [
+            (
+                route.host.lower().encode() if route.host else None,
+                route.path_prefix.encode() if route.path_prefix else None,
+                re.compile(route.path_regex.encode()) if route.path_regex else None,
+                route.group,
+            )
+            for route in routes
+        ]
+
+    def route(self, head: HTTPMessageHead) -> str | None:
+        path = head.path.partition(b'?')[0]
+        host = Router.normalize_host(head.get_header(b'host') or b'')
+        for route_host, prefix, regex, group in self.routes:
+            if route_host is not None:
+                if route_host.startswith(b'*.') and not host.endswith(route_host[1:]):
+                    continue
+                if not route_host.startswith(b'*.') and host != route_host:
+                    continue
+            if prefix is not None and not path.startswith(prefix):
+                continue
+            if regex is not None and not regex.search(path):
+                continue
+            return group
+        return 'default'
+
+
+def measure(router, heads: list[HTTPMessageHead]) -> float:
+    """Среднее время выбора группы в микросекундах."""
+    route = router.route
+    start = time.perf_counter()
+    for head in heads:
+        route(head)
+    return (time.perf_counter() - start) / len(heads) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--lookups', type=int, default=200_000)
+    args = parser.parse_args()
+
+    for count in args.routes:
+        routes = make_routes(count)
+        heads = make_heads(args.lookups, count)
+        start = time.perf_counter()
+        router = Router(routes, 'default')
+        compile_ms = (time.perf_counter() - start) * 1000
+        # Линейный перебор на больших таблицах медленный, ему хватает меньшей выборки.
+        linear_heads = heads[:max(1000, args.lookups * 10 // count)]
+        print(
+            f'{count:>6} routes: index {measure(router, heads):6.2f} us/lookup (compile {compile_ms:.1f} ms), '
+            f'linear {measure(LinearRouter(routes), linear_heads):8.2f} us/lookup'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Быстрый апстрим-заглушка для бенчмарков: asyncio.Protocol на сыром сокете вместо ThreadingHTTPServer.
+
+На каждый запрос отвечает 200 с телом body_bytes через задержку из распределения --latency (в миллисекундах):
+    fixed:MS, uniform:MIN:MAX, exp:MEAN, lognormal:MEDIAN:SIGMA, bimodal:FAST:SLOW:SLOW_RATIO
+
+Тело запроса пропускается по Content-Length, ответы на одном соединении уходят в порядке запросов.
+
+    python bench/stub_upstream.py --port 9301 --latency exp:5 --body-bytes 1024
+"""
+import argparse
+import asyncio
+import math
+import random
+from typing import Callable
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Генератор задержек в секундах по описанию распределения."""
+    kind, *params = spec.split(':')
+    values = [float(param) / 1000 for param in params]
+    if kind == 'fixed':
+        delay_s, = values
+        return lambda: delay_s
+    if kind == 'uniform':
+        low_s, high_s = values
+        return lambda: random.uniform(low_s, high_s)
+    if kind == 'exp':
+        mean_s, = values
+        return lambda: random.expovariate(1 / mean_s) if mean_s else 0.0
+    if kind == 'lognormal':
+        median_s, sigma = values[0], float(params[1])
+        return lambda: random.lognormvariate(math.log(median_s), sigma)
+    if kind == 'bimodal':
+        fast_s, slow_s, slow_ratio = values[0], values[1], float(params[2])
+        return lambda: slow_s if random.random() < slow_ratio else fast_s
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+class StubUpstreamProtocol(asyncio.Protocol):
+    def __init__(self, response: bytes, latency: Callable[[], float]):
+        self.response = response
+        # Ответ на HEAD - только заголовки, иначе тело рассинхронизирует соединение пула прокси.
+        self.head_response = response[:response.index(b'\r\n\r\n') + 4]
+        self.latency = latency
+        self.buffer = b''
+        self.body_left = 0
+        self.last_response_at = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        loop = asyncio.get_running_loop()
+        while data:
+            if self.body_left:
+                skipped = min(self.body_left, len(data))
+                self.body_left -= skipped
+                data = data[skipped:]
+                continue
+            self.buffer += data
+            head_end = self.buffer.find(b'\r\n\r\n')
+            if head_end == -1:
+                return
+            head, data, self.buffer = self.buffer[:head_end], self.buffer[head_end + 4:], b''
+            self.body_left = self.get_content_length(head)
+            response = self.head_response if head.startswith(b'HEAD ') else self.response
+
+            delay_s = self.latency()
+            if delay_s <= 0 and self.last_response_at <= loop.time():
+                self.transport.write(response)
+                continue
+            # Следующий ответ не раньше предыдущего, иначе ответы на соединении перепутаются.
+            self.last_response_at = max(self.last_response_at, loop.time() + delay_s)
+            loop.call_at(self.last_response_at, self.respond, response)
+
+    def respond(self, response: bytes):
+        if not self.transport.is_closing():
+            self.transport.write(response)
+
+    @staticmethod
+    def get_content_length(head: bytes) -> int:
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                return int(value)
+        return 0
+
+
+def make_response(body_bytes: int) -> bytes:
+    return b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % body_bytes + b'x' * body_bytes
+
+
+def run_upstream(port: int, latency: str = 'fixed:0', body_bytes: int = 2) -> None:
+    async def serve():
+        response, latency_fn = make_response(body_bytes), parse_latency(latency)
+        server = await asyncio.get_running_loop().create_server(
+            lambda: StubUpstreamProtocol(response, latency_fn), '127.0.0.1', port, backlog=4096
+        )
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9301)
+    parser.add_argument('--latency', default='fixed:0')
+    parser.add_argument('--body-bytes', type=int, default=2)
+    args = parser.parse_args()
+    run_upstream(args.port, args.latency, args.body_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Воспроизводимый набор сценариев нагрузки на одной машине, без k6 и tests/echo.py.
+
+Для каждого сценария поднимает апстримы-заглушки (bench/stub_upstream.py) и прокси отдельными процессами
+и гоняет открытую нагрузку bench/loadgen.py с постоянной частотой. Результат - JSON с RPS, p50/p99/p999
+(с поправкой на coordinated omission) и CPU прокси на запрос. С --baseline результат сравнивается
+с сохраненным прогоном, при ухудшении больше --tolerance процесс завершается с кодом 1.
+
+    python bench/suite.py --output bench/results.json
+    python bench/suite.py --baseline bench/results.json [--scenarios keepalive_small overload]
+
+Генератор однопоточный: если max_send_lag_ms в результате заметно больше нуля, упирается он, а не прокси.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+import psutil
+import yaml
+
+from loadgen import OpenLoopGenerator
+from stub_upstream import run_upstream
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROXY_PORT = 9300
+UPSTREAM_PORTS = (9301, 9302)
+
+
+@dataclass
+class Scenario:
+    rate: float
+    keep_alive: bool = True
+    body_bytes: int = 2
+    latency: str = 'fixed:0'
+    proxy: dict = field(default_factory=dict)
+
+
+SCENARIOS = {
+    'keepalive_small': Scenario(rate=2000),
+    'new_connection_small': Scenario(rate=1000, keep_alive=False),
+    'keepalive_large': Scenario(rate=200, body_bytes=1024 * 1024),
+    'slow_upstream': Scenario(rate=1000, latency='lognormal:50:0.5'),
+    # Частота выше лимита admission: лишние запросы должны получать быстрые 503, а не таймауты.
+    'overload': Scenario(
+        rate=4000,
+        latency='fixed:20',
+        proxy={'admission': {'max_requests': 50, 'max_queue': 50, 'queue_timeout_ms': 50}},
+    ),
+}
+
+# Для какой метрики рост - ухудшение.
+LOWER_IS_BETTER = {'p50_ms': True, 'p99_ms': True, 'p999_ms': True, 'cpu_ms_per_request': True, 'rps': False}
+
+
+def start_proxy(scenario: Scenario, workers: int) -> tuple[subprocess.Popen, str]:
+    config = {
+        'listen': f'127.0.0.1:{PROXY_PORT}',
+        'upstreams': [{'host': '127.0.0.1', 'port': port} for port in UPSTREAM_PORTS],
+        'timeouts': {'connect_ms': 2000, 'read_ms': 10000, 'write_ms': 10000, 'total_ms': 600000},
+        'limits': {'max_client_conns': 10000, 'max_conns_per_upstream': 500},
+        'workers': workers,
+        'logging': {'level': 'warning', 'access_log': False},
+        **scenario.proxy,
+    }
+    fd, path = tempfile.mkstemp(suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(config, f)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'proxy', 'main.py'), path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, path
+
+
+async def wait_port(port: int, timeout_s: float = 30) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'port {port} is not listening')
+
+
+def cpu_seconds(process: psutil.Process) -> float:
+    """CPU прокси вместе с воркерами."""
+    total = 0.0
+    for member in (process, *process.children(recursive=True)):
+        try:
+            times = member.cpu_times()
+        except psutil.NoSuchProcess:
+            continue
+        total += times.user + times.system
+    return total
+
+
+async def measure(scenario: Scenario, proxy: psutil.Process, seconds: float, warmup_s: float) -> dict:
+    for port in (PROXY_PORT, *UPSTREAM_PORTS):
+        await wait_port(port)
+    if warmup_s:
+        await OpenLoopGenerator('127.0.0.1', PROXY_PORT, scenario.rate / 2, warmup_s, scenario.keep_alive).run()
+
+    cpu_before = cpu_seconds(proxy)
+    result = await OpenLoopGenerator('127.0.0.1', PROXY_PORT, scenario.rate, seconds, scenario.keep_alive).run()
+    cpu_used = cpu_seconds(proxy) - cpu_before
+    result['cpu_ms_per_request'] = round(cpu_used * 1000 / max(result['requests'], 1), 4)
+    return result
+
+
+def run_scenario(scenario: Scenario, seconds: float, warmup_s: float, workers: int) -> dict:
+    upstreams = [
+        multiprocessing.Process(target=run_upstream, args=(port, scenario.latency, scenario.body_bytes), daemon=True)
+        for port in UPSTREAM_PORTS
+    ]
+    for upstream in upstreams:
+        upstream.start()
+    proxy, config_path = start_proxy(scenario, workers)
+    try:
+        return asyncio.run(measure(scenario, psutil.Process(proxy.pid), seconds, warmup_s))
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        os.remove(config_path)
+        for upstream in upstreams:
+            upstream.terminate()
+            upstream.join()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Печатает изменения относительно baseline, возвращает False, если есть ухудшение больше tolerance."""
+    ok = True
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for metric, lower_is_better in LOWER_IS_BETTER.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regression = change > tolerance if lower_is_better else change < -tolerance
+            ok = ok and not regression
+            mark = '  REGRESSION' if regression else ''
+            print(f'{name:>22} {metric:>18}: {old:>10} -> {new:>10} ({change * 100:+.1f}%){mark}')
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--rate-scale', type=float, default=1.0, help='множитель частоты для всех сценариев')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', help='куда сохранить JSON результата')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workers': args.workers,
+            'seconds': args.seconds,
+            'rate_scale': args.rate_scale,
+        },
+        'scenarios': {},
+    }
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        scenario.rate *= args.rate_scale
+        results['scenarios'][name] = run_scenario(scenario, args.seconds, args.warmup, args.workers)
+        print(f'{name}: {json.dumps(results["scenarios"][name])}', file=sys.stderr)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
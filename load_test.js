@@ -1,16 +1,39 @@
 import http from "k6/http";
+import { check } from "k6";
+
+// SCENARIO=overload разгоняет поток выше пропускной способности прокси:
+// с admission отказы сверх лимита приходят сразу как 503, а число успешных ответов в секунду не падает.
+const SCENARIOS = {
+  high_rps: {
+    executor: "constant-arrival-rate",
+    rate: 5000,
+    timeUnit: "1s",
+    duration: "45s",
+    preAllocatedVUs: 100,
+    maxVUs: 1500,
+  },
+  overload: {
+    executor: "ramping-arrival-rate",
+    startRate: 1000,
+    timeUnit: "1s",
+    preAllocatedVUs: 200,
+    maxVUs: 3000,
+    stages: [
+      { target: 4000, duration: "20s" },
+      { target: 8000, duration: "20s" },
+      { target: 8000, duration: "20s" },
+    ],
+  },
+};
+
+const SCENARIO = __ENV.SCENARIO || "high_rps";
 
 export const options = {
   noVUConnectionReuse: false,
-  scenarios: {
-    high_rps: {
-      executor: "constant-arrival-rate",
-      rate: 5000,
-      timeUnit: "1s",
-      duration: "45s",
-      preAllocatedVUs: 100,
-      maxVUs: 1500,
-    },
+  scenarios: { [SCENARIO]: SCENARIOS[SCENARIO] },
+  thresholds: {
+    // Отказ при перегрузке должен быть быстрым, а не таймаутом.
+    "http_req_duration{status:503}": ["p(99)<100"],
   },
 };
 
@@ -26,7 +49,11 @@ const payload = JSON.stringify({
 });
 
 export default function () {
-  http.post(URL, payload, {
+  const res = http.post(URL, payload, {
     headers: { "Content-Type": "application/json" },
   });
+  check(res, {
+    ok: (r) => r.status === 200,
+    shed: (r) => r.status === 503 && r.headers["Retry-After"] !== undefined,
+  });
 }
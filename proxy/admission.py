@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from collections import deque
+
+from config import AdmissionConfig
+from deadline import wait_future
+from metrics import ADMISSION_REJECTED, ADMISSION_LIMIT, ADMISSION_QUEUE, register_collector
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class AdmissionTicket:
+    """
+    Слот одного запроса. Повторный release ничего не делает.
+
+    complete освобождает слот и передает контроллеру время с момента допуска: ожидание в очереди
+    в него не входит, иначе лимит снижался бы из-за собственной очереди.
+    """
+    def __init__(self, controller: 'AdmissionController'):
+        self.controller = controller
+        self.admitted_at = asyncio.get_event_loop().time()
+        self.is_released = False
+
+    def complete(self) -> None:
+        self.release(asyncio.get_event_loop().time() - self.admitted_at)
+
+    def release(self, latency_s: float | None = None) -> None:
+        if not self.is_released:
+            self.is_released = True
+            self.controller.release(latency_s)
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременных запросов к апстримам.
+
+    Сверх лимита запрос ждет в очереди не дольше queue_timeout_ms, при полной очереди
+    или по истечении срока получает отказ - без ожидания таймаутов апстрима.
+    В adaptive режиме лимит подбирается AIMD: +1 за каждые limit ответов быстрее latency_target_ms,
+    если лимит выбран хотя бы наполовину, и умножение на 0.9 на медленный ответ
+    (не чаще раза за latency_target_ms).
+    """
+    BACKOFF_RATIO = 0.9
+
+    def __init__(self, config: AdmissionConfig):
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.decreased_at = 0.0
+        self.limit = float(config.max_requests or config.max_limit)
+        self.apply_config(config)
+        register_collector(self.update_metrics)
+
+    def apply_config(self, config: AdmissionConfig) -> None:
+        """Adaptive лимит при перезагрузке конфига сохраняется в новых границах, фиксированный берется из конфига."""
+        self.config = config
+        self.max_queue = config.max_queue
+        self.queue_timeout_s = config.queue_timeout_ms / 1000
+        self.latency_target_s = config.latency_target_ms / 1000
+        if config.adaptive:
+            self.limit = min(max(self.limit, config.min_limit), config.max_limit)
+        else:
+            self.limit = float(config.max_requests or config.max_limit)
+        self.wake_waiters()
+
+    @property
+    def is_unlimited(self) -> bool:
+        return not self.config.max_requests and not self.config.adaptive
+
+    async def admit(self) -> AdmissionTicket:
+        if self.is_unlimited or (self.in_flight < int(self.limit) and not self.waiters):
+            self.in_flight += 1
+            return AdmissionTicket(self)
+        if len(self.waiters) >= self.max_queue:
+            ADMISSION_REJECTED.labels(reason="queue_full").inc()
+            raise AdmissionRejected("Admission queue is full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await wait_future(waiter, self.queue_timeout_s)
+        except BaseException as exc:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, отдаем его следующему.
+                self.release()
+            if isinstance(exc, TimeoutError):
+                ADMISSION_REJECTED.labels(reason="queue_timeout").inc()
+                raise AdmissionRejected("Admission queue timeout")
+            raise
+        return AdmissionTicket(self)
+
+    def release(self, latency_s: float | None = None) -> None:
+        self.in_flight -= 1
+        if self.config.adaptive and latency_s is not None:
+            self.adjust_limit(latency_s)
+        self.wake_waiters()
+
+    def wake_waiters(self) -> None:
+        while self.waiters and (self.is_unlimited or self.in_flight < int(self.limit)):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def adjust_limit(self, latency_s: float) -> None:
+        limit = self.limit
+        if latency_s > self.latency_target_s:
+            now = asyncio.get_running_loop().time()
+            if now - self.decreased_at >= self.latency_target_s:
+                self.decreased_at = now
+                limit = max(self.config.min_limit, limit * self.BACKOFF_RATIO)
+        elif self.in_flight * 2 >= limit:
+            limit = min(self.config.max_limit, limit + 1 / limit)
+        if int(limit) != int(self.limit):
+            logger.debug(f"Admission limit changed to {int(limit)}")
+        self.limit = limit
+
+    def update_metrics(self) -> None:
+        ADMISSION_LIMIT.set(0 if self.is_unlimited else int(self.limit))
+        ADMISSION_QUEUE.set(len(self.waiters))
@@ -0,0 +1,69 @@
+import random
+
+from config import BalancingConfig
+
+
+class BalancingStrategy:
+    """
+    Выбор апстрима для очередного запроса.
+
+    Стратегия получает список Upstream из пула и не владеет соединениями: пул сам берет
+    свободное соединение у выбранного апстрима.
+    """
+    def __init__(self, config: BalancingConfig):
+        self.config = config
+
+    def select(self, upstreams: list['Upstream']) -> 'Upstream':
+        raise NotImplementedError
+
+
+class RoundRobinStrategy(BalancingStrategy):
+    def __init__(self, config: BalancingConfig):
+        super().__init__(config)
+        self.position = 0
+
+    def select(self, upstreams: list['Upstream']) -> 'Upstream':
+        self.position = (self.position + 1) % len(upstreams)
+        return upstreams[self.position]
+
+
+class LeastOutstandingStrategy(BalancingStrategy):
+    """
+    Апстрим с наименьшим числом запросов в работе, при равенстве - тот, у которого есть свободные соединения.
+
+    Обход начинается с очередного по кругу апстрима, чтобы равные по нагрузке чередовались.
+    """
+    def __init__(self, config: BalancingConfig):
+        super().__init__(config)
+        self.position = 0
+
+    def select(self, upstreams: list['Upstream']) -> 'Upstream':
+        self.position = (self.position + 1) % len(upstreams)
+        return min(
+            upstreams[self.position:] + upstreams[:self.position],
+            key=lambda upstream: (upstream.outstanding, not upstream.idle),
+        )
+
+
+class PeakEWMAStrategy(BalancingStrategy):
+    """
+    Power of two choices: из двух случайных апстримов берется тот, у которого меньше
+    EWMA задержки, умноженная на число запросов в работе. Апстрим без свободных соединений
+    проигрывает апстриму, у которого они есть.
+    """
+    def select(self, upstreams: list['Upstream']) -> 'Upstream':
+        if len(upstreams) == 1:
+            return upstreams[0]
+        first, second = random.sample(upstreams, 2)
+        return first if self.cost(first) <= self.cost(second) else second
+
+    @staticmethod
+    def cost(upstream: 'Upstream') -> tuple[bool, float]:
+        return not upstream.idle, upstream.ewma_latency_s * (upstream.outstanding + 1)
+
+
+STRATEGIES: dict[str, type[BalancingStrategy]] = {
+    "round_robin": RoundRobinStrategy,
+    "least_outstanding": LeastOutstandingStrategy,
+    "p2c_ewma": PeakEWMAStrategy,
+}
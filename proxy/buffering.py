@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import tempfile
+from collections import deque
+
+from config import BufferingConfig
+from metrics import RESPONSE_BUFFER_BYTES, RESPONSE_BUFFERED, LocalCounter, register_collector
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseBuffer:
+    """
+    Ответ апстрима на пути к клиенту: чтение апстрима не ждет, пока клиент примет данные.
+
+    Пока клиент успевает, чанки пишутся в его транспорт сразу. Когда запись приостановлена,
+    данные копятся в памяти до memory_bytes, сверх - во временном файле, а отдельная задача
+    дописывает их клиенту по мере готовности сокета. Файл отдается через os.sendfile.
+    Запись в файл синхронная: обычно она попадает в page cache и не ждет диска.
+    Если клиент отвалился или не принимает данные дольше write_ms, остаток ответа отбрасывается,
+    а соединение с клиентом закрывается: апстрим все равно дочитывается и возвращается в пул.
+
+    Если задан previous (задача ответа на предыдущий запрос того же соединения), данные только копятся,
+    а отдаются клиенту после успешного завершения previous. Если previous завершился ошибкой,
+    ответ не отдается, а finish падает: соединение закроется после ответа с ошибкой.
+    """
+    def __init__(self, client_conn: 'BaseConnection', buffering: 'ResponseBuffering', previous: asyncio.Task | None):
+        self.client_conn = client_conn
+        self.buffering = buffering
+        self.previous = previous
+        self.held = previous is not None
+        if previous is not None:
+            previous.add_done_callback(self.on_previous_done)
+        self.memory: deque[bytes | memoryview] = deque()
+        self.memory_size = 0
+        self.spool = None
+        # Неотправленные данные файла лежат в [spool_sent, spool_size).
+        self.spool_size = 0
+        self.spool_sent = 0
+        self.sender: asyncio.Task | None = None
+        self.progress: asyncio.Future | None = None
+        self.failed = False
+
+    async def write(self, data: bytes | memoryview) -> None:
+        if self.failed:
+            return
+        if self.sender is None and not self.held and not self.client_conn.protocol.write_paused:
+            if self.client_conn.transport.is_closing():
+                self.fail()
+                return
+            self.client_conn.transport.write(data)
+            return
+
+        config = self.buffering.config
+        # Пока в файле есть неотправленное, новые данные идут за ними, иначе нарушится порядок.
+        while not self.failed:
+            if self.spool_sent == self.spool_size and self.memory_size + len(data) <= config.memory_bytes:
+                self.memory.append(data)
+                self.memory_size += len(data)
+                self.buffering.add_memory(len(data))
+                break
+            if self.spool_size - self.spool_sent + len(data) <= config.max_spool_bytes:
+                self.write_spool(data)
+                break
+            # Память и файл заполнены: апстрим читается дальше, только когда клиент примет часть ответа.
+            self.start_sender()
+            self.progress = asyncio.get_running_loop().create_future()
+            await self.progress
+        self.start_sender()
+
+    def write_spool(self, data: bytes | memoryview) -> None:
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile(dir=self.buffering.config.spool_dir)
+        os.pwrite(self.spool.fileno(), data, self.spool_size)
+        self.spool_size += len(data)
+        self.buffering.add_spool(len(data))
+
+    def start_sender(self) -> None:
+        if self.sender is None and not self.held and not self.failed:
+            self.sender = asyncio.create_task(self.send())
+
+    async def send(self) -> None:
+        try:
+            while self.memory or self.spool_sent < self.spool_size:
+                if self.memory:
+                    data = self.memory.popleft()
+                    self.memory_size -= len(data)
+                    self.buffering.memory_bytes -= len(data)
+                    await self.client_conn.write(data)
+                else:
+                    size = min(self.spool_size - self.spool_sent, self.buffering.SEND_FILE_BYTES)
+                    await self.client_conn.send_file(self.spool.fileno(), self.spool_sent, size)
+                    self.spool_sent += size
+                    self.buffering.spool_bytes -= size
+                    if self.spool_sent == self.spool_size:
+                        # Отправленный файл не переписываем: sendfile отдает в сокет страницы page cache по ссылке,
+                        # и еще не ушедшие в сеть данные изменились бы. Следующая порция пойдет в новый файл.
+                        self.close_spool()
+                self.wakeup()
+        except ConnectionError as exc:
+            logger.debug("Client stopped reading buffered response: %r", exc)
+            self.fail()
+        finally:
+            self.sender = None
+            self.wakeup()
+
+    def on_previous_done(self, previous: asyncio.Task) -> None:
+        if previous.cancelled() or previous.exception() is not None:
+            # Соединение закрывает обработчик ошибки previous, транспорт не трогаем.
+            self.failed = True
+            self.discard()
+            self.wakeup()
+            return
+        self.held = False
+        if self.memory or self.spool_size:
+            self.start_sender()
+
+    def wakeup(self) -> None:
+        if self.progress is not None and not self.progress.done():
+            self.progress.set_result(None)
+
+    def fail(self) -> None:
+        self.failed = True
+        self.client_conn.transport.abort()
+        self.discard()
+
+    def discard(self) -> None:
+        self.buffering.memory_bytes -= self.memory_size
+        self.buffering.spool_bytes -= self.spool_size - self.spool_sent
+        self.memory.clear()
+        self.memory_size = 0
+        self.close_spool()
+
+    def close_spool(self) -> None:
+        self.spool_size = self.spool_sent = 0
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    async def finish(self) -> None:
+        """Ждет, пока клиент получит весь накопленный ответ."""
+        if self.previous is not None:
+            await asyncio.wait((self.previous,))
+            if self.held:
+                # Ошибка не дает отдать и ответы на следующие запросы: их буферы ждут этот.
+                raise ConnectionError("Response to previous pipelined request was not sent")
+        while self.sender is not None:
+            await asyncio.shield(self.sender)
+
+    def close(self) -> None:
+        if self.sender is not None:
+            self.sender.cancel()
+        self.discard()
+        self.wakeup()
+
+
+class ResponseBuffering:
+    """Настройки config.buffering и учет байт во всех буферах ответов процесса."""
+    # Сколько байт файла отдавать за один вызов sendfile, между вызовами обновляются счетчики.
+    SEND_FILE_BYTES = 1024 * 1024
+
+    def __init__(self, config: BufferingConfig):
+        self.config = config
+        self.memory_bytes = 0
+        self.spool_bytes = 0
+        self.buffered = LocalCounter(RESPONSE_BUFFERED.labels(storage="memory"))
+        self.spooled = LocalCounter(RESPONSE_BUFFERED.labels(storage="disk"))
+        register_collector(self.update_metrics)
+
+    def apply_config(self, config: BufferingConfig) -> None:
+        self.config = config
+
+    def buffer(self, client_conn: 'BaseConnection', previous: asyncio.Task | None = None) -> ResponseBuffer:
+        return ResponseBuffer(client_conn, self, previous)
+
+    def add_memory(self, size: int) -> None:
+        self.memory_bytes += size
+        self.buffered.inc(size)
+
+    def add_spool(self, size: int) -> None:
+        self.spool_bytes += size
+        self.spooled.inc(size)
+
+    def update_metrics(self) -> None:
+        RESPONSE_BUFFER_BYTES.labels(storage="memory").set(self.memory_bytes)
+        RESPONSE_BUFFER_BYTES.labels(storage="disk").set(self.spool_bytes)
@@ -0,0 +1,162 @@
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from config import CacheConfig
+from http_utils.http_reader import HTTPMessageHead
+from metrics import CACHE_BYTES, CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES, LocalCounter, register_collector
+
+
+class CacheEntry:
+    __slots__ = ('response', 'expires_at', 'variants')
+
+    def __init__(self, response: bytes, expires_at: float):
+        self.response = response
+        self.expires_at = expires_at
+        # Сжатые варианты ответа по Content-Encoding, для несжимаемого ответа - он сам.
+        self.variants: dict[bytes, bytes] | None = None
+
+    @property
+    def size(self) -> int:
+        size = len(self.response)
+        if self.variants:
+            size += sum(len(variant) for variant in self.variants.values() if variant is not self.response)
+        return size
+
+
+class ResponseCache:
+    """
+    In-memory кеш ответов апстримов.
+
+    Ключ - группа апстримов, выбранная маршрутом, метод, Host, путь и значения заголовков из vary_headers.
+    Срок жизни берется из Cache-Control (s-maxage/max-age) или Expires, ответы с no-store/no-cache/private,
+    с Set-Cookie и с Vary по заголовкам не из vary_headers не сохраняются.
+    Суммарный размер ответов ограничен max_bytes, при переполнении вытесняются давно не читанные (LRU).
+    Сжатые варианты ответа хранятся в его записи, учитываются в max_bytes и вытесняются вместе с ним.
+    """
+    CACHEABLE_METHODS = frozenset((b'GET',))
+    CACHEABLE_STATUSES = frozenset((200,))
+    UNCACHEABLE_DIRECTIVES = frozenset((b'no-store', b'no-cache', b'private'))
+
+    def __init__(self, config: CacheConfig):
+        self.max_bytes = config.max_bytes
+        self.max_object_bytes = config.max_object_bytes
+        self.vary_headers = [header.lower().encode() for header in config.vary_headers]
+        self.entries: OrderedDict[bytes, CacheEntry] = OrderedDict()
+        self.size = 0
+        self.hits = LocalCounter(CACHE_HITS)
+        self.misses = LocalCounter(CACHE_MISSES)
+        self.evictions = LocalCounter(CACHE_EVICTIONS)
+        register_collector(self.update_metrics)
+
+    def make_key(self, request_head: HTTPMessageHead, group: str) -> bytes | None:
+        """Ключ кеша для запроса или None, если запрос нельзя обслужить из кеша."""
+        if request_head.method not in self.CACHEABLE_METHODS:
+            return None
+        if request_head.get_header(b'authorization') is not None:
+            return None
+        if self._directives(request_head).keys() & self.UNCACHEABLE_DIRECTIVES:
+            return None
+        key = [group.encode(), request_head.method, request_head.get_header(b'host') or b'', request_head.path]
+        for header in self.vary_headers:
+            key.append(request_head.get_header(header) or b'')
+        return b'\0'.join(key)
+
+    def get(self, key: bytes) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses.inc()
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses.inc()
+            return None
+        self.entries.move_to_end(key)
+        self.hits.inc()
+        return entry.response
+
+    def is_storable(self, response_head: HTTPMessageHead) -> bool:
+        """Можно ли отдавать ответ другим клиентам: без Set-Cookie и с Vary только по заголовкам из ключа."""
+        if response_head.status not in self.CACHEABLE_STATUSES:
+            return False
+        if response_head.get_header(b'set-cookie') is not None:
+            return False
+        vary = response_head.get_header(b'vary')
+        if vary:
+            for header in vary.lower().split(b','):
+                if header.strip() not in self.vary_headers:
+                    return False
+        return True
+
+    def put(self, key: bytes, response_head: HTTPMessageHead, response: bytes) -> None:
+        if not self.is_storable(response_head) or len(response) > self.max_object_bytes:
+            return
+        ttl = self.get_ttl(response_head)
+        if not ttl or ttl <= 0:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+        while self.entries and self.size + len(response) > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions.inc()
+        self.entries[key] = CacheEntry(response, time.monotonic() + ttl)
+        self.size += len(response)
+
+    def get_variant(self, key: bytes, encoding: bytes) -> bytes | None:
+        """Вариант ответа в кодировке encoding, если он уже сохранен; свежесть entry проверяет get."""
+        entry = self.entries.get(key)
+        if entry is None or entry.variants is None:
+            return None
+        return entry.variants.get(encoding)
+
+    def put_variant(self, key: bytes, encoding: bytes, variant: bytes) -> None:
+        """Сохраняет вариант к ответу, который еще в кеше. Вариант не вытесняет другие ответы."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        size = len(variant) if variant is not entry.response else 0
+        if self.size + size > self.max_bytes:
+            return
+        if entry.variants is None:
+            entry.variants = {}
+        entry.variants[encoding] = variant
+        self.size += size
+
+    def get_ttl(self, response_head: HTTPMessageHead) -> float | None:
+        """Срок жизни ответа в секундах или None, если ответ не разрешено кешировать."""
+        directives = self._directives(response_head)
+        if directives.keys() & self.UNCACHEABLE_DIRECTIVES:
+            return None
+        max_age = directives.get(b's-maxage', directives.get(b'max-age'))
+        if max_age is not None:
+            return int(max_age) if max_age.isdigit() else None
+
+        expires = response_head.get_header(b'expires')
+        if expires is None:
+            return None
+        try:
+            expires_at = parsedate_to_datetime(expires.decode('latin-1'))
+            date = response_head.get_header(b'date')
+            now = parsedate_to_datetime(date.decode('latin-1')).timestamp() if date else time.time()
+        except (TypeError, ValueError):
+            return None
+        return expires_at.timestamp() - now
+
+    @staticmethod
+    def _directives(head: HTTPMessageHead) -> dict[bytes, bytes | None]:
+        cache_control = head.get_header(b'cache-control')
+        if not cache_control:
+            return {}
+        directives = {}
+        for directive in cache_control.lower().split(b','):
+            name, _, value = directive.strip().partition(b'=')
+            directives[name] = value.strip(b'"') or None
+        return directives
+
+    def _remove(self, key: bytes) -> None:
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    def update_metrics(self) -> None:
+        CACHE_BYTES.set(self.size)
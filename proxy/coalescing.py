@@ -0,0 +1,142 @@
+import asyncio
+from typing import AsyncIterator
+
+from config import CoalescingConfig
+from http_utils.http_reader import HTTPMessageHead
+from metrics import COALESCED_REQUESTS, LocalCounter
+
+
+class FlightFailed(Exception):
+    pass
+
+
+class FlightAbandoned(Exception):
+    pass
+
+
+class Flight:
+    """
+    Запрос к апстриму, ответ на который получат и клиенты одинаковых запросов, пришедших, пока он в работе.
+
+    Лидер добавляет в parts байты ответа в том виде, в каком отдает их своему клиенту, ожидающие читают
+    их через iter_parts со своей скоростью. Ответ хранится один на всех до конца полета.
+    """
+
+    def __init__(self, coalescer: 'RequestCoalescer', key: bytes):
+        self.coalescer = coalescer
+        self.key = key
+        self.parts: list[bytes | memoryview] = []
+        self.status: int | None = None
+        self.upstream: str | None = None
+        self.finished = False
+        self.failed = False
+        self.abandoned = False
+        self.waiter: asyncio.Future | None = None
+
+    def accept(self, response_head: HTTPMessageHead, upstream: str) -> bool:
+        """
+        Ответ пришел: слишком длинный, chunked (длина заранее неизвестна) или личный не раздаем,
+        ожидающие отправят свои запросы сами.
+        """
+        if (
+                response_head.chunked
+                or response_head.content_length > self.coalescer.config.max_response_bytes
+                or self.coalescer.is_private(response_head)
+        ):
+            self.abandoned = True
+            self.close()
+            return False
+        self.status, self.upstream = response_head.status, upstream
+        return True
+
+    def append(self, data: bytes | memoryview) -> None:
+        self.parts.append(data)
+        self.wakeup()
+
+    def finish(self) -> None:
+        self.finished = True
+        self.close()
+
+    def close(self) -> None:
+        """Новые запросы больше не присоединяются. Если ответ не получен целиком, ожидающие получат ошибку."""
+        if not (self.finished or self.abandoned):
+            self.failed = True
+        if self.coalescer.flights.get(self.key) is self:
+            del self.coalescer.flights[self.key]
+        self.wakeup()
+
+    def wakeup(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+        self.waiter = None
+
+    async def iter_parts(self) -> AsyncIterator[bytes | memoryview]:
+        index = 0
+        while True:
+            while index < len(self.parts):
+                index += 1
+                yield self.parts[index - 1]
+            if self.finished:
+                return
+            if self.abandoned:
+                raise FlightAbandoned("Response to coalesced request is too large")
+            if self.failed:
+                raise FlightFailed("Coalesced request failed")
+            if self.waiter is None:
+                self.waiter = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self.waiter)
+
+
+class RequestCoalescer:
+    """
+    Склейка одинаковых одновременных запросов (single-flight) по config.coalescing.
+
+    Ключ - метод, Host, путь, заголовки из vary_headers и кодировка сжатия ответа.
+    Склеиваются GET и HEAD без тела и без Authorization и Cookie. Ответ с Set-Cookie или
+    Cache-Control: private/no-store получает только клиент лидера.
+    """
+    COALESCED_METHODS = frozenset((b'GET', b'HEAD'))
+    PRIVATE_HEADERS = (b'authorization', b'cookie')
+    PRIVATE_DIRECTIVES = (b'private', b'no-store')
+
+    def __init__(self, config: CoalescingConfig):
+        self.flights: dict[bytes, Flight] = {}
+        self.leaders = LocalCounter(COALESCED_REQUESTS.labels(role="leader"))
+        self.followers = LocalCounter(COALESCED_REQUESTS.labels(role="follower"))
+        self.apply_config(config)
+
+    def apply_config(self, config: CoalescingConfig) -> None:
+        self.config = config
+        self.vary_headers = [header.lower().encode() for header in config.vary_headers]
+
+    def make_key(self, request_head: HTTPMessageHead, encoding: bytes | None) -> bytes | None:
+        if not self.config.enabled or request_head.method not in self.COALESCED_METHODS:
+            return None
+        for header in self.PRIVATE_HEADERS:
+            if request_head.get_header(header) is not None:
+                return None
+        key = [request_head.method, request_head.get_header(b'host') or b'', request_head.path, encoding or b'']
+        for header in self.vary_headers:
+            key.append(request_head.get_header(header) or b'')
+        return b'\0'.join(key)
+
+    def is_private(self, response_head: HTTPMessageHead) -> bool:
+        if response_head.get_header(b'set-cookie') is not None:
+            return True
+        cache_control = response_head.get_header(b'cache-control')
+        if cache_control is None:
+            return False
+        directives = [directive.strip().partition(b'=')[0] for directive in cache_control.lower().split(b',')]
+        return any(directive in directives for directive in self.PRIVATE_DIRECTIVES)
+
+    def join(self, key: bytes) -> Flight | None:
+        """Полет с тем же ключом, если он еще принимает запросы."""
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.followers.inc()
+        return flight
+
+    def start(self, key: bytes) -> Flight:
+        flight = self.flights[key] = Flight(self, key)
+        self.leaders.inc()
+        return flight
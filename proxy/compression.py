@@ -0,0 +1,187 @@
+import asyncio
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CompressionConfig
+from http_utils.http_reader import HTTPMessageHead, HTTPResponseParser
+from metrics import COMPRESSED_RESPONSES, COMPRESSION_BYTES, COMPRESSION_CPU, LocalCounter
+
+# Параметр wbits zlib: gzip - с заголовком gzip, deflate - в обертке zlib, как его понимают HTTP клиенты.
+WBITS = {b'gzip': 31, b'deflate': 15}
+# Заголовки ответа апстрима, которые заменяет сжатый ответ.
+REPLACED_HEADERS = (b'content-length', b'transfer-encoding')
+# Сжимаются только полные ответы: в 206 Content-Range указывает на байты несжатого тела.
+COMPRESSIBLE_STATUSES = frozenset((200,))
+
+
+def compress_part(compressor, data: bytes | memoryview, is_last: bool) -> tuple[bytes, float]:
+    """Сжимает часть тела, на последней части дописывает остаток. Возвращает сжатые байты и CPU время потока."""
+    started_at = time.thread_time()
+    compressed = compressor.compress(data)
+    if is_last:
+        compressed += compressor.flush()
+    return compressed, time.thread_time() - started_at
+
+
+class ResponseCompression:
+    """
+    Сжатие ответов по config.compression.
+
+    Кодировка выбирается по Accept-Encoding запроса из config.encodings, сжимаются ответы 200 с телом
+    от min_length байт и Content-Type из config.types, если апстрим не сжал их сам.
+    Части тела от offload_bytes сжимаются в пуле потоков: zlib отпускает GIL, и event loop не стоит.
+    """
+
+    def __init__(self, config: CompressionConfig):
+        self.executor: ThreadPoolExecutor | None = None
+        self.config = config
+        self.apply_config(config)
+        self.bytes_in = LocalCounter(COMPRESSION_BYTES.labels(direction="in"))
+        self.bytes_out = LocalCounter(COMPRESSION_BYTES.labels(direction="out"))
+        self.cpu = LocalCounter(COMPRESSION_CPU)
+        self.compressed = LocalCounter(COMPRESSED_RESPONSES.labels(source="upstream"))
+        self.compressed_from_cache = LocalCounter(COMPRESSED_RESPONSES.labels(source="cache"))
+
+    def apply_config(self, config: CompressionConfig) -> None:
+        if self.executor is None or config.threads != self.config.threads:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(config.threads, thread_name_prefix="compression")
+        self.config = config
+        self.encodings = [encoding.encode() for encoding in config.encodings]
+        self.types = frozenset(content_type.lower().encode() for content_type in config.types)
+
+    def accepted_encoding(self, request_head: HTTPMessageHead) -> bytes | None:
+        """Кодировка для ответа на запрос или None, если клиент не принимает сжатые ответы."""
+        if not self.config.enabled or request_head.method == b'HEAD':
+            return None
+        # Сжатый ответ идет с Transfer-Encoding: chunked, которого нет в HTTP/1.0.
+        if request_head.buffer[request_head.headers_start - 10:request_head.headers_start - 2] != b'HTTP/1.1':
+            return None
+        accept_encoding = request_head.get_header(b'accept-encoding')
+        if not accept_encoding:
+            return None
+        accepted, rejected = set(), set()
+        for item in accept_encoding.lower().split(b','):
+            name, _, params = item.partition(b';')
+            quality = params.strip()
+            # q=0 запрещает кодировку, остальные значения q порядок не меняют: он задан config.encodings.
+            if quality.startswith(b'q=') and not quality[2:].strip(b'0.'):
+                rejected.add(name.strip())
+            else:
+                accepted.add(name.strip())
+        for encoding in self.encodings:
+            if encoding in accepted or (b'*' in accepted and encoding not in rejected):
+                return encoding
+        return None
+
+    def should_compress(self, response_head: HTTPMessageHead) -> bool:
+        if response_head.status not in COMPRESSIBLE_STATUSES:
+            return False
+        # chunked тело идет как есть, вместе с размерами чанков: сжимать его нельзя.
+        if response_head.chunked or response_head.content_length < self.config.min_length:
+            return False
+        if response_head.get_header(b'content-encoding') is not None:
+            return False
+        content_type = response_head.get_header(b'content-type')
+        if content_type is None or content_type.partition(b';')[0].strip().lower() not in self.types:
+            return False
+        cache_control = response_head.get_header(b'cache-control')
+        return cache_control is None or b'no-transform' not in cache_control.lower()
+
+    def compressor(self, encoding: bytes, keep_body: bool = False) -> 'ResponseCompressor':
+        return ResponseCompressor(self, encoding, keep_body)
+
+    async def compress(self, compressor, data: bytes | memoryview, is_last: bool) -> bytes:
+        if len(data) >= self.config.offload_bytes:
+            compressed, cpu_s = await asyncio.get_running_loop().run_in_executor(
+                self.executor, compress_part, compressor, data, is_last
+            )
+        else:
+            compressed, cpu_s = compress_part(compressor, data, is_last)
+        self.bytes_in.inc(len(data))
+        self.bytes_out.inc(len(compressed))
+        self.cpu.inc(cpu_s)
+        return compressed
+
+    async def compress_response(self, response: bytes, encoding: bytes) -> bytes:
+        """
+        Сжатый вариант целого ответа (заголовки и тело, как в кеше) с Content-Length.
+
+        Если ответ не подходит для сжатия, возвращается он сам.
+        """
+        head = HTTPResponseParser().feed(response)[0].head
+        if not self.should_compress(head):
+            return response
+        body = memoryview(response)[head.end - head.start:]
+        compressor = zlib.compressobj(self.config.level, zlib.DEFLATED, WBITS[encoding])
+        compressed = await self.compress(compressor, body, is_last=True)
+        return rewrite_head(head, encoding, content_length=len(compressed)) + compressed
+
+
+class ResponseCompressor:
+    """
+    Сжимает тело одного ответа по частям и оформляет его в Transfer-Encoding: chunked.
+
+    При keep_body сжатое тело копится для кеша, variant() возвращает его целым ответом с Content-Length.
+    """
+
+    def __init__(self, compression: ResponseCompression, encoding: bytes, keep_body: bool):
+        self.compression = compression
+        self.encoding = encoding
+        self.zlib_compressor = zlib.compressobj(compression.config.level, zlib.DEFLATED, WBITS[encoding])
+        self.head: HTTPMessageHead | None = None
+        self.body_parts: list[bytes] | None = [] if keep_body else None
+
+    async def compress(self, data: bytes | memoryview, head: HTTPMessageHead | None, is_message_end: bool) -> bytes:
+        """Байты для клиента вместо data: head - заголовки ответа, если data начинается с них."""
+        prefix = b''
+        if head is not None:
+            self.head = head
+            head_size = head.end - head.start
+            prefix, data = rewrite_head(head, self.encoding), data[head_size:]
+        compressed = await self.compression.compress(self.zlib_compressor, data, is_message_end)
+        if self.body_parts is not None:
+            self.body_parts.append(compressed)
+        if compressed:
+            prefix += b'%x\r\n' % len(compressed) + compressed + b'\r\n'
+        if is_message_end:
+            self.compression.compressed.inc()
+            prefix += b'0\r\n\r\n'
+        return prefix
+
+    def variant(self) -> bytes:
+        body = b''.join(self.body_parts)
+        return rewrite_head(self.head, self.encoding, content_length=len(body)) + body
+
+
+def rewrite_head(head: HTTPMessageHead, encoding: bytes, content_length: int | None = None) -> bytes:
+    """
+    Заголовки сжатого ответа: без длины исходного тела, с Content-Encoding и Accept-Encoding в Vary.
+
+    Vary апстрима сохраняется одним заголовком, Accept-Encoding добавляется к нему, если его там еще нет.
+    """
+    buffer = head.buffer
+    lines = [buffer[head.start:head.headers_start]]
+    vary = []
+    pos = head.headers_start
+    while pos < head.end - 2:
+        line_end = buffer.find(b'\r\n', pos, head.end) + 2
+        colon = buffer.find(b':', pos, line_end)
+        name = buffer[pos:colon].strip().lower()
+        if name == b'vary':
+            vary.append(buffer[colon + 1:line_end - 2].strip())
+        elif name not in REPLACED_HEADERS:
+            lines.append(buffer[pos:line_end])
+        pos = line_end
+    tokens = {token.strip().lower() for value in vary for token in value.split(b',')}
+    if b'accept-encoding' not in tokens and b'*' not in tokens:
+        vary.append(b'Accept-Encoding')
+    vary_value = b', '.join(value for value in vary if value)
+    lines.append(b'Content-Encoding: ' + encoding + b'\r\nVary: ' + vary_value + b'\r\n')
+    if content_length is None:
+        lines.append(b'Transfer-Encoding: chunked\r\n\r\n')
+    else:
+        lines.append(b'Content-Length: %d\r\n\r\n' % content_length)
+    return b''.join(lines)
@@ -1,26 +1,208 @@
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field, replace
 
 import yaml
 
+# Группа апстримов из верхнеуровневого upstreams, в нее идут запросы без подходящего маршрута.
+DEFAULT_GROUP = "default"
+
 
 @dataclass
 class TimeoutsConfig:
     connect_ms: float
     read_ms: float
     write_ms: float
+    # Длительность клиентской сессии целиком.
     total_ms: float
+    # Ожидание следующего запроса на keep-alive соединении, по умолчанию read_ms.
+    keepalive_ms: float | None = None
+    # Запрос от начала до конца ответа, по умолчанию не ограничен.
+    request_ms: float | None = None
 
 
 @dataclass
 class UpstreamConfig:
     host: str
     port: int
+    # Если не заданы, берутся из pool.min_idle и limits.max_conns_per_upstream.
+    min_idle: int | None = None
+    max_size: int | None = None
+    # Соединения к апстриму по TLS. Сертификат проверяется по tls_ca_file или системным корневым,
+    # имя для SNI и проверки - tls_server_name, по умолчанию host.
+    tls: bool = False
+    tls_verify: bool = True
+    tls_ca_file: str | None = None
+    tls_server_name: str | None = None
 
 
 @dataclass
 class LimitsConfig:
     max_client_conns: int
     max_conns_per_upstream: int
+    # Сколько запросов одного соединения (HTTP pipelining) отправлять апстримам до ответа на первый, 1 - по одному.
+    pipeline_depth: int = 1
+
+
+@dataclass
+class AdmissionConfig:
+    max_requests: int = 0
+    max_queue: int = 1000
+    queue_timeout_ms: float = 500
+    retry_after_s: int = 1
+    adaptive: bool = False
+    min_limit: int = 10
+    max_limit: int = 1000
+    latency_target_ms: float = 200
+
+
+@dataclass
+class RetryConfig:
+    # Повторы и хеджи только для GET, HEAD и OPTIONS без тела, по умолчанию выключены.
+    max_attempts: int = 1
+    budget_ratio: float = 0.2
+    budget_min_per_second: float = 10
+    hedging: bool = False
+    hedge_delay_ms: float = 0
+    hedge_min_delay_ms: float = 5
+
+
+@dataclass
+class PoolConfig:
+    min_idle: int = 10
+    idle_ttl_ms: float = 60000
+    max_dial_rate: float = 100
+
+
+@dataclass
+class LoggingConfig:
+    level: str = "info"
+    access_log: bool = True
+    access_log_sample_rate: float = 1.0
+    queue_size: int = 10000
+
+
+@dataclass
+class RelayConfig:
+    window_bytes: int = 256 * 1024
+    splice_threshold_bytes: int = 1024 * 1024
+
+
+@dataclass
+class BufferingConfig:
+    enabled: bool = False
+    # Ответ для медленного клиента копится в памяти до memory_bytes, дальше - во временном файле в spool_dir.
+    memory_bytes: int = 1024 * 1024
+    # Когда и файл заполнен, чтение апстрима ждет клиента; 0 - без файла.
+    max_spool_bytes: int = 1024 * 1024 * 1024
+    spool_dir: str | None = None
+
+
+@dataclass
+class TLSConfig:
+    enabled: bool = False
+    cert_file: str | None = None
+    # Если не задан, ключ берется из cert_file.
+    key_file: str | None = None
+    handshake_timeout_ms: float = 5000
+    # Тикеты позволяют клиенту возобновить сессию без полного handshake, без них - только по id сессии из кэша.
+    session_tickets: bool = True
+    # Сколько тикетов TLS 1.3 выдавать после handshake.
+    num_tickets: int = 2
+
+
+@dataclass
+class CompressionConfig:
+    enabled: bool = False
+    # Кодировки в порядке предпочтения, если клиент принимает несколько.
+    encodings: list[str] = field(default_factory=lambda: ["gzip", "deflate"])
+    level: int = 5
+    min_length: int = 1024
+    types: list[str] = field(default_factory=lambda: [
+        "application/json", "application/javascript", "application/xml", "text/html", "text/plain", "text/css",
+        "text/xml",
+    ])
+    # Части тела от offload_bytes сжимаются в пуле из threads потоков, меньшие - в event loop.
+    offload_bytes: int = 64 * 1024
+    threads: int = 2
+
+
+@dataclass
+class CoalescingConfig:
+    enabled: bool = False
+    # Заголовки запроса, которые вместе с методом, Host и путем отличают запросы друг от друга.
+    vary_headers: list[str] = field(default_factory=list)
+    # Ответы длиннее не раздаются: присоединившиеся запросы уходят к апстриму сами.
+    max_response_bytes: int = 1024 * 1024
+
+
+@dataclass
+class CacheConfig:
+    enabled: bool = False
+    max_bytes: int = 64 * 1024 * 1024
+    max_object_bytes: int = 1024 * 1024
+    vary_headers: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BalancingConfig:
+    strategy: str = "round_robin"
+    ewma_decay_ms: float = 10000
+
+
+@dataclass
+class HealthConfig:
+    max_failures: int = 5
+    ejection_ms: float = 10000
+    max_ejection_ms: float = 300000
+    check_interval_ms: float = 0
+    check_path: str = "/health"
+    check_timeout_ms: float = 1000
+
+
+@dataclass
+class RateLimitConfig:
+    enabled: bool = False
+    requests_per_second: float = 100
+    burst: float = 200
+    # Клиент - значение этого заголовка (например X-API-Key), если он есть в запросе, иначе адрес.
+    key_header: str | None = None
+    # Новых соединений с одного адреса в секунду, 0 - без ограничения.
+    connections_per_second: float = 0
+    connection_burst: float = 50
+    max_clients: int = 1000000
+    shards: int = 64
+    retry_after_s: int = 1
+
+
+@dataclass
+class DebugConfig:
+    loop_lag_interval_ms: float = 100
+    # Колбэки event loop дольше порога попадают в /debug/slow_callbacks, 0 - не замерять.
+    # Замер стоит около микросекунды на каждый колбэк, поэтому включается явно.
+    slow_callback_ms: float = 0
+    slow_callbacks_kept: int = 100
+    profile_max_s: float = 60
+    # Воркер с номером i отдает /debug на worker_port + i, 0 - не отдавать.
+    worker_port: int = 0
+
+
+@dataclass
+class UpstreamGroupConfig:
+    upstreams: list[UpstreamConfig]
+    # Если не заданы, берутся из limits.max_conns_per_upstream и balancing.strategy.
+    max_conns_per_upstream: int | None = None
+    strategy: str | None = None
+
+
+@dataclass
+class RouteConfig:
+    group: str
+    # Точный Host или "*.example.com" (любой поддомен), без host - любой.
+    host: str | None = None
+    # Одно из трех: префикс по целым сегментам пути, точный путь или регулярное выражение (re.search).
+    path_prefix: str | None = None
+    path: str | None = None
+    path_regex: str | None = None
 
 
 @dataclass
@@ -29,6 +211,38 @@ class Config:
     upstreams: list[UpstreamConfig]
     timeouts: TimeoutsConfig
     limits: LimitsConfig
+    workers: int = 1
+    admission: AdmissionConfig = field(default_factory=AdmissionConfig)
+    pool: PoolConfig = field(default_factory=PoolConfig)
+    retries: RetryConfig = field(default_factory=RetryConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    relay: RelayConfig = field(default_factory=RelayConfig)
+    buffering: BufferingConfig = field(default_factory=BufferingConfig)
+    tls: TLSConfig = field(default_factory=TLSConfig)
+    compression: CompressionConfig = field(default_factory=CompressionConfig)
+    coalescing: CoalescingConfig = field(default_factory=CoalescingConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    balancing: BalancingConfig = field(default_factory=BalancingConfig)
+    health: HealthConfig = field(default_factory=HealthConfig)
+    debug: DebugConfig = field(default_factory=DebugConfig)
+    rate_limit: RateLimitConfig = field(default_factory=RateLimitConfig)
+    upstream_groups: dict[str, UpstreamGroupConfig] = field(default_factory=dict)
+    routes: list[RouteConfig] = field(default_factory=list)
+
+    def group_configs(self) -> dict[str, "Config"]:
+        """Конфиг пула для каждой группы апстримов: общие секции, свои апстримы и лимиты группы."""
+        configs = {DEFAULT_GROUP: self} if self.upstreams else {}
+        for name, group in self.upstream_groups.items():
+            configs[name] = replace(
+                self,
+                upstreams=group.upstreams,
+                limits=replace(
+                    self.limits,
+                    max_conns_per_upstream=group.max_conns_per_upstream or self.limits.max_conns_per_upstream,
+                ),
+                balancing=replace(self.balancing, strategy=group.strategy or self.balancing.strategy),
+            )
+        return configs
 
 
 class ConfigLoader:
@@ -40,9 +254,33 @@ class ConfigLoader:
         self._validate_config(raw_config)
         return Config(
             listen=raw_config["listen"],
-            upstreams=[UpstreamConfig(**upstream) for upstream in raw_config["upstreams"]],
+            upstreams=[UpstreamConfig(**upstream) for upstream in raw_config.get("upstreams", [])],
             timeouts=TimeoutsConfig(**raw_config["timeouts"]),
             limits=LimitsConfig(**raw_config["limits"]),
+            workers=raw_config.get("workers", 1),
+            admission=AdmissionConfig(**raw_config.get("admission", {})),
+            pool=PoolConfig(**raw_config.get("pool", {})),
+            retries=RetryConfig(**raw_config.get("retries", {})),
+            logging=LoggingConfig(**raw_config.get("logging", {})),
+            relay=RelayConfig(**raw_config.get("relay", {})),
+            buffering=BufferingConfig(**raw_config.get("buffering", {})),
+            tls=TLSConfig(**raw_config.get("tls", {})),
+            compression=CompressionConfig(**raw_config.get("compression", {})),
+            coalescing=CoalescingConfig(**raw_config.get("coalescing", {})),
+            cache=CacheConfig(**raw_config.get("cache", {})),
+            balancing=BalancingConfig(**raw_config.get("balancing", {})),
+            health=HealthConfig(**raw_config.get("health", {})),
+            debug=DebugConfig(**raw_config.get("debug", {})),
+            rate_limit=RateLimitConfig(**raw_config.get("rate_limit", {})),
+            upstream_groups={
+                name: UpstreamGroupConfig(
+                    upstreams=[UpstreamConfig(**upstream) for upstream in group["upstreams"]],
+                    max_conns_per_upstream=group.get("max_conns_per_upstream"),
+                    strategy=group.get("strategy"),
+                )
+                for name, group in raw_config.get("upstream_groups", {}).items()
+            },
+            routes=[RouteConfig(**route) for route in raw_config.get("routes", [])],
         )
 
     def _get_raw_config(self, path: str) -> dict:
@@ -56,18 +294,106 @@ class ConfigLoader:
         if len(server_uri) != 2:
             raise ValueError("invalid 'listen' param")
 
-        if "upstreams" not in raw_config:
-            raise ValueError("'upstreams' param required")
-        if not isinstance(raw_config["upstreams"], list):
+        groups = raw_config.get("upstream_groups", {})
+        if "upstreams" not in raw_config and not groups:
+            raise ValueError("'upstreams' or 'upstream_groups' param required")
+        if not isinstance(raw_config.get("upstreams", []), list):
             raise ValueError("upstreams must be list")
-        for upstream in raw_config["upstreams"]:
-            if "host" not in upstream:
-                raise ValueError("host not set in upstream")
-            if "port" not in upstream:
-                raise ValueError("port not set in upstream")
+        self._validate_upstreams(raw_config.get("upstreams", []))
+        if DEFAULT_GROUP in groups:
+            raise ValueError(f"upstream group name '{DEFAULT_GROUP}' is reserved for 'upstreams'")
+        for name, group in groups.items():
+            if not isinstance(group.get("upstreams"), list) or not group["upstreams"]:
+                raise ValueError(f"upstream group {name}: upstreams must be non-empty list")
+            self._validate_upstreams(group["upstreams"])
+
+        known_groups = set(groups) | ({DEFAULT_GROUP} if raw_config.get("upstreams") else set())
+        for route in raw_config.get("routes", []):
+            if route.get("group") not in known_groups:
+                raise ValueError(f"route {route}: unknown upstream group")
+            if sum(route.get(key) is not None for key in ("path_prefix", "path", "path_regex")) > 1:
+                raise ValueError(f"route {route}: only one of path_prefix, path and path_regex allowed")
+            if route.get("path_regex") is not None:
+                try:
+                    re.compile(route["path_regex"])
+                except re.error as exc:
+                    raise ValueError(f"route {route}: invalid path_regex: {exc}")
 
         if "timeouts" not in raw_config:
             raise ValueError("'timeouts' param required")
 
         if "limits" not in raw_config:
             raise ValueError("'limits' param required")
+
+        pipeline_depth = raw_config["limits"].get("pipeline_depth", 1)
+        if not isinstance(pipeline_depth, int) or pipeline_depth < 1:
+            raise ValueError("limits.pipeline_depth must be positive int")
+
+        admission = raw_config.get("admission", {})
+        if admission.get("min_limit", 10) > admission.get("max_limit", 1000):
+            raise ValueError("admission.min_limit must not exceed admission.max_limit")
+
+        if raw_config.get("pool", {}).get("max_dial_rate", 1) <= 0:
+            raise ValueError("pool.max_dial_rate must be positive")
+
+        strategies = [raw_config.get("balancing", {}).get("strategy", "round_robin")]
+        strategies += [group["strategy"] for group in groups.values() if group.get("strategy")]
+        for strategy in strategies:
+            if strategy not in ("round_robin", "least_outstanding", "p2c_ewma"):
+                raise ValueError(f"unknown balancing strategy: {strategy}")
+
+        max_attempts = raw_config.get("retries", {}).get("max_attempts", 1)
+        if not isinstance(max_attempts, int) or max_attempts < 1:
+            raise ValueError("retries.max_attempts must be positive int")
+
+        logging_config = raw_config.get("logging", {})
+        if logging_config.get("level", "info").upper() not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+            raise ValueError(f"unknown logging level: {logging_config['level']}")
+        if not 0 <= logging_config.get("access_log_sample_rate", 1.0) <= 1:
+            raise ValueError("logging.access_log_sample_rate must be between 0 and 1")
+
+        buffering = raw_config.get("buffering", {})
+        if buffering.get("memory_bytes", 0) < 0 or buffering.get("max_spool_bytes", 0) < 0:
+            raise ValueError("buffering.memory_bytes and buffering.max_spool_bytes must not be negative")
+
+        tls = raw_config.get("tls", {})
+        if tls.get("enabled", False) and not tls.get("cert_file"):
+            raise ValueError("tls.cert_file required when tls is enabled")
+        if not isinstance(tls.get("num_tickets", 2), int) or tls.get("num_tickets", 2) < 0:
+            raise ValueError("tls.num_tickets must be non-negative int")
+
+        compression = raw_config.get("compression", {})
+        for encoding in compression.get("encodings", []):
+            if encoding not in ("gzip", "deflate"):
+                raise ValueError(f"unknown compression encoding: {encoding}")
+        if compression.get("level", 5) not in range(1, 10):
+            raise ValueError("compression.level must be between 1 and 9")
+        if not isinstance(compression.get("threads", 2), int) or compression.get("threads", 2) < 1:
+            raise ValueError("compression.threads must be positive int")
+
+        if raw_config.get("coalescing", {}).get("max_response_bytes", 0) < 0:
+            raise ValueError("coalescing.max_response_bytes must not be negative")
+
+        if raw_config.get("debug", {}).get("loop_lag_interval_ms", 100) <= 0:
+            raise ValueError("debug.loop_lag_interval_ms must be positive")
+
+        rate_limit = raw_config.get("rate_limit", {})
+        if rate_limit.get("requests_per_second", 100) <= 0:
+            raise ValueError("rate_limit.requests_per_second must be positive")
+        if rate_limit.get("burst", 200) < 1 or rate_limit.get("connection_burst", 50) < 1:
+            raise ValueError("rate_limit.burst and rate_limit.connection_burst must be at least 1")
+        if not isinstance(rate_limit.get("shards", 64), int) or rate_limit.get("shards", 64) < 1:
+            raise ValueError("rate_limit.shards must be positive int")
+
+        workers = raw_config.get("workers", 1)
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers must be positive int")
+
+    def _validate_upstreams(self, upstreams: list[dict]):
+        for upstream in upstreams:
+            if "host" not in upstream:
+                raise ValueError("host not set in upstream")
+            if "port" not in upstream:
+                raise ValueError("port not set in upstream")
+            if upstream.get("tls_ca_file") and not upstream.get("tls_verify", True):
+                raise ValueError(f"upstream {upstream['host']}: tls_ca_file is useless with tls_verify: false")
@@ -0,0 +1,118 @@
+import asyncio
+import math
+import weakref
+from typing import Any, Callable
+
+
+class TimerWheel:
+    """
+    Общий на event loop таймер для сроков ожидания.
+
+    Сроки раскладываются по слотам кольца с шагом RESOLUTION_S. loop.call_at взводится один раз на шаг
+    и только пока есть взведенные сроки, постановка и снятие срока - операции над set.
+    В отличие от asyncio.wait_for, на операцию не создается ни задача, ни TimerHandle.
+    """
+    RESOLUTION_S = 0.01
+    SLOTS = 1024
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.slots: list[set['Deadline']] = [set() for _ in range(self.SLOTS)]
+        self.tick = 0
+        self.scheduled = 0
+        self.handle: asyncio.TimerHandle | None = None
+
+    def schedule(self, deadline: 'Deadline', when: float) -> None:
+        if self.handle is None:
+            self.tick = int(self.loop.time() / self.RESOLUTION_S)
+            self.handle = self.loop.call_at((self.tick + 1) * self.RESOLUTION_S, self.advance)
+        deadline.tick = max(math.ceil(when / self.RESOLUTION_S), self.tick + 1)
+        self.slots[deadline.tick % self.SLOTS].add(deadline)
+        self.scheduled += 1
+
+    def cancel(self, deadline: 'Deadline') -> None:
+        self.slots[deadline.tick % self.SLOTS].discard(deadline)
+        deadline.tick = None
+        self.scheduled -= 1
+
+    def advance(self) -> None:
+        now_tick = int(self.loop.time() / self.RESOLUTION_S)
+        while self.tick < now_tick and self.scheduled:
+            self.tick += 1
+            slot = self.slots[self.tick % self.SLOTS]
+            if not slot:
+                continue
+            # В слоте могут лежать сроки следующих оборотов кольца.
+            for deadline in [deadline for deadline in slot if deadline.tick <= self.tick]:
+                self.cancel(deadline)
+                deadline.expire()
+        if self.scheduled:
+            self.tick = max(self.tick, now_tick)
+            self.handle = self.loop.call_at((self.tick + 1) * self.RESOLUTION_S, self.advance)
+        else:
+            self.handle = None
+
+
+_wheels: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TimerWheel] = weakref.WeakKeyDictionary()
+
+
+def get_timer_wheel() -> TimerWheel:
+    loop = asyncio.get_running_loop()
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        wheel = _wheels[loop] = TimerWheel(loop)
+    return wheel
+
+
+class Deadline:
+    """
+    Срок ожидания, переиспользуется между операциями на одном соединении.
+
+    start взводит срок, wait ждет future: если срок истек раньше, future получает TimeoutError.
+    on_expire вызывается при истечении срока, даже если ожидания в этот момент нет.
+    """
+    __slots__ = ('wheel', 'on_expire', 'tick', 'waiter', 'expired')
+
+    def __init__(self, on_expire: Callable[[], Any] | None = None):
+        self.wheel = get_timer_wheel()
+        self.on_expire = on_expire
+        self.tick: int | None = None
+        self.waiter: asyncio.Future | None = None
+        self.expired = False
+
+    def start(self, timeout_s: float) -> None:
+        if self.tick is not None:
+            self.wheel.cancel(self)
+        self.expired = False
+        self.wheel.schedule(self, self.wheel.loop.time() + timeout_s)
+
+    def stop(self) -> None:
+        if self.tick is not None:
+            self.wheel.cancel(self)
+
+    async def wait(self, future: asyncio.Future) -> Any:
+        if self.expired:
+            future.cancel()
+            raise TimeoutError
+        self.waiter = future
+        try:
+            return await future
+        finally:
+            self.waiter = None
+
+    def expire(self) -> None:
+        self.expired = True
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(TimeoutError())
+        if self.on_expire is not None:
+            self.on_expire()
+
+
+async def wait_future(future: asyncio.Future, timeout_s: float) -> Any:
+    """Замена asyncio.wait_for для уже созданного future."""
+    deadline = Deadline()
+    deadline.start(timeout_s)
+    try:
+        return await deadline.wait(future)
+    finally:
+        deadline.stop()
@@ -0,0 +1,191 @@
+import asyncio
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from config import Config, DebugConfig
+from metrics import GC_PAUSE, LOOP_LAG, SLOW_CALLBACKS, LocalHistogram, register_admin_route
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = b"application/json"
+TEXT_CONTENT_TYPE = b"text/plain; charset=utf-8"
+
+
+class SlowCallbackMonitor:
+    """
+    Замеряет каждый колбэк event loop (в том числе шаги задач) и запоминает последние дольше порога.
+
+    asyncio в debug-режиме делает то же, но заметно замедляет loop. Здесь на колбэк приходится
+    два вызова perf_counter (около 0.9 us на колбэк), источник колбэка определяется только для медленных.
+    Поэтому замер включается явно через debug.slow_callback_ms и снимается uninstall при перезагрузке конфига.
+    """
+    def __init__(self, threshold_s: float, kept: int):
+        self.threshold_s = threshold_s
+        self.recent: deque[dict] = deque(maxlen=kept)
+        self.original_run = None
+
+    def install(self) -> None:
+        original_run = self.original_run = asyncio.Handle._run
+        monitor = self
+
+        def timed_run(handle: asyncio.Handle) -> None:
+            started_at = time.perf_counter()
+            original_run(handle)
+            duration_s = time.perf_counter() - started_at
+            if duration_s >= monitor.threshold_s:
+                monitor.report(handle, duration_s)
+
+        asyncio.Handle._run = timed_run
+
+    def uninstall(self) -> None:
+        if self.original_run is not None:
+            asyncio.Handle._run = self.original_run
+            self.original_run = None
+
+    def apply(self, threshold_s: float, kept: int) -> None:
+        self.threshold_s = threshold_s
+        if kept != self.recent.maxlen:
+            self.recent = deque(self.recent, maxlen=kept)
+
+    def report(self, handle: asyncio.Handle, duration_s: float) -> None:
+        SLOW_CALLBACKS.inc()
+        self.recent.append({
+            "time": time.time(),
+            "duration_ms": round(duration_s * 1000, 3),
+            "source": self.describe(handle),
+        })
+
+    @staticmethod
+    def describe(handle: asyncio.Handle) -> str:
+        task = getattr(handle._callback, "__self__", None)
+        if not isinstance(task, asyncio.Task):
+            return repr(handle)
+        coro = task.get_coro()
+        frame = getattr(coro, "cr_frame", None)
+        code = getattr(coro, "cr_code", None)
+        if code is None:
+            return repr(task)
+        # Строка, на которой задача остановилась после медленного шага, или начало корутины, если она завершилась.
+        line = frame.f_lineno if frame is not None else code.co_firstlineno
+        return f"{code.co_qualname} {code.co_filename}:{line}"
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик потока event loop: из отдельного потока раз в interval_s снимает стек
+    через sys._current_frames. Результат - collapsed stacks (формат flamegraph.pl и speedscope).
+    Пока профиль не запрошен, ничего не стоит.
+    """
+    def __init__(self, thread_id: int, interval_s: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+
+    def run(self, seconds: float) -> str:
+        stacks: Counter[str] = Counter()
+        stop_at = time.monotonic() + seconds
+        while time.monotonic() < stop_at:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stacks[self.collapse(frame)] += 1
+            del frame
+            time.sleep(self.interval_s)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    @staticmethod
+    def collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+class Diagnostics:
+    """
+    Диагностика процесса на порту метрик.
+
+    Постоянно включены дешевые замеры: задержка event loop (таймер раз в loop_lag_interval_ms)
+    и паузы GC через gc.callbacks. Медленные колбэки замеряются, только если задан debug.slow_callback_ms. На /debug/profile по запросу снимается профиль,
+    /debug/slow_callbacks отдает последние медленные колбэки, /debug/gc - статистику сборщика.
+    """
+    def __init__(self, config: DebugConfig):
+        self.config = config
+        self.loop_lag = LocalHistogram(LOOP_LAG)
+        self.gc_pauses = [LocalHistogram(GC_PAUSE.labels(generation=str(generation))) for generation in range(3)]
+        self.gc_started_at = 0.0
+        self.slow_callbacks: SlowCallbackMonitor | None = None
+        self.profile_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        self.install()
+        interval_s = self.config.loop_lag_interval_ms / 1000
+        loop = asyncio.get_running_loop()
+        while True:
+            expected_at = loop.time() + interval_s
+            await asyncio.sleep(interval_s)
+            self.loop_lag.observe(max(0.0, loop.time() - expected_at))
+
+    def install(self) -> None:
+        gc.callbacks.append(self.on_gc)
+        self.apply_config(self.config)
+        register_admin_route("/debug/profile", self.handle_profile)
+        register_admin_route("/debug/slow_callbacks", self.handle_slow_callbacks)
+        register_admin_route("/debug/gc", self.handle_gc)
+
+    def apply_config(self, config: DebugConfig) -> None:
+        """Включает, перенастраивает или снимает замер медленных колбэков. Остальное - со следующего запуска."""
+        self.config = config
+        threshold_s = config.slow_callback_ms / 1000
+        if threshold_s <= 0:
+            if self.slow_callbacks is not None:
+                self.slow_callbacks.uninstall()
+                self.slow_callbacks = None
+        elif self.slow_callbacks is None:
+            self.slow_callbacks = SlowCallbackMonitor(threshold_s, config.slow_callbacks_kept)
+            self.slow_callbacks.install()
+        else:
+            self.slow_callbacks.apply(threshold_s, config.slow_callbacks_kept)
+
+    def reload(self, config: Config) -> None:
+        self.apply_config(config.debug)
+
+    def on_gc(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self.gc_started_at = time.perf_counter()
+        else:
+            self.gc_pauses[info["generation"]].observe(time.perf_counter() - self.gc_started_at)
+
+    async def handle_profile(self, params: dict[str, str]) -> tuple[bytes, bytes]:
+        seconds = float(params.get("seconds", 10))
+        if not 0 < seconds <= self.config.profile_max_s:
+            raise ValueError(f"seconds must be in (0, {self.config.profile_max_s}]")
+        interval_s = float(params.get("interval_ms", 5)) / 1000
+        profiler = SamplingProfiler(threading.get_ident(), interval_s)
+        # Один профиль за раз, семплирование идет в потоке пула и не держит event loop.
+        async with self.profile_lock:
+            logger.info("Profiling event loop for %ss", seconds)
+            stacks = await asyncio.get_running_loop().run_in_executor(None, profiler.run, seconds)
+        return TEXT_CONTENT_TYPE, stacks.encode()
+
+    async def handle_slow_callbacks(self, params: dict[str, str]) -> tuple[bytes, bytes]:
+        recent = list(self.slow_callbacks.recent) if self.slow_callbacks is not None else []
+        return JSON_CONTENT_TYPE, json.dumps({
+            "threshold_ms": self.config.slow_callback_ms,
+            "callbacks": recent,
+        }).encode()
+
+    async def handle_gc(self, params: dict[str, str]) -> tuple[bytes, bytes]:
+        return JSON_CONTENT_TYPE, json.dumps({
+            "enabled": gc.isenabled(),
+            "thresholds": gc.get_threshold(),
+            "counts": gc.get_count(),
+            "stats": gc.get_stats(),
+            "objects": len(gc.get_objects()) if params.get("objects") == "1" else None,
+        }).encode()
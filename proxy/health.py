@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+from config import HealthConfig
+from metrics import UPSTREAM_HEALTHY, UPSTREAM_EJECTIONS, HEALTH_CHECK_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamHealth:
+    """
+    Пассивная проверка здоровья апстрима.
+
+    После max_failures ошибок подряд апстрим выводится из ротации. Срок вывода растет
+    экспоненциально с каждым повторным выводом и сбрасывается после первого успешного ответа.
+    """
+    def __init__(self, name: str, config: HealthConfig):
+        self.name = name
+        self.config = config
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.healthy_gauge = UPSTREAM_HEALTHY.labels(upstream=name)
+        self.healthy_gauge.set(1)
+
+    def is_available(self, now: float) -> bool:
+        if not self.ejected_until:
+            return True
+        if now < self.ejected_until:
+            return False
+        # Срок вывода истек: апстрим снова получает запросы, повторные ошибки выведут его на больший срок.
+        self.ejected_until = 0.0
+        self.healthy_gauge.set(1)
+        return True
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        if not self.ejected_until:
+            self.ejections = 0
+
+    def record_failure(self, now: float) -> None:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.config.max_failures and self.is_available(now):
+            self.eject(now)
+
+    def eject(self, now: float) -> None:
+        self.ejections += 1
+        duration_ms = min(self.config.ejection_ms * 2 ** (self.ejections - 1), self.config.max_ejection_ms)
+        self.ejected_until = now + duration_ms / 1000
+        self.consecutive_failures = 0
+        self.healthy_gauge.set(0)
+        UPSTREAM_EJECTIONS.labels(upstream=self.name).inc()
+        logger.warning(f"Upstream {self.name} ejected for {duration_ms:.0f}ms")
+
+    def readmit(self) -> None:
+        if self.ejected_until:
+            logger.info(f"Upstream {self.name} passed health check, returned to rotation")
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        self.healthy_gauge.set(1)
+
+
+class HealthChecker:
+    """
+    Активные проверки: раз в check_interval_ms отправляет GET check_path на каждый апстрим
+    по отдельному соединению. Ответ со статусом меньше 500 возвращает апстрим в ротацию,
+    ошибка или таймаут считаются как ошибка запроса.
+    """
+    def __init__(self, pool: 'UpstreamPool', config: HealthConfig):
+        self.pool = pool
+        self.interval_s = config.check_interval_ms / 1000
+        self.timeout_s = config.check_timeout_ms / 1000
+        self.path = config.check_path
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check(upstream) for upstream in self.pool.upstreams))
+            await asyncio.sleep(self.interval_s)
+
+    async def check(self, upstream: 'Upstream') -> None:
+        try:
+            is_healthy = await asyncio.wait_for(self.probe(upstream), self.timeout_s)
+        except Exception as exc:
+            logger.debug(f"Health check of {upstream.name} failed: {exc!r}")
+            is_healthy = False
+
+        if is_healthy:
+            upstream.health.readmit()
+        else:
+            HEALTH_CHECK_FAILURES.labels(upstream=upstream.name).inc()
+            self.pool.report_failure(upstream)
+
+    async def probe(self, upstream: 'Upstream') -> bool:
+        connection = await self.pool.connect_upstream(upstream)
+        try:
+            await connection.write(
+                f"GET {self.path} HTTP/1.1\r\nHost: {upstream.name}\r\nConnection: close\r\n\r\n".encode()
+            )
+            async for data in connection.iterator():
+                return data.head.status < 500
+            return False
+        finally:
+            await connection.close()
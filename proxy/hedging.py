@@ -0,0 +1,67 @@
+import asyncio
+from collections import deque
+
+from config import RetryConfig
+
+
+class RetryBudget:
+    """
+    Бюджет повторов и хеджей.
+
+    Каждый запрос пополняет бюджет на budget_ratio, еще budget_min_per_second начисляется со временем,
+    чтобы повторы работали и при малом потоке. Повтор или хедж тратит единицу бюджета.
+    """
+    def __init__(self, config: RetryConfig):
+        self.ratio = config.budget_ratio
+        self.min_per_second = config.budget_min_per_second
+        self.max_balance = max(10.0, self.min_per_second)
+        self.balance = self.max_balance
+        self.updated_at = 0.0
+
+    def deposit(self) -> None:
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = asyncio.get_event_loop().time()
+        self.balance = min(self.max_balance, self.balance + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class HedgingPolicy:
+    """
+    Через сколько отправлять хедж: фиксированный hedge_delay_ms или p95 времени до первого байта
+    ответа по последним WINDOW запросам, но не меньше hedge_min_delay_ms.
+    Пока замеров меньше MIN_SAMPLES, хеджирование по p95 не работает.
+    """
+    WINDOW = 1000
+    MIN_SAMPLES = 20
+    RECALC_EVERY = 100
+
+    def __init__(self, config: RetryConfig):
+        self.enabled = config.hedging
+        self.fixed_delay_s = config.hedge_delay_ms / 1000
+        self.min_delay_s = config.hedge_min_delay_ms / 1000
+        self.samples: deque[float] = deque(maxlen=self.WINDOW)
+        self.observed = 0
+        self.p95_s: float | None = None
+
+    def observe(self, ttfb_s: float) -> None:
+        self.samples.append(ttfb_s)
+        self.observed += 1
+        if self.observed % self.RECALC_EVERY == 0 or (self.p95_s is None and len(self.samples) >= self.MIN_SAMPLES):
+            ordered = sorted(self.samples)
+            self.p95_s = ordered[int(len(ordered) * 0.95)]
+
+    @property
+    def delay_s(self) -> float | None:
+        if not self.enabled:
+            return None
+        if self.fixed_delay_s:
+            return self.fixed_delay_s
+        if self.p95_s is None:
+            return None
+        return max(self.p95_s, self.min_delay_s)
@@ -21,7 +21,7 @@ class HTTPResponse:
         return request_line + crlf + headers + crlf * 2 + body
 
 
-def get_error_response(status: int, reason: str, body: str) -> bytes:
+def get_error_response(status: int, reason: str, body: str, headers: dict[bytes, bytes] | None = None) -> bytes:
     return HTTPResponse(
         version=b'HTTP/1.1',
         status=str(status).encode(),
@@ -29,5 +29,6 @@ def get_error_response(status: int, reason: str, body: str) -> bytes:
         body=body.encode(),
         headers={
             b'Content-Length': str(len(body.encode())).encode(),
+            **(headers or {}),
         }
     ).full
@@ -1,84 +1,213 @@
 import asyncio
+import os
 from typing import AsyncIterable
 
 from config import Config
-from http_utils.http_reader import BaseHTTPReader, HTTPMessageChunk
+from deadline import Deadline
+from http_utils.http_reader import HTTPMessageChunk, HTTPParseError
+from http_utils.protocol import HTTPStreamProtocol
+from http_utils.splice import (
+    SENDFILE_SUPPORTED, SPLICE_SUPPORTED, SpliceReadError, SpliceReadTimeout, SpliceWriteError, sendfile_to_socket,
+    splice_sockets
+)
 
 
 class BaseHTTPIterator:
     """
-    Обертка над BaseHTTPReader, устанавливает таймауты на чтение данных из клиента или апстрима.
+    Обертка над HTTPStreamProtocol, устанавливает таймауты на чтение данных из клиента или апстрима.
+
+    Если чанк уже разобран и лежит в очереди протокола, он отдается без ожидания.
+    Между сообщениями действует idle_timeout_s, внутри сообщения - read_timeout_s.
+    Если задан deadline_at, ожидание не продлится дольше него (таймаут запроса целиком).
     """
-    http_reader_class: type[BaseHTTPReader]
+    __slots__ = ('protocol', 'read_timeout', 'idle_timeout', 'deadline', 'deadline_at', 'messages_read')
     timeout_err: Exception
+    # Ошибка разбора, которую видит вызывающий код: по ней ответ апстрима отличается от запроса клиента.
+    parse_error_class: type[HTTPParseError] = HTTPParseError
 
-    def __init__(self, reader: asyncio.StreamReader, read_timeout_s: float):
-        self.reader = reader
+    def __init__(self, protocol: HTTPStreamProtocol, read_timeout_s: float, idle_timeout_s: float | None = None):
+        self.protocol = protocol
         self.read_timeout = read_timeout_s
-        self.http_reader = self.http_reader_class(reader)
-        self.http_iterator = self.http_reader.chunk_iterator()
+        self.idle_timeout = read_timeout_s if idle_timeout_s is None else idle_timeout_s
+        self.deadline = Deadline()
+        self.deadline_at: float | None = None
         self.messages_read = 0
 
     def __aiter__(self):
         return self
 
     async def __anext__(self) -> HTTPMessageChunk:
-        if self.reader.at_eof():
-            raise StopAsyncIteration
-        try:
-            chunk = await asyncio.wait_for(anext(self.http_iterator), self.read_timeout)
-            if chunk.is_message_end:
-                self.messages_read += 1
-            return chunk
-        except TimeoutError as exc:
-            raise self.timeout_err from exc
+        if self.protocol.chunks:
+            chunk = self.protocol.pop_chunk()
+        else:
+            timeout = self.read_timeout if self.protocol.parser.in_message else self.idle_timeout
+            if self.deadline_at is not None:
+                timeout = min(timeout, self.deadline_at - asyncio.get_event_loop().time())
+            self.deadline.start(timeout)
+            try:
+                chunk = await self.protocol.read_chunk(self.deadline)
+            except TimeoutError as exc:
+                raise self.timeout_err from exc
+            except HTTPParseError as exc:
+                if isinstance(exc, self.parse_error_class):
+                    raise
+                raise self.parse_error_class(*exc.args) from exc
+            finally:
+                self.deadline.stop()
+            if chunk is None:
+                raise StopAsyncIteration
+        if chunk.is_message_end:
+            self.messages_read += 1
+        return chunk
 
 
 class BaseConnection:
     """
-    Обертка над сырыми потоками asyncio.Stream*.
+    Обертка над HTTPStreamProtocol и его транспортом.
 
     Читает и пишет согласно таймаутам.
     """
+    __slots__ = (
+        'protocol', 'transport', 'write_deadline', 'http_iterator', 'config', 'read_timeout_s', 'write_timeout_s'
+    )
     connection_closed_err: Exception
     http_iterator_class: type[BaseHTTPIterator]
 
-    def __init__(
-            self,
-            reader: asyncio.StreamReader,
-            writer: asyncio.StreamWriter,
-            config: Config,
-    ):
-        self.reader = reader
-        self.writer = writer
+    def __init__(self, protocol: HTTPStreamProtocol, config: Config):
+        self.protocol = protocol
+        self.transport = protocol.transport
+        self.write_deadline = Deadline()
+        self.http_iterator = self.http_iterator_class(self.protocol, config.timeouts.read_ms / 1000)
+        self.apply_config(config)
+
+    def apply_config(self, config: Config) -> None:
+        """Таймауты из config, после перезагрузки конфига применяются к следующему запросу на соединении."""
+        self.config = config
         self.read_timeout_s = config.timeouts.read_ms / 1000
         self.write_timeout_s = config.timeouts.write_ms / 1000
-        self.http_iterator = self.http_iterator_class(self.reader, self.read_timeout_s)
+        idle_timeout_s = self.get_idle_timeout_s(config)
+        self.http_iterator.read_timeout = self.read_timeout_s
+        self.http_iterator.idle_timeout = self.read_timeout_s if idle_timeout_s is None else idle_timeout_s
+
+    def get_idle_timeout_s(self, config: Config) -> float | None:
+        return None
 
     def iterator(self) -> AsyncIterable[HTTPMessageChunk]:
         return self.http_iterator
 
     @property
     def addr(self) -> tuple[str, int]:
-        return self.writer.get_extra_info("socket").getpeername()
+        return self.transport.get_extra_info("peername")
+
+    @property
+    def is_closed(self) -> bool:
+        # После ошибки разбора границы сообщений потеряны, соединение нельзя переиспользовать.
+        return self.transport.is_closing() or self.protocol.eof or self.protocol.exception is not None
 
     @property
     def messages_read(self) -> int:
         return self.http_iterator.messages_read
 
-    async def write(self, response: bytes) -> None:
-        if self.writer.is_closing():
+    async def write(self, response: bytes | memoryview) -> None:
+        if self.transport.is_closing():
             raise self.connection_closed_err
-        else:
-            self.writer.write(response)
-            try:
-                await asyncio.wait_for(self.writer.drain(), self.write_timeout_s)
-            except Exception:
-                raise self.connection_closed_err
+        self.transport.write(response)
+        if self.protocol.write_paused:
+            await self.drain()
 
-    async def close(self):
-        self.writer.close()
+    async def drain(self) -> None:
+        self.write_deadline.start(self.write_timeout_s)
         try:
-            await self.writer.wait_closed()
-        except BrokenPipeError:
-            pass
+            await self.protocol.drain(self.write_deadline)
+        except Exception:
+            raise self.connection_closed_err
+        finally:
+            self.write_deadline.stop()
+
+    def set_deadline(self, deadline_at: float | None) -> None:
+        """Ожидание ответа на текущий запрос не продлится дольше deadline_at (время loop.time())."""
+        self.http_iterator.deadline_at = deadline_at
+
+    @property
+    def can_splice(self) -> bool:
+        return (
+                SPLICE_SUPPORTED
+                and self.transport.get_extra_info("sslcontext") is None
+                and self.transport.get_extra_info("socket") is not None
+        )
+
+    @property
+    def can_sendfile(self) -> bool:
+        return (
+                SENDFILE_SUPPORTED
+                and self.transport.get_extra_info("sslcontext") is None
+                and self.transport.get_extra_info("socket") is not None
+        )
+
+    async def send_file(self, fd: int, offset: int, size: int) -> None:
+        """Пишет size байт файла fd с offset: через os.sendfile, если транспорт - обычный сокет, иначе через буфер."""
+        if not self.can_sendfile:
+            await self.write(os.pread(fd, size, offset))
+            return
+        await self.flush()
+        dst_fd = self.transport.get_extra_info("socket").fileno()
+        try:
+            await sendfile_to_socket(fd, offset, dst_fd, size, self.write_timeout_s)
+        except SpliceWriteError as exc:
+            raise self.connection_closed_err from exc
+
+    async def flush(self) -> None:
+        """Ждет, пока буфер записи транспорта опустеет полностью."""
+        if not self.transport.get_write_buffer_size():
+            return
+        low, high = self.transport.get_write_buffer_limits()
+        self.transport.set_write_buffer_limits(high=0)
+        try:
+            await self.drain()
+        finally:
+            if not self.transport.is_closing():
+                self.transport.set_write_buffer_limits(high=high, low=low)
+
+    async def splice_body_to(self, destination: 'BaseConnection') -> None:
+        """
+        Пересылает остаток тела текущего сообщения в destination.
+
+        Уже разобранные чанки пишутся как обычно, остальное переносится между сокетами через os.splice.
+        Сообщение считается прочитанным целиком, итератор продолжит со следующего.
+        """
+        self.protocol.hold_reading()
+        try:
+            is_message_end = False
+            while self.protocol.chunks and not is_message_end:
+                chunk = self.protocol.pop_chunk()
+                await destination.write(chunk.chunk)
+                is_message_end = chunk.is_message_end
+
+            # Если конец тела уже разобран, парсер мог дойти до следующего конвейерного сообщения:
+            # body_left тогда относится к нему и не трогается.
+            body_left = 0
+            if not is_message_end:
+                body_left, self.protocol.parser.body_left = self.protocol.parser.body_left, 0
+            if body_left:
+                await destination.flush()
+                try:
+                    await splice_sockets(
+                        self.transport.get_extra_info("socket").fileno(),
+                        destination.transport.get_extra_info("socket").fileno(),
+                        body_left,
+                        self.read_timeout_s,
+                        destination.write_timeout_s,
+                    )
+                except SpliceReadTimeout as exc:
+                    raise self.http_iterator.timeout_err from exc
+                except SpliceReadError as exc:
+                    raise self.connection_closed_err from exc
+                except SpliceWriteError as exc:
+                    raise destination.connection_closed_err from exc
+            self.http_iterator.messages_read += 1
+        finally:
+            self.protocol.release_reading()
+
+    async def close(self):
+        self.transport.close()
+        await self.protocol.wait_closed()
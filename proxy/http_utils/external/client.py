@@ -1,5 +1,9 @@
+import asyncio
+
+from config import Config
 from http_utils.external.base import BaseConnection, BaseHTTPIterator
-from http_utils.http_reader import HTTPRequestReader
+from http_utils.http_reader import HTTPMessageHead
+from http_utils.protocol import HTTPStreamProtocol
 
 
 class ClientConnectionTimeout(TimeoutError):
@@ -11,10 +15,45 @@ class ClientConnectionClosed(ConnectionResetError):
 
 
 class ClientRequestIterator(BaseHTTPIterator):
-    http_reader_class = HTTPRequestReader
+    __slots__ = ()
     timeout_err = ClientConnectionTimeout("Timeout on getting data from resource")
 
 
 class ClientConnection(BaseConnection):
+    __slots__ = ('request_head', 'request_started_at', 'connected_at', 'host', 'state', 'upstream')
     connection_closed_err = ClientConnectionClosed("Client closed connection")
     http_iterator_class = ClientRequestIterator
+
+    def __init__(self, protocol: HTTPStreamProtocol, config: Config):
+        super().__init__(protocol, config)
+        # Текущий запрос, для access log при ответе ошибкой.
+        self.request_head: HTTPMessageHead | None = None
+        self.request_started_at = 0.0
+        # Для /debug/connections: idle - ждем запрос, admission, upstream - ждем апстрим, response - отдаем ответ,
+        # coalesced - ждем ответ на такой же запрос другого клиента.
+        self.connected_at = asyncio.get_event_loop().time()
+        # Адрес без порта - ключ клиента для rate limit.
+        self.host = self.addr[0] if self.addr else ""
+        self.state = "idle"
+        self.upstream: str | None = None
+
+    def get_idle_timeout_s(self, config: Config) -> float | None:
+        # Ожидание следующего запроса на keep-alive соединении.
+        return config.timeouts.keepalive_ms / 1000 if config.timeouts.keepalive_ms is not None else None
+
+    def set_idle(self) -> None:
+        """Запрос обработан: пока соединение ждет следующий, заголовки и буфер последнего запроса не держим."""
+        self.state, self.request_head = "idle", None
+
+    def snapshot(self, now: float) -> dict:
+        head = self.request_head
+        return {
+            "client": str(self.addr),
+            "state": self.state,
+            "age_s": round(now - self.connected_at, 3),
+            "requests": self.messages_read,
+            "method": head.method.decode() if head is not None else None,
+            "path": head.path.decode(errors="replace") if head is not None else None,
+            "request_s": round(now - self.request_started_at, 3) if self.state != "idle" else None,
+            "upstream": self.upstream,
+        }
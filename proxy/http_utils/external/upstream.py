@@ -1,5 +1,5 @@
 from http_utils.external.base import BaseHTTPIterator, BaseConnection
-from http_utils.http_reader import HTTPResponseReader
+from http_utils.http_reader import HTTPParseError
 
 
 class UpstreamConnectionTimeout(TimeoutError):
@@ -10,11 +10,21 @@ class UpstreamConnectionClosed(ConnectionResetError):
     pass
 
 
+class UpstreamResponseInvalid(HTTPParseError):
+    """Ответ апстрима не разбирается: клиенту уходит 502, соединение с апстримом не переиспользуется."""
+
+
 class UpstreamResponseIterator(BaseHTTPIterator):
-    http_reader_class = HTTPResponseReader
+    __slots__ = ()
     timeout_err = UpstreamConnectionTimeout("Timeout on getting data from resource")
+    parse_error_class = UpstreamResponseInvalid
 
 
 class UpstreamConnection(BaseConnection):
+    __slots__ = ()
     connection_closed_err = UpstreamConnectionClosed("Upstream closed connection")
     http_iterator_class = UpstreamResponseIterator
+
+    def expect_bodyless_response(self) -> None:
+        """Следующий ответ пойдет на HEAD запрос: Content-Length в нем не означает наличие тела."""
+        self.protocol.parser.expect_no_body = True
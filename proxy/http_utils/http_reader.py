@@ -1,107 +1,237 @@
-import asyncio
 import http
 import logging
 from dataclasses import dataclass
-from typing import AsyncGenerator
 
 
 class HTTPParseError(Exception):
     pass
 
 
-@dataclass
+class HTTPMessageHead:
+    """
+    Стартовая строка и заголовки HTTP сообщения.
+
+    Хранит ссылку на исходный буфер и границы заголовков, словарь заголовков не строится:
+    нужные значения ищутся в буфере по запросу через get_header.
+    """
+    __slots__ = ('buffer', 'start', 'end', 'headers_start', 'method', 'path', 'status', 'content_length', 'chunked')
+
+    def __init__(self, buffer: bytes, start: int, end: int, headers_start: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.headers_start = headers_start
+        self.method: bytes | None = None
+        self.path: bytes | None = None
+        self.status: int | None = None
+        self.content_length = 0
+        # Тело в Transfer-Encoding: chunked, content_length тогда 0.
+        self.chunked = False
+
+    @property
+    def raw(self) -> memoryview:
+        return memoryview(self.buffer)[self.start:self.end]
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.get_header(b'connection')
+        return connection is None or connection.lower() != b'close'
+
+    def get_header(self, name: bytes) -> bytes | None:
+        """Значение первого заголовка с именем name (в нижнем регистре) или None."""
+        buffer, size = self.buffer, len(name)
+        first_char = name[0]
+        pos, stop = self.headers_start, self.end - 2
+        while pos < stop:
+            line_end = buffer.find(b'\r\n', pos, self.end)
+            if (
+                    line_end - pos > size
+                    and buffer[pos] | 0x20 == first_char
+                    and buffer[pos + size] == 0x3a
+                    and buffer[pos:pos + size].lower() == name
+            ):
+                return buffer[pos + size + 1:line_end].strip()
+            pos = line_end + 2
+        return None
+
+
+@dataclass(slots=True)
 class HTTPMessageChunk:
-    chunk: bytes
+    chunk: bytes | memoryview
     is_message_start: bool
     is_message_end: bool
+    head: HTTPMessageHead | None = None
 
 
 logger = logging.getLogger(__name__)
 
 
-class BaseHTTPReader:
+class BaseHTTPParser:
     """
-    Читает из asyncio.StreamReader байты по чанкам, парсит и валидирует по формату HTTP сообщения.
+    Инкрементальный парсер HTTP/1.1 сообщений.
 
-    Таймауты обрабатываются в клиентском коде.
+    Получает байты из asyncio.Protocol.data_received через feed() и отдает HTTPMessageChunk,
+    которые ссылаются на срезы (memoryview) исходного буфера, тело не копируется.
+    Из заголовков разбираются только Content-Length и Transfer-Encoding, нужные для определения границ сообщения.
+    Тело в chunked отдается как есть, вместе с размерами чанков и трейлерами: разбираются только строки
+    размеров, чтобы найти конец сообщения.
     """
-    MIN_VERSION = b'HTTP/1.1'
-
-    def __init__(self, reader: asyncio.StreamReader):
-        self.reader = reader
-
-    async def chunk_iterator(self) -> AsyncGenerator[HTTPMessageChunk, None]:
-        try:
-            async for chunk in self._chunk_iterator():
-                yield chunk
-        except Exception:
-            raise HTTPParseError('Invalid bytes from external resource')
-
-    async def _chunk_iterator(self) -> AsyncGenerator[HTTPMessageChunk, None]:
-        while True:
-            start_line = await self._get_start_line()
-            self._validate_start_line(start_line)
-            headers = await self._get_headers()
-            yield HTTPMessageChunk(start_line + headers, is_message_start=True, is_message_end=False)
-            async for chunk in self._get_body(headers):
-                yield chunk
-
-    async def _get_headers(self) -> bytes:
-        return await self.reader.readuntil(b'\r\n\r\n')
-
-    async def _get_body(self, headers: bytes) -> AsyncGenerator[HTTPMessageChunk, None]:
-        lower_case_headers = self._get_parsed_headers(headers)
-
-        if content_length := int(lower_case_headers.get(b'content-length', 0)):
-            chunk_size = 512
-            bytes_read = 0
-            while bytes_read < content_length:
-                to_read = min(chunk_size, content_length - bytes_read)
-                is_message_end = content_length - bytes_read <= chunk_size
-                chunk = await self.reader.readexactly(to_read)
-                yield HTTPMessageChunk(chunk, is_message_start=False, is_message_end=is_message_end)
-                bytes_read += to_read
+    __slots__ = ('body_left', 'partial_head', 'chunk_state')
+    MAX_HEAD_SIZE = 64 * 1024
+    # Что ждет chunked тело: строку размера чанка, CRLF после данных чанка или строку трейлера.
+    CHUNK_SIZE, CHUNK_DATA_END, CHUNK_TRAILER = 1, 2, 3
+    HEX_DIGITS = b'0123456789abcdefABCDEF'
+
+    def __init__(self):
+        self.body_left = 0
+        self.partial_head = b''
+        self.chunk_state = 0
+
+    @property
+    def in_message(self) -> bool:
+        return bool(self.body_left or self.partial_head or self.chunk_state)
+
+    def feed(self, data: bytes) -> list[HTTPMessageChunk]:
+        if self.partial_head:
+            data, self.partial_head = self.partial_head + data, b''
+
+        chunks = []
+        view = memoryview(data)
+        pos, size = 0, len(data)
+        while pos < size:
+            if self.body_left:
+                to_read = min(self.body_left, size - pos)
+                self.body_left -= to_read
+                if not self.body_left and self.chunk_state:
+                    self.chunk_state = self.CHUNK_DATA_END
+                is_message_end = not (self.body_left or self.chunk_state)
+                chunks.append(HTTPMessageChunk(view[pos:pos + to_read], False, is_message_end))
+                pos += to_read
+                continue
+
+            if self.chunk_state:
+                line_end = data.find(b'\r\n', pos)
+                if line_end == -1:
+                    if size - pos > self.MAX_HEAD_SIZE:
+                        raise HTTPParseError('Too long chunk line')
+                    self.partial_head = data[pos:]
+                    break
+                self._parse_chunk_line(data[pos:line_end])
+                chunks.append(HTTPMessageChunk(view[pos:line_end + 2], False, not self.chunk_state))
+                pos = line_end + 2
+                continue
+
+            head_end = data.find(b'\r\n\r\n', pos)
+            if head_end == -1:
+                if size - pos > self.MAX_HEAD_SIZE:
+                    raise HTTPParseError('Too large message head')
+                self.partial_head = data[pos:]
+                break
+            head_end += 4
+            if head_end - pos > self.MAX_HEAD_SIZE:
+                raise HTTPParseError('Too large message head')
+
+            head = self._parse_head(data, pos, head_end)
+            self.body_left = head.content_length
+            self.chunk_state = self.CHUNK_SIZE if head.chunked else 0
+            chunks.append(HTTPMessageChunk(view[pos:head_end], True, not (self.body_left or head.chunked), head))
+            pos = head_end
+        return chunks
+
+    def _parse_chunk_line(self, line: bytes) -> None:
+        if self.chunk_state == self.CHUNK_DATA_END:
+            if line:
+                raise HTTPParseError('Missing CRLF after chunk data')
+            self.chunk_state = self.CHUNK_SIZE
+        elif self.chunk_state == self.CHUNK_TRAILER:
+            # Пустая строка завершает трейлеры и сообщение.
+            if not line:
+                self.chunk_state = 0
         else:
-            yield HTTPMessageChunk(b'', is_message_start=False, is_message_end=True)
+            chunk_size = line.partition(b';')[0].strip()
+            # int() принял бы и "+a", и "1_0", а апстрим прочитал бы их иначе.
+            if not chunk_size or chunk_size.strip(self.HEX_DIGITS):
+                raise HTTPParseError(f'Invalid chunk size: {chunk_size}')
+            self.body_left = int(chunk_size, 16)
+            if not self.body_left:
+                self.chunk_state = self.CHUNK_TRAILER
+
+    def _parse_head(self, data: bytes, start: int, end: int) -> HTTPMessageHead:
+        line_end = data.find(b'\r\n', start, end)
+        head = HTTPMessageHead(data, start, end, line_end + 2)
+        try:
+            self._parse_start_line(head, data[start:line_end])
+            self._parse_body_length(head)
+        except HTTPParseError:
+            raise
+        except Exception as exc:
+            raise HTTPParseError('Invalid bytes from external resource') from exc
+        return head
+
+    def _parse_body_length(self, head: HTTPMessageHead) -> None:
+        """Заполняет head.content_length и head.chunked."""
+        content_length = head.get_header(b'content-length')
+        transfer_encoding = head.get_header(b'transfer-encoding')
+        if transfer_encoding is not None:
+            # Оба заголовка сразу - признак request smuggling, а без chunked последним границу тела не найти.
+            if content_length is not None:
+                raise HTTPParseError('Both Transfer-Encoding and Content-Length')
+            if transfer_encoding.lower().rpartition(b',')[2].strip() != b'chunked':
+                raise HTTPParseError(f'Unsupported Transfer-Encoding: {transfer_encoding}')
+            head.chunked = True
+            return
+        if content_length is None:
+            return
+        if not content_length.isdigit():
+            raise HTTPParseError(f'Invalid Content-Length: {content_length}')
+        head.content_length = int(content_length)
+
+    def _parse_start_line(self, head: HTTPMessageHead, raw_start_line: bytes) -> None:
+        raise NotImplementedError
 
-    def _get_parsed_headers(self, raw_headers: bytes) -> dict[bytes, bytes]:
-        headers = {}
 
-        for header_line in raw_headers[:-4].split(b'\r\n'):
-            name, value = header_line.split(b':', 1)
-            headers[name.lower()] = value.strip()
+class HTTPRequestParser(BaseHTTPParser):
+    __slots__ = ()
+    METHODS = frozenset(method.value.encode() for method in http.HTTPMethod)
 
-        return headers
+    def _parse_start_line(self, head: HTTPMessageHead, raw_start_line: bytes) -> None:
+        method, path, version = raw_start_line.split(b' ')
 
-    async def _get_start_line(self) -> bytes:
-        return await self.reader.readuntil(b'\r\n')
+        if method not in self.METHODS:
+            raise HTTPParseError(f'Wrong method: {method}')
 
-    def _validate_start_line(self, raw_start_line: bytes) -> None:
-        raise NotImplementedError
+        if not path:
+            raise HTTPParseError(f'Empty path')
 
+        if not version.startswith(b'HTTP/'):
+            raise HTTPParseError(f'Invalid version: {version}')
 
-class HTTPRequestReader(BaseHTTPReader):
-    def _validate_start_line(self, raw_start_line: bytes) -> None:
-        method, path, version = raw_start_line[:-2].split(b' ')
-        # logger.info(f"Getting request. {method} {path} {version}")
+        head.method, head.path = method, path
 
-        if http.HTTPMethod(method.decode()) not in http.HTTPMethod:
-            raise ValueError(f'Wrong method: {method}')
 
-        if not path:
-            raise ValueError(f'Empty path')
+class HTTPResponseParser(BaseHTTPParser):
+    __slots__ = ('expect_no_body',)
+    STATUSES = frozenset(status.value for status in http.HTTPStatus)
+    BODYLESS_STATUSES = frozenset((http.HTTPStatus.NO_CONTENT, http.HTTPStatus.NOT_MODIFIED))
+
+    def __init__(self):
+        super().__init__()
+        self.expect_no_body = False
 
-        if not version.startswith(b'HTTP/') and version < self.MIN_VERSION:
-            raise ValueError(f'Invalid version: {version}')
+    def _parse_start_line(self, head: HTTPMessageHead, raw_start_line: bytes) -> None:
+        version, status = raw_start_line.split(b' ', 2)[:2]
 
+        if int(status) not in self.STATUSES:
+            raise HTTPParseError(f'Wrong status code: {status}')
 
-class HTTPResponseReader(BaseHTTPReader):
-    def _validate_start_line(self, raw_start_line: bytes) -> None:
-        version, status, reason = raw_start_line[:-2].split(b' ', 2)
-        # logger.info(f"Getting response. {status} {reason}")
+        if not version.startswith(b'HTTP/'):
+            raise HTTPParseError(f'Invalid version: {version}')
 
-        if http.HTTPStatus(int(status)) not in http.HTTPStatus:
-            raise ValueError(f'Wrong status code: {status}')
+        head.status = int(status)
 
-        if not version.startswith(b'HTTP/') and version < self.MIN_VERSION:
-            raise ValueError(f'Invalid version: {version}')
+    def _parse_body_length(self, head: HTTPMessageHead) -> None:
+        # Ответ на HEAD и ответы 204/304 не имеют тела, даже если переданы Content-Length или Transfer-Encoding.
+        expect_no_body, self.expect_no_body = self.expect_no_body, False
+        if expect_no_body or head.status in self.BODYLESS_STATUSES:
+            return
+        super()._parse_body_length(head)
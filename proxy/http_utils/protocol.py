@@ -0,0 +1,201 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+from deadline import Deadline
+
+from http_utils.http_reader import BaseHTTPParser, HTTPMessageChunk, HTTPParseError, HTTPRequestParser, \
+    HTTPResponseParser
+
+
+class HTTPStreamProtocol(asyncio.Protocol):
+    """
+    Замена пары StreamReader/StreamWriter для HTTP соединения.
+
+    Байты из data_received сразу разбираются парсером, готовые HTTPMessageChunk копятся в очереди
+    до чтения. Если в очереди больше read_window байт, чтение из сокета приостанавливается.
+    Подряд идущие куски тела одного сообщения отдаются одним чанком размером до read_window.
+    Запись идет напрямую в транспорт, drain нужен только после pause_writing.
+    Очередь чанков создается при приходе данных и освобождается, когда опустеет: простаивающее
+    keep-alive соединение ее не держит.
+    """
+    __slots__ = (
+        'on_connection_made', 'read_window', 'handler_task', 'transport', 'parser', 'chunks', 'buffered', 'exception',
+        'message_started_at', 'created_at', 'eof', 'read_paused', 'read_held', 'write_paused', 'read_waiter',
+        'drain_waiter', 'lost', 'closed_waiter',
+    )
+    parser_class: type[BaseHTTPParser]
+    READ_WINDOW = 256 * 1024
+
+    def __init__(
+            self,
+            on_connection_made: Callable[['HTTPStreamProtocol'], Awaitable[None]] | None = None,
+            read_window: int = READ_WINDOW,
+    ):
+        self.on_connection_made = on_connection_made
+        self.read_window = read_window
+        self.handler_task: asyncio.Task | None = None
+        self.transport: asyncio.Transport | None = None
+        self.parser = self.parser_class()
+        self.chunks: deque[HTTPMessageChunk] | None = None
+        self.buffered = 0
+        self.exception: Exception | None = None
+        # Время прихода первых байт последнего начатого сообщения, для метрики чтения заголовков.
+        self.message_started_at = 0.0
+        # Протокол создается сразу после установки TCP соединения, для TLS - до handshake.
+        self.created_at = asyncio.get_event_loop().time()
+        self.eof = False
+        self.read_paused = False
+        self.read_held = False
+        self.write_paused = False
+        self.read_waiter: asyncio.Future | None = None
+        self.drain_waiter: asyncio.Future | None = None
+        self.lost = False
+        self.closed_waiter: asyncio.Future | None = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        if self.on_connection_made is not None:
+            self.handler_task = asyncio.get_running_loop().create_task(self.on_connection_made(self))
+
+    def data_received(self, data: bytes) -> None:
+        if not self.parser.in_message:
+            self.message_started_at = asyncio.get_running_loop().time()
+        try:
+            chunks = self.parser.feed(data)
+        except HTTPParseError as exc:
+            self.exception = exc
+            self.read_held = True
+            self._update_reading()
+        else:
+            if self.chunks is None:
+                self.chunks = deque(chunks)
+            else:
+                self.chunks.extend(chunks)
+            self.buffered += len(data)
+            if self.buffered > self.read_window and not self.read_paused:
+                self.read_paused = True
+                self._update_reading()
+        self._wakeup(self.read_waiter)
+
+    def eof_received(self) -> bool:
+        self.eof = True
+        self._wakeup(self.read_waiter)
+        # Оставляем транспорт открытым на запись: клиент мог закрыть только свою половину соединения.
+        # TLS транспорт полузакрытия не поддерживает и закрывается сам.
+        return self.transport.get_extra_info("sslcontext") is None
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.eof = True
+        self._wakeup(self.read_waiter)
+        if self.drain_waiter is not None and not self.drain_waiter.done():
+            self.drain_waiter.set_exception(ConnectionResetError('Connection lost'))
+        self.lost = True
+        self._wakeup(self.closed_waiter)
+
+    def pause_writing(self) -> None:
+        self.write_paused = True
+
+    def resume_writing(self) -> None:
+        self.write_paused = False
+        self._wakeup(self.drain_waiter)
+
+    def pop_chunk(self) -> HTTPMessageChunk:
+        chunk = self.chunks.popleft()
+        size = len(chunk.chunk)
+        if not chunk.is_message_end and self.chunks and not self.chunks[0].is_message_start:
+            parts = [chunk.chunk]
+            while self.chunks and not self.chunks[0].is_message_start:
+                if size + len(self.chunks[0].chunk) > self.read_window:
+                    break
+                next_chunk = self.chunks.popleft()
+                parts.append(next_chunk.chunk)
+                size += len(next_chunk.chunk)
+                if next_chunk.is_message_end:
+                    break
+            if len(parts) > 1:
+                chunk = HTTPMessageChunk(b''.join(parts), chunk.is_message_start, next_chunk.is_message_end, chunk.head)
+
+        if not self.chunks:
+            self.chunks = None
+        self.buffered -= size
+        if self.read_paused and self.buffered <= self.read_window // 2:
+            self.read_paused = False
+            self._update_reading()
+        return chunk
+
+    def hold_reading(self) -> None:
+        """Останавливает чтение из транспорта независимо от заполнения очереди (например, на время splice)."""
+        self.read_held = True
+        self._update_reading()
+
+    def release_reading(self) -> None:
+        self.read_held = False
+        self._update_reading()
+
+    def _update_reading(self) -> None:
+        if self.transport.is_closing():
+            return
+        if self.read_paused or self.read_held:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
+
+    async def read_chunk(self, deadline: Deadline | None = None) -> HTTPMessageChunk | None:
+        """
+        Следующий чанк сообщения или None, если соединение закрыто между сообщениями.
+
+        По истечении deadline бросает TimeoutError.
+        """
+        while not self.chunks:
+            if self.exception is not None:
+                raise self.exception
+            if self.eof:
+                if self.parser.in_message:
+                    raise HTTPParseError('Connection closed in the middle of message')
+                return None
+            self.read_waiter = asyncio.get_running_loop().create_future()
+            try:
+                if deadline is None:
+                    await self.read_waiter
+                else:
+                    await deadline.wait(self.read_waiter)
+            finally:
+                self.read_waiter = None
+        return self.pop_chunk()
+
+    async def drain(self, deadline: Deadline | None = None) -> None:
+        if self.transport.is_closing():
+            raise ConnectionResetError('Connection lost')
+        if not self.write_paused:
+            return
+        self.drain_waiter = asyncio.get_running_loop().create_future()
+        try:
+            if deadline is None:
+                await self.drain_waiter
+            else:
+                await deadline.wait(self.drain_waiter)
+        finally:
+            self.drain_waiter = None
+
+    async def wait_closed(self) -> None:
+        if self.lost:
+            return
+        if self.closed_waiter is None:
+            self.closed_waiter = asyncio.get_running_loop().create_future()
+        await self.closed_waiter
+
+    @staticmethod
+    def _wakeup(waiter: asyncio.Future | None) -> None:
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+class HTTPRequestProtocol(HTTPStreamProtocol):
+    __slots__ = ()
+    parser_class = HTTPRequestParser
+
+
+class HTTPResponseProtocol(HTTPStreamProtocol):
+    __slots__ = ()
+    parser_class = HTTPResponseParser
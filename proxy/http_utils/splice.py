@@ -0,0 +1,112 @@
+import asyncio
+import fcntl
+import os
+
+from deadline import wait_future
+
+SPLICE_SUPPORTED = hasattr(os, 'splice')
+SENDFILE_SUPPORTED = hasattr(os, 'sendfile')
+
+PIPE_SIZE = 1024 * 1024
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+class SpliceReadError(Exception):
+    pass
+
+
+class SpliceWriteError(Exception):
+    pass
+
+
+class SpliceReadTimeout(SpliceReadError):
+    pass
+
+
+class SpliceWriteTimeout(SpliceWriteError):
+    pass
+
+
+async def splice_sockets(src_fd: int, dst_fd: int, size: int, read_timeout_s: float, write_timeout_s: float) -> None:
+    """
+    Переносит size байт из сокета src_fd в сокет dst_fd через pipe с помощью os.splice, данные не попадают
+    в пространство пользователя.
+
+    Сокеты должны быть неблокирующими, а их транспорты не должны читать и писать на время переноса.
+    Готовность ждем через add_reader/add_writer на дубликатах дескрипторов: исходные заняты транспортами.
+    """
+    loop = asyncio.get_running_loop()
+    read_pipe, write_pipe = os.pipe()
+    src_dup, dst_dup = os.dup(src_fd), os.dup(dst_fd)
+    try:
+        try:
+            fcntl.fcntl(write_pipe, F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError:
+            pass
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        while size:
+            try:
+                in_pipe = os.splice(src_fd, write_pipe, min(size, PIPE_SIZE), flags=flags)
+            except BlockingIOError:
+                await _wait_ready(loop, loop.add_reader, loop.remove_reader, src_dup, read_timeout_s, SpliceReadTimeout)
+                continue
+            except OSError as exc:
+                raise SpliceReadError('Source connection failed during splice') from exc
+            if not in_pipe:
+                raise SpliceReadError('Source connection closed during splice')
+            size -= in_pipe
+
+            while in_pipe:
+                try:
+                    in_pipe -= os.splice(read_pipe, dst_fd, in_pipe, flags=flags)
+                except BlockingIOError:
+                    await _wait_ready(
+                        loop, loop.add_writer, loop.remove_writer, dst_dup, write_timeout_s, SpliceWriteTimeout
+                    )
+                except OSError as exc:
+                    raise SpliceWriteError('Destination connection failed during splice') from exc
+    finally:
+        for fd in (read_pipe, write_pipe, src_dup, dst_dup):
+            os.close(fd)
+
+
+async def sendfile_to_socket(file_fd: int, offset: int, dst_fd: int, size: int, write_timeout_s: float) -> None:
+    """
+    Отправляет size байт файла file_fd начиная с offset в сокет dst_fd через os.sendfile, без копирования
+    в пространство пользователя. Условия для сокета те же, что у splice_sockets.
+    """
+    loop = asyncio.get_running_loop()
+    dst_dup = os.dup(dst_fd)
+    try:
+        while size:
+            try:
+                sent = os.sendfile(dst_fd, file_fd, offset, size)
+            except BlockingIOError:
+                await _wait_ready(
+                    loop, loop.add_writer, loop.remove_writer, dst_dup, write_timeout_s, SpliceWriteTimeout
+                )
+                continue
+            except OSError as exc:
+                raise SpliceWriteError('Destination connection failed during sendfile') from exc
+            if not sent:
+                raise SpliceWriteError('File ended before sendfile completed')
+            offset += sent
+            size -= sent
+    finally:
+        os.close(dst_dup)
+
+
+async def _wait_ready(loop, add, remove, fd: int, timeout_s: float, timeout_err: type[Exception]) -> None:
+    waiter = loop.create_future()
+    add(fd, _set_ready, waiter)
+    try:
+        await wait_future(waiter, timeout_s)
+    except TimeoutError as exc:
+        raise timeout_err from exc
+    finally:
+        remove(fd)
+
+
+def _set_ready(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
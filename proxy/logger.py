@@ -1,8 +1,16 @@
+import atexit
+import json
 import logging
-import logging.config
+import queue
+import random
 import sys
+from logging.handlers import QueueHandler, QueueListener
 
+from config import LoggingConfig
 from context import client_addr_var
+from metrics import LOG_DROPPED
+
+ACCESS_LOGGER = "access"
 
 
 class LoggingFilter(logging.Filter):
@@ -11,40 +19,97 @@ class LoggingFilter(logging.Filter):
         return True
 
 
-def setup_logging(level=logging.INFO):
-    logging.config.dictConfig({
-        "version": 1,
-        "disable_existing_loggers": False,
-
-        "formatters": {
-            "default": {
-                "format": (
-                    "[%(asctime)s "
-                    "%(levelname)s "
-                    "%(name)s "
-                    "{client:%(client_addr)s}] "
-                    "%(message)s "
-                ),
-            },
-        },
-
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "stream": sys.stdout,
-                "formatter": "default",
-                "filters": ["context"],
-            },
-        },
-
-        "filters": {
-            "context": {
-                "()": LoggingFilter,
-            }
-        },
-
-        "root": {
-            "level": level,
-            "handlers": ["console"],
-        },
-    })
+class DroppingQueueHandler(QueueHandler):
+    """
+    Кладет записи в ограниченную очередь, форматирование и запись в stdout идут в потоке QueueListener.
+
+    Если очередь заполнена (stdout не успевает), запись отбрасывается и считается в LOG_DROPPED,
+    event loop не ждет.
+    """
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Обработчик в том же процессе: запись не сериализуется, форматировать ее здесь не нужно.
+        return record
+
+
+class ProxyFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        if record.name == ACCESS_LOGGER:
+            return json.dumps({"time": self.formatTime(record), **record.msg}, separators=(',', ':'))
+        return super().format(record)
+
+
+def setup_logging(config: LoggingConfig | None = None):
+    config = config or LoggingConfig()
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=config.queue_size)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(ProxyFormatter(
+        "[%(asctime)s "
+        "%(levelname)s "
+        "%(name)s "
+        "{client:%(client_addr)s}] "
+        "%(message)s "
+    ))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(LoggingFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    apply_logging_config(config)
+
+    listener = QueueListener(log_queue, console)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def apply_logging_config(config: LoggingConfig) -> None:
+    """Уровни логгеров, меняются и при перезагрузке конфига. queue_size применяется только при запуске."""
+    logging.getLogger().setLevel(config.level.upper())
+    logging.getLogger(ACCESS_LOGGER).setLevel(logging.INFO if config.access_log else logging.CRITICAL)
+
+
+class AccessLog:
+    """
+    Одна структурированная строка на запрос в логгер access.
+
+    Пишется доля sample_rate запросов и все ответы 5xx. Строка собирается в JSON в потоке логирования.
+    """
+    def __init__(self, config: LoggingConfig):
+        self.sample_rate = config.access_log_sample_rate
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+
+    def log(
+            self,
+            head: 'HTTPMessageHead | None',
+            status: int,
+            duration_s: float,
+            upstream: str | None = None,
+            bytes_sent: int = 0,
+            upstream_s: float | None = None,
+            cache: bool = False,
+            coalesced: bool = False,
+    ) -> None:
+        if status < 500 and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        self.logger.info({
+            "client": client_addr_var.get(),
+            "method": head.method.decode() if head is not None else None,
+            "path": head.path.decode(errors="replace") if head is not None else None,
+            "status": status,
+            "upstream": upstream,
+            "bytes": bytes_sent,
+            "duration_ms": round(duration_s * 1000, 3),
+            "upstream_ms": round(upstream_s * 1000, 3) if upstream_s is not None else None,
+            "cache": cache,
+            "coalesced": coalesced,
+        })
@@ -1,21 +1,36 @@
 import asyncio
+import signal
 import sys
 
+from diagnostics import Diagnostics
 from logger import setup_logging
-from metrics import start_metrics_server
+from metrics import monitor_process, start_metrics_server
 from proxy_server import ProxyServer
+from reload import ConfigReloader
+from workers import WorkerSupervisor
 
-from config import ConfigLoader
+from config import Config, ConfigLoader
 
 
-async def run(config_path: str):
-    setup_logging()
-    config = ConfigLoader(config_path).get_config()
+async def run(config: Config, config_path: str):
+    server = ProxyServer(config)
+    diagnostics = Diagnostics(config.debug)
+    ConfigReloader(config_path, server.reload, diagnostics.reload).install()
     await asyncio.gather(
-        ProxyServer(config).start_server(),
-        start_metrics_server()
+        server.start_server(),
+        start_metrics_server(),
+        monitor_process(),
+        diagnostics.run(),
     )
 
 
 if __name__ == '__main__':
-    asyncio.run(run(sys.argv[1]))
+    config_path = sys.argv[1]
+    config = ConfigLoader(config_path).get_config()
+    setup_logging(config.logging)
+    # До установки обработчика в event loop SIGHUP не должен завершать процесс.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if config.workers > 1:
+        asyncio.run(WorkerSupervisor(config, config_path).run())
+    else:
+        asyncio.run(run(config, config_path))
@@ -1,7 +1,19 @@
 import asyncio
+import gzip
+import os
+from bisect import bisect_left
+from functools import partial
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl, urlsplit
+
 import psutil
 
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, Gauge
+from prometheus_client import (
+    Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, Gauge, CollectorRegistry, REGISTRY, PROCESS_COLLECTOR
+)
+
+# Процессные метрики выставляем сами (см. monitor_process), чтобы они суммировались по воркерам.
+REGISTRY.unregister(PROCESS_COLLECTOR)
 
 UPSTREAM_TIMEOUTS = Counter(
     "proxy_upstream_errors_total",
@@ -20,58 +32,363 @@ REQUEST_LATENCY = Histogram(
     buckets=(0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
 )
 
+PHASE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+CLIENT_HEADER_READ = Histogram(
+    "proxy_client_header_read_seconds",
+    "Time from first byte of request to parsed request head",
+    buckets=PHASE_BUCKETS,
+)
+UPSTREAM_TTFB = Histogram(
+    "proxy_upstream_ttfb_seconds",
+    "Time from getting upstream connection to first byte of response",
+    ["upstream"],
+    buckets=PHASE_BUCKETS,
+)
+UPSTREAM_STREAMING = Histogram(
+    "proxy_upstream_response_streaming_seconds",
+    "Time from first to last byte of response sent to client",
+    ["upstream"],
+    buckets=PHASE_BUCKETS,
+)
+
 POOL_LATENCY = Histogram(
     "pool_latency_seconds",
     "pool latency",
     buckets=(0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
 )
 
-ACTIVE_TASKS = Gauge("active_tasks", "Number of active asyncio tasks")
-CPU_USER = Gauge('process_cpu_seconds_total', 'CPU user time')
-MEM_RSS = Gauge('process_resident_memory_bytes', 'Resident memory in bytes')
-MEM_VIRTUAL = Gauge('process_virtual_memory_bytes', 'Virtual memory in bytes')
+ADMISSION_REJECTED = Counter(
+    "proxy_admission_rejected_total",
+    "Requests and connections rejected with 503",
+    ["reason"]
+)
+ADMISSION_LIMIT = Gauge("proxy_admission_limit", "Concurrent requests limit", multiprocess_mode="livesum")
+ADMISSION_QUEUE = Gauge("proxy_admission_queue", "Requests waiting for admission", multiprocess_mode="livesum")
+
+RATE_LIMITED = Counter("proxy_rate_limited_total", "Requests and connections rejected with 429", ["scope"])
+RATE_LIMIT_CLIENTS = Gauge("proxy_rate_limit_clients", "Clients in rate limiter table", multiprocess_mode="livesum")
+
+PIPELINED_REQUESTS = Counter(
+    "proxy_pipelined_requests_total",
+    "Requests sent to upstream before response to previous request on the same connection",
+)
+
+COALESCED_REQUESTS = Counter(
+    "proxy_coalesced_requests_total",
+    "Requests sent to upstream for identical concurrent requests (leader) and answered with their response (follower)",
+    ["role"],
+)
+
+RETRIES = Counter("proxy_retries_total", "Idempotent requests retried after upstream error")
+HEDGES = Counter("proxy_hedges_total", "Hedged requests sent to another upstream")
+HEDGE_WINS = Counter("proxy_hedge_wins_total", "Hedged requests answered before the original")
+RETRY_BUDGET_EXHAUSTED = Counter(
+    "proxy_retry_budget_exhausted_total",
+    "Retries and hedges skipped because retry budget is empty",
+)
+
+POOL_SIZE = Gauge(
+    "proxy_pool_connections",
+    "Upstream connections owned by pool: idle, busy and dialing",
+    ["upstream"],
+    multiprocess_mode="livesum",
+)
+POOL_IDLE = Gauge("proxy_pool_idle_connections", "Idle upstream connections", ["upstream"], multiprocess_mode="livesum")
+POOL_WAITERS = Gauge(
+    "proxy_pool_waiters",
+    "Requests waiting for upstream connection",
+    ["upstream"],
+    multiprocess_mode="livesum",
+)
+POOL_IN_FLIGHT = Gauge(
+    "proxy_upstream_in_flight_requests",
+    "Requests sent to upstream and waiting for connection to it",
+    ["upstream"],
+    multiprocess_mode="livesum",
+)
+POOL_DIAL_LATENCY = Histogram(
+    "proxy_pool_dial_latency_seconds",
+    "Time to establish upstream connection",
+    ["upstream"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2)
+)
+
+CACHE_HITS = Counter("proxy_cache_hits_total", "Responses served from cache")
+CACHE_MISSES = Counter("proxy_cache_misses_total", "Cacheable requests not found in cache")
+CACHE_EVICTIONS = Counter("proxy_cache_evictions_total", "Cache entries evicted to fit memory budget")
+CACHE_BYTES = Gauge("proxy_cache_bytes", "Memory used by cached responses", multiprocess_mode="livesum")
+
+RESPONSE_BUFFERED = Counter(
+    "proxy_response_buffered_bytes_total",
+    "Upstream response bytes buffered because client was slower than upstream",
+    ["storage"],
+)
+RESPONSE_BUFFER_BYTES = Gauge(
+    "proxy_response_buffer_bytes",
+    "Buffered response bytes not yet sent to clients",
+    ["storage"],
+    multiprocess_mode="livesum",
+)
+
+COMPRESSION_BYTES = Counter(
+    "proxy_compression_bytes_total",
+    "Response body bytes before (in) and after (out) compression",
+    ["direction"],
+)
+COMPRESSION_CPU = Counter("proxy_compression_cpu_seconds_total", "CPU time spent compressing responses")
+COMPRESSED_RESPONSES = Counter(
+    "proxy_compressed_responses_total",
+    "Compressed responses: compressed while streaming from upstream or taken as compressed variant from cache",
+    ["source"],
+)
+
+TLS_HANDSHAKES = Counter(
+    "proxy_tls_handshakes_total",
+    "Completed TLS handshakes with clients and upstreams, resumed - without full handshake",
+    ["side", "resumed"],
+)
+TLS_HANDSHAKE_LATENCY = Histogram(
+    "proxy_tls_handshake_seconds",
+    "Time from TCP connection to completed TLS handshake",
+    ["side"],
+    buckets=PHASE_BUCKETS,
+)
+
+UPSTREAM_HEALTHY = Gauge(
+    "proxy_upstream_healthy",
+    "Upstream is in rotation (1) or ejected (0)",
+    ["upstream"],
+    multiprocess_mode="livemin",
+)
+UPSTREAM_EJECTIONS = Counter(
+    "proxy_upstream_ejections_total",
+    "Upstream ejections after consecutive failures",
+    ["upstream"]
+)
+HEALTH_CHECK_FAILURES = Counter(
+    "proxy_health_check_failures_total",
+    "Failed active health checks",
+    ["upstream"]
+)
+
+# Метрики с лейблом upstream: лейблы апстрима, удаленного из конфига, удаляются (remove_upstream_metrics).
+UPSTREAM_METRICS = (
+    UPSTREAM_TIMEOUTS, REQUEST_LATENCY, UPSTREAM_TTFB, UPSTREAM_STREAMING, POOL_SIZE, POOL_IDLE, POOL_WAITERS,
+    POOL_IN_FLIGHT, POOL_DIAL_LATENCY, UPSTREAM_HEALTHY, UPSTREAM_EJECTIONS, HEALTH_CHECK_FAILURES,
+)
+
+LOOP_LAG = Histogram(
+    "proxy_event_loop_lag_seconds",
+    "Delay of event loop timer callbacks",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+SLOW_CALLBACKS = Counter("proxy_slow_callbacks_total", "Event loop callbacks slower than debug.slow_callback_ms")
+GC_PAUSE = Histogram(
+    "proxy_gc_pause_seconds",
+    "Garbage collector pauses",
+    ["generation"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+
+LOG_DROPPED = Counter("proxy_log_records_dropped_total", "Log records dropped because log queue is full")
+
+# multiprocess_mode учитывается только в режиме нескольких воркеров (PROMETHEUS_MULTIPROC_DIR).
+CLIENT_CONNECTIONS = Gauge("proxy_client_connections", "Open client connections", multiprocess_mode="livesum")
+# Считается из состояния прокси, а не по asyncio.all_tasks(): обход всех задач растет с числом соединений.
+ACTIVE_TASKS = Gauge(
+    "active_tasks", "Client connection tasks and known background tasks", multiprocess_mode="livesum"
+)
+CPU_USER = Gauge('process_cpu_seconds_total', 'CPU user time', multiprocess_mode="sum")
+MEM_RSS = Gauge('process_resident_memory_bytes', 'Resident memory in bytes', multiprocess_mode="livesum")
+MEM_VIRTUAL = Gauge('process_virtual_memory_bytes', 'Virtual memory in bytes', multiprocess_mode="livesum")
+
+# Изменения метрик на пути запроса копятся в памяти процесса и переносятся в prometheus_client в flush_metrics:
+# без блокировки и, в multiprocess-режиме, без записи в mmap-файл на каждое наблюдение.
+_local_metrics: list['LocalCounter | LocalHistogram'] = []
+_collectors: list[Callable[[], None]] = []
+
+# Пути /debug на порту метрик: обработчик получает параметры запроса и возвращает Content-Type и тело.
+AdminHandler = Callable[[dict[str, str]], Awaitable[tuple[bytes, bytes]]]
+_admin_routes: dict[str, AdminHandler] = {}
+
+
+class LocalCounter:
+    """Счетчик поверх child метрики prometheus_client (metric.labels(...) или метрики без лейблов)."""
+    __slots__ = ('child', 'value')
+
+    def __init__(self, child: Counter):
+        self.child = child
+        self.value = 0.0
+        _local_metrics.append(self)
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def flush(self) -> None:
+        if self.value:
+            self.child.inc(self.value)
+            self.value = 0.0
+
+    def close(self) -> None:
+        """Переносит накопленное в child и больше не переносится в flush_metrics."""
+        self.flush()
+        _local_metrics.remove(self)
+
+
+class LocalHistogram:
+    """
+    Гистограмма поверх child метрики: наблюдения раскладываются по бакетам локально, в child - пачкой.
+
+    Публичного API для добавления нескольких наблюдений у Histogram нет, flush пишет в его внутренние поля
+    (_upper_bounds, _sum, _buckets), как это делает Histogram.observe. Поэтому версия prometheus_client
+    ограничена в requirements.txt, а несовместимая версия обнаруживается при создании метрики.
+    """
+    __slots__ = ('child', 'upper_bounds', 'counts', 'sum')
+
+    def __init__(self, child: Histogram):
+        if not all(hasattr(child, name) for name in ('_upper_bounds', '_sum', '_buckets')):
+            raise RuntimeError("Unsupported prometheus_client version: Histogram internals changed")
+        self.child = child
+        self.upper_bounds = child._upper_bounds
+        self.counts = [0] * len(self.upper_bounds)
+        self.sum = 0.0
+        _local_metrics.append(self)
+
+    def observe(self, amount: float) -> None:
+        self.sum += amount
+        self.counts[bisect_left(self.upper_bounds, amount)] += 1
+
+    def flush(self) -> None:
+        if not any(self.counts):
+            return
+        self.child._sum.inc(self.sum)
+        for bucket, count in zip(self.child._buckets, self.counts):
+            if count:
+                bucket.inc(count)
+        self.counts = [0] * len(self.upper_bounds)
+        self.sum = 0.0
 
-process = psutil.Process()
+    def close(self) -> None:
+        self.flush()
+        _local_metrics.remove(self)
 
 
-async def monitor_active_tasks(interval: float = 1.0):
+def register_collector(collector: Callable[[], None]) -> None:
+    """collector вызывается перед отдачей метрик и выставляет gauge из состояния прокси."""
+    _collectors.append(collector)
+
+
+def unregister_collector(collector: Callable[[], None]) -> None:
+    _collectors.remove(collector)
+
+
+def remove_upstream_metrics(name: str) -> None:
+    """
+    Удаляет лейблы апстрима из метрик UPSTREAM_METRICS.
+
+    В multiprocess-режиме prometheus_client удалять лейблы не умеет: значения лежат в файлах воркеров.
+    Там gauge апстрима обнуляются, а счетчики и гистограммы остаются с последними значениями.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        for metric in UPSTREAM_METRICS:
+            if isinstance(metric, Gauge):
+                metric.labels(upstream=name).set(0)
+        return
+    for metric in UPSTREAM_METRICS:
+        metric.remove(name)
+
+
+def register_admin_route(path: str, handler: AdminHandler) -> None:
+    _admin_routes[path] = handler
+
+
+def flush_metrics() -> None:
+    for metric in _local_metrics:
+        metric.flush()
+    for collector in _collectors:
+        collector()
+
+
+async def monitor_process(interval: float = 1.0):
+    # Процесс берем здесь, а не при импорте: в воркере pid отличается от pid супервизора.
+    process = psutil.Process()
     while True:
-        tasks = asyncio.all_tasks(asyncio.get_event_loop())
-        active_count = sum(1 for t in tasks if not t.done())
-        ACTIVE_TASKS.set(active_count)
+        # В multiprocess-режиме метрики отдает супервизор, локальные значения воркера переносятся по таймеру.
+        flush_metrics()
         CPU_USER.set(process.cpu_times().user)
-        MEM_RSS.set(process.memory_info().rss)
-        MEM_VIRTUAL.set(process.memory_info().vms)
+        memory = process.memory_info()
+        MEM_RSS.set(memory.rss)
+        MEM_VIRTUAL.set(memory.vms)
         await asyncio.sleep(interval)
 
 
-async def handle_metrics(reader, writer):
+GZIP_LEVEL = 1
+
+
+async def handle_metrics(reader, writer, registry: CollectorRegistry = REGISTRY):
+    """
+    Отвечает на запросы соединения, пока клиент не закроет его или не попросит Connection: close.
+
+    Пути из register_admin_route отдают диагностику, остальные - метрики.
+    """
     try:
-        await reader.readuntil(b"\r\n\r\n")
-    except asyncio.IncompleteReadError:
-        writer.close()
-        return
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            headers = {
+                name.strip().lower(): value.strip().lower()
+                for name, _, value in (line.partition(":") for line in header_lines if line)
+            }
+            connection = headers.get("connection", "")
+            keep_alive = connection != "close" and (request_line.endswith("1.1") or connection == "keep-alive")
 
-    body = generate_latest()
-    response = (
-            b"HTTP/1.1 200 OK\r\n"
-            b"Content-Type: " + CONTENT_TYPE_LATEST.encode() + (
-                    b"\r\n"
-                    b"Content-Length: " + str(len(body)).encode() +
-                    b"\r\n"
-                    b"Connection: close"
-                    b"\r\n\r\n"
+            target = urlsplit(request_line.split(" ")[1] if " " in request_line else "/")
+            status, content_type, body = await get_admin_response(target.path, dict(parse_qsl(target.query)), registry)
+            extra_headers = b""
+            if "gzip" in headers.get("accept-encoding", ""):
+                # Скрейп большого числа серий: минимальное сжатие почти так же эффективно для текста метрик и дешевле.
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+                extra_headers = b"Content-Encoding: gzip\r\n"
+            response = (
+                    b"HTTP/1.1 " + status + b"\r\n"
+                    b"Content-Type: " + content_type + b"\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                    + extra_headers
+                    + (b"Connection: keep-alive" if keep_alive else b"Connection: close")
+                    + b"\r\n\r\n"
+                    + body
             )
-            + body
-    )
+            writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
 
-    writer.write(response)
-    await writer.drain()
-    writer.close()
+
+async def get_admin_response(
+        path: str,
+        params: dict[str, str],
+        registry: CollectorRegistry,
+) -> tuple[bytes, bytes, bytes]:
+    handler = _admin_routes.get(path)
+    if handler is None:
+        flush_metrics()
+        return b"200 OK", CONTENT_TYPE_LATEST.encode(), generate_latest(registry)
+    try:
+        content_type, body = await handler(params)
+    except ValueError as exc:
+        return b"400 Bad Request", b"text/plain; charset=utf-8", str(exc).encode()
+    return b"200 OK", content_type, body
 
 
-async def start_metrics_server():
-    server = await asyncio.start_server(handle_metrics, "0.0.0.0", 9100)
-    asyncio.create_task(monitor_active_tasks())
+async def start_metrics_server(registry: CollectorRegistry = REGISTRY, port: int = 9100):
+    server = await asyncio.start_server(partial(handle_metrics, registry=registry), "0.0.0.0", port)
     async with server:
         await server.serve_forever()
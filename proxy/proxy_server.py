@@ -1,55 +1,242 @@
 import asyncio
+import json
 import logging
+from collections import Counter
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
 
+from admission import AdmissionController, AdmissionRejected, AdmissionTicket
+from buffering import ResponseBuffering
+from cache import ResponseCache
+from coalescing import Flight, FlightAbandoned, FlightFailed, RequestCoalescer
+from compression import ResponseCompression
 from config import Config
+from deadline import Deadline
 from http_utils.error_responses import get_error_response
 from http_utils.external.base import BaseConnection
-from http_utils.http_reader import HTTPParseError
-from http_utils.external.upstream import UpstreamConnectionTimeout
-from metrics import REQUEST_LATENCY, UPSTREAM_TIMEOUTS, POOL_TIMEOUTS
-from upstream_pool import PoolConnectionError, RoundRobinUpstreamPool, PoolMember
+from http_utils.http_reader import HTTPMessageChunk, HTTPMessageHead, HTTPParseError
+from health import HealthChecker
+from hedging import HedgingPolicy, RetryBudget
+from http_utils.external.upstream import UpstreamConnectionTimeout, UpstreamConnectionClosed, UpstreamResponseInvalid
+from logger import AccessLog, apply_logging_config
+from ratelimit import ClientRateLimiter
+from routing import Router
+from tls import HandshakeStats, create_server_context
+from metrics import (
+    POOL_TIMEOUTS, ADMISSION_REJECTED, RETRIES, HEDGES, HEDGE_WINS, RETRY_BUDGET_EXHAUSTED, CLIENT_CONNECTIONS,
+    ACTIVE_TASKS, CLIENT_HEADER_READ, RATE_LIMITED, RATE_LIMIT_CLIENTS, PIPELINED_REQUESTS, LocalCounter, LocalHistogram,
+    register_admin_route, register_collector
+)
+from upstream_pool import PoolConnectionError, UpstreamPool, PoolMember, Upstream
 from http_utils.external.client import ClientConnectionTimeout, ClientConnectionClosed, ClientConnection
+from http_utils.protocol import HTTPRequestProtocol
 from context import client_addr_var
 
 logger = logging.getLogger(__name__)
 
 
 class ProxyServer:
+    IDEMPOTENT_METHODS = frozenset((b'GET', b'HEAD', b'OPTIONS'))
+    # Ошибки попытки, после которых идемпотентный запрос можно отправить на другой апстрим.
+    RETRYABLE_ERRORS = (
+        PoolConnectionError, UpstreamConnectionTimeout, UpstreamConnectionClosed, UpstreamResponseInvalid
+    )
+    # Секции конфига, изменения которых применяются только после перезапуска.
+    RESTART_REQUIRED = ("listen", "workers", "cache", "tls")
+
     def __init__(self, config: Config):
         self.config = config
-        self.conn_semaphore = asyncio.Semaphore(config.limits.max_client_conns)
+        self.client_connections: set[ClientConnection] = set()
+        self.admission = AdmissionController(config.admission)
         self.total_timeout_s = self.config.timeouts.total_ms / 1000
-        self.pool = RoundRobinUpstreamPool(config)
+        request_ms = self.config.timeouts.request_ms
+        self.request_timeout_s = request_ms / 1000 if request_ms is not None else None
+        self.pools = {name: UpstreamPool(group_config) for name, group_config in config.group_configs().items()}
+        self.router = Router.from_config(config)
+        self.cache = ResponseCache(config.cache) if config.cache.enabled else None
+        self.buffering = ResponseBuffering(config.buffering)
+        self.compression = ResponseCompression(config.compression)
+        self.coalescer = RequestCoalescer(config.coalescing)
+        self.health_tasks: dict[str, asyncio.Task] = {}
+        self.access_log = AccessLog(config.logging)
+        self.retry_budget = RetryBudget(config.retries)
+        self.hedging = HedgingPolicy(config.retries)
+        self.retries_enabled = config.retries.max_attempts > 1 or config.retries.hedging
+        self.rate_limiter = ClientRateLimiter(config.rate_limit) if config.rate_limit.enabled else None
+        self.rate_limit_task: asyncio.Task | None = None
+        self.header_read = LocalHistogram(CLIENT_HEADER_READ)
+        self.rate_limited_requests = LocalCounter(RATE_LIMITED.labels(scope="request"))
+        self.rate_limited_connections = LocalCounter(RATE_LIMITED.labels(scope="connection"))
+        self.pipelined_requests = LocalCounter(PIPELINED_REQUESTS)
+        self.tls_context = create_server_context(config.tls) if config.tls.enabled else None
+        self.tls_handshakes = HandshakeStats("client")
+        register_collector(self.update_metrics)
+        register_admin_route("/debug/connections", self.handle_connections_snapshot)
 
     async def start_server(self) -> None:
-        await self.pool.prepare_connections()
+        for pool in self.pools.values():
+            pool.prepare_connections()
+        self.start_health_checker()
+        self.start_rate_limiter()
         host, port = self.config.listen.split(":")
-        server = await asyncio.start_server(self.client_handler, host=host, port=port)
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(
+            self.create_client_protocol,
+            host=host,
+            port=port,
+            reuse_port=self.config.workers > 1,
+            ssl=self.tls_context,
+            ssl_handshake_timeout=self.config.tls.handshake_timeout_ms / 1000 if self.tls_context else None,
+        )
         async with server:
-            logger.info(f"Starting server host={host} port={port}")
+            logger.info(f"Starting server host={host} port={port} tls={self.tls_context is not None}")
             await server.serve_forever()
 
-    async def client_handler(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-        async with self.conn_semaphore:
-            client_connection = ClientConnection(reader, writer, self.config)
-            token = client_addr_var.set(str(client_connection.addr))
-            logger.info("Got new client connection.")
-            try:
-                await asyncio.wait_for(self.process_client_connection(client_connection), self.total_timeout_s)
-            except TimeoutError:
-                logger.info("Keep alive connection with client closed forcefully: too long session!")
-            client_addr_var.reset(token)
+    def create_client_protocol(self) -> HTTPRequestProtocol:
+        # Окно чтения берется из текущего конфига: после перезагрузки новое действует для новых соединений.
+        return HTTPRequestProtocol(self.client_handler, self.config.relay.window_bytes)
+
+    def start_health_checker(self, restart: bool = True) -> None:
+        """Активные проверки, задача на группу: задачи удаленных групп отменяются, новых - запускаются."""
+        for name, task in list(self.health_tasks.items()):
+            if restart or name not in self.pools:
+                task.cancel()
+                del self.health_tasks[name]
+        if self.config.health.check_interval_ms > 0:
+            for name, pool in self.pools.items():
+                if name not in self.health_tasks:
+                    self.health_tasks[name] = asyncio.create_task(HealthChecker(pool, self.config.health).run())
+
+    def start_rate_limiter(self) -> None:
+        if self.rate_limit_task is not None:
+            self.rate_limit_task.cancel()
+            self.rate_limit_task = None
+        if self.rate_limiter is not None:
+            self.rate_limit_task = asyncio.create_task(self.rate_limiter.run())
+
+    def reload(self, config: Config) -> dict:
+        """
+        Применяет перечитанный конфиг без перезапуска.
+
+        Запросы в работе дорабатывают со старыми настройками, новые таймауты и лимиты действуют
+        со следующего запроса, в том числе на уже открытых соединениях. Пулы апстримов, оставшихся
+        в конфиге, сохраняются. Новые маршруты действуют со следующего запроса.
+        """
+        previous, self.config = self.config, config
+        restart_required = [name for name in self.RESTART_REQUIRED if getattr(config, name) != getattr(previous, name)]
+        if config.logging.queue_size != previous.logging.queue_size:
+            restart_required.append("logging.queue_size")
+
+        self.total_timeout_s = config.timeouts.total_ms / 1000
+        request_ms = config.timeouts.request_ms
+        self.request_timeout_s = request_ms / 1000 if request_ms is not None else None
+        self.admission.apply_config(config.admission)
+        self.buffering.apply_config(config.buffering)
+        self.compression.apply_config(config.compression)
+        self.coalescer.apply_config(config.coalescing)
+        added, removed = self.reload_pools(config)
+        self.router = Router.from_config(config)
+        apply_logging_config(config.logging)
+        self.access_log = AccessLog(config.logging)
+        if config.retries != previous.retries:
+            self.retry_budget = RetryBudget(config.retries)
+            self.hedging = HedgingPolicy(config.retries)
+            self.retries_enabled = config.retries.max_attempts > 1 or config.retries.hedging
+        self.start_health_checker(restart=config.health != previous.health)
+        if not config.rate_limit.enabled:
+            self.rate_limiter = None
+        elif self.rate_limiter is None or config.rate_limit.shards != previous.rate_limit.shards:
+            self.rate_limiter = ClientRateLimiter(config.rate_limit)
+        else:
+            self.rate_limiter.apply_config(config.rate_limit)
+        if config.rate_limit != previous.rate_limit:
+            self.start_rate_limiter()
+        return {"added": added, "removed": removed, "restart_required": restart_required}
+
+    def reload_pools(self, config: Config) -> tuple[list[str], list[str]]:
+        """
+        Пулы оставшихся групп перечитывают свои апстримы, пулы удаленных групп закрываются:
+        апстримы выводятся из ротации, их метрики удаляются после завершения запросов.
+        """
+        pools, added, removed = {}, [], []
+        for name, group_config in config.group_configs().items():
+            pool = self.pools.pop(name, None)
+            if pool is None:
+                pool = UpstreamPool(group_config)
+                pool.prepare_connections()
+                added += [upstream.name for upstream in pool.upstreams]
+            else:
+                group_added, group_removed = pool.reload(group_config)
+                added += group_added
+                removed += group_removed
+            pools[name] = pool
+        for pool in self.pools.values():
+            removed += [upstream.name for upstream in pool.upstreams]
+            pool.close()
+        self.pools = pools
+        return added, removed
+
+    async def client_handler(self, protocol: HTTPRequestProtocol) -> None:
+        if self.tls_context is not None:
+            self.tls_handshakes.observe(protocol.transport, protocol.created_at)
+        client_connection = ClientConnection(protocol, self.config)
+        if len(self.client_connections) >= self.config.limits.max_client_conns:
+            ADMISSION_REJECTED.labels(reason="conn_limit").inc()
+            await self.reject_client_connection(client_connection, self.send_overloaded_response)
+            return
+        if self.rate_limiter is not None and not self.rate_limiter.allow_connection(
+                client_connection.host, asyncio.get_event_loop().time()
+        ):
+            self.rate_limited_connections.inc()
+            await self.reject_client_connection(client_connection, self.send_rate_limited_response)
+            return
+
+        self.client_connections.add(client_connection)
+        token = client_addr_var.set(str(client_connection.addr))
+        logger.debug("Got new client connection.")
+        task = asyncio.current_task()
+        session_deadline = Deadline(on_expire=task.cancel)
+        session_deadline.start(self.total_timeout_s)
+        try:
+            await self.process_client_connection(client_connection)
+        except asyncio.CancelledError:
+            if not session_deadline.expired:
+                raise
+            task.uncancel()
+            logger.info("Keep alive connection with client closed forcefully: too long session!")
+        finally:
+            session_deadline.stop()
+            self.client_connections.discard(client_connection)
+        client_addr_var.reset(token)
+
+    async def reject_client_connection(
+            self,
+            client_conn: BaseConnection,
+            send_response: Callable[[BaseConnection], Awaitable[None]],
+    ) -> None:
+        """Отклоненное соединение не ждет: отвечаем на первый запрос (503 или 429) и закрываем."""
+        try:
+            await anext(client_conn.iterator(), None)
+        except Exception:
+            pass
+        await send_response(client_conn)
+        await client_conn.close()
 
     async def process_client_connection(self, client_conn: BaseConnection) -> None:
-        logger.info('Processing new client connection.')
+        logger.debug('Processing new client connection.')
 
         try:
             await self.proxy_client(client_conn)
         except (ClientConnectionTimeout, ClientConnectionClosed):
-            logger.info("Client timeout.")
+            logger.debug("Client timeout.")
         except UpstreamConnectionTimeout:
             logger.error("Upstream timeout")
             await self.send_bad_gateway_response(client_conn)
+        except UpstreamConnectionClosed:
+            logger.error("Upstream closed connection")
+            await self.send_bad_gateway_response(client_conn)
+        except UpstreamResponseInvalid:
+            logger.error("Error parsing upstream http data")
+            await self.send_bad_gateway_response(client_conn)
         except HTTPParseError:
             logger.error("Error parsing client http data")
             await self.send_parsing_error_response(client_conn)
@@ -57,49 +244,518 @@ class ProxyServer:
             POOL_TIMEOUTS.inc()
             logger.error(exc)
             await self.send_bad_gateway_response(client_conn)
+        except AdmissionRejected as exc:
+            logger.debug(exc)
+            await self.send_overloaded_response(client_conn)
+        except FlightFailed as exc:
+            logger.error(exc)
+            await self.send_bad_gateway_response(client_conn)
         except Exception as exc:
             logger.error(exc)
         finally:
             await client_conn.close()
 
-    async def cleanup(self, pool_member: PoolMember, task: asyncio.Task) -> None:
-        if task:
-            try:
-                await task
-            except UpstreamConnectionTimeout:
-                if not pool_member.response_is_read:
-                    UPSTREAM_TIMEOUTS.labels(upstream=pool_member.connection.addr).inc()
-                    raise
-            finally:
-                await self.pool.release(pool_member, is_healthy=pool_member.response_is_read)
+    async def cleanup(
+            self,
+            pool_member: PoolMember | None,
+            task: asyncio.Task | None,
+            ticket: AdmissionTicket | None,
+    ) -> None:
+        try:
+            if task:
+                try:
+                    await task
+                except UpstreamConnectionTimeout:
+                    if not pool_member.response_is_read:
+                        pool_member.upstream.timeouts.inc()
+                        pool_member.pool.observe_latency(pool_member, pool_member.connection.read_timeout_s)
+                        ticket.complete()
+                        raise
+                finally:
+                    await pool_member.pool.release(pool_member, is_healthy=pool_member.response_is_read)
+            elif pool_member:
+                # Ответ не начинали читать: запрос не дошел до апстрима целиком.
+                await pool_member.pool.release(pool_member, is_healthy=False)
+        finally:
+            if ticket:
+                ticket.release()
 
     async def proxy_client(self, client_conn: BaseConnection) -> None:
-        logger.info("Getting data from client...")
+        logger.debug("Getting data from client...")
 
-        pool_member, response_task = None, None
+        pool_member, response_task, ticket, flight = None, None, None, None
+        # Конвейерные запросы в работе, в порядке поступления. Их не больше pipeline_depth, хватает списка.
+        pipeline: list[asyncio.Task] = []
         loop = asyncio.get_event_loop()
         try:
             async for data in client_conn.iterator():
+                is_message_end = data.is_message_end
                 if data.is_message_start:
                     start_time = loop.time()
-                    await self.cleanup(pool_member, response_task)
-                    pool_member = await self.pool.acquire()
-                    logger.info(f"Got upstream connection: {pool_member.connection.addr}")
-                    response_task = asyncio.create_task(self.upstream_to_client(client_conn, pool_member, start_time))
+                    if client_conn.config is not self.config:
+                        client_conn.apply_config(self.config)
+                    client_conn.request_head, client_conn.request_started_at = data.head, start_time
+                    client_conn.state, client_conn.upstream = "admission", None
+                    self.header_read.observe(start_time - client_conn.protocol.message_started_at)
+                    pipelined = self.can_pipeline(data, client_conn, pipeline)
+                    if not pipelined:
+                        await self.drain_pipeline(pipeline)
+                    reject = None
+                    if self.rate_limiter is not None and not self.rate_limiter.allow_request(
+                            client_conn.host, data.head, start_time
+                    ):
+                        self.rate_limited_requests.inc()
+                        reject = self.send_rate_limited_response
+                    elif (pool := self.pools.get(group := self.router.route(data.head))) is None:
+                        reject = self.send_not_found_response
+                    if reject is not None:
+                        await self.drain_pipeline(pipeline)
+                        # Тело отклоненного запроса не дочитываем: после ответа на запрос с телом закрываем соединение.
+                        await reject(client_conn, close=not is_message_end)
+                        if not is_message_end:
+                            return
+                        client_conn.set_idle()
+                        continue
+                    cache_key = self.get_cache_key(data, group)
+                    if cache_key is not None and (cached_response := self.cache.get(cache_key)) is not None:
+                        await self.drain_pipeline(pipeline)
+                        if (encoding := self.compression.accepted_encoding(data.head)) is not None:
+                            cached_response = await self.get_cached_variant(cache_key, cached_response, encoding)
+                        await self.send_response(client_conn, cached_response)
+                        self.access_log.log(
+                            data.head, 200, loop.time() - start_time, bytes_sent=len(cached_response), cache=True
+                        )
+                        client_conn.set_idle()
+                        continue
+                    coalesce_key = self.get_coalesce_key(data)
+                    if coalesce_key is not None and (leader_flight := self.coalescer.join(coalesce_key)) is not None:
+                        await self.drain_pipeline(pipeline)
+                        try:
+                            await self.follow_flight(client_conn, leader_flight, data.head, start_time)
+                        except FlightAbandoned:
+                            pass
+                        else:
+                            client_conn.set_idle()
+                            continue
+                    if coalesce_key is not None:
+                        flight = self.coalescer.start(coalesce_key)
+
+                    client_conn.state = "upstream"
+                    if pipelined:
+                        self.pipelined_requests.inc()
+                        pipeline.append(asyncio.create_task(self.proxy_pipelined(
+                            client_conn, data, pool, start_time, cache_key, pipeline[-1] if pipeline else None, flight
+                        )))
+                        flight = None
+                        # Вперед читаем только уже пришедшие запросы, иначе ждем ответы на отправленные.
+                        keep = self.config.limits.pipeline_depth - 1 if client_conn.protocol.chunks else 0
+                        await self.drain_pipeline(pipeline, keep)
+                        if not pipeline:
+                            client_conn.set_idle()
+                        continue
+
+                    ticket = await self.admission.admit()
+                    if self.is_retryable(data):
+                        pool_member, first_chunk = await self.fetch_idempotent(data, pool, start_time)
+                        response_task = asyncio.create_task(self.upstream_to_client(
+                            client_conn, data.head, pool_member, ticket, start_time, cache_key, first_chunk,
+                            flight=flight,
+                        ))
+                    else:
+                        pool_member = await pool.acquire()
+                        client_conn.upstream = pool_member.upstream.name
+                        self.set_request_deadline(pool_member, start_time)
+                        logger.debug("Got upstream connection: %s", pool_member.upstream.name)
+                        if data.head.method == b'HEAD':
+                            pool_member.connection.expect_bodyless_response()
+                        response_task = asyncio.create_task(self.upstream_to_client(
+                            client_conn, data.head, pool_member, ticket, start_time, cache_key, flight=flight
+                        ))
+                        await self.send_request(pool_member, data.chunk)
+                        if self.should_splice(data, client_conn, pool_member.connection):
+                            await client_conn.splice_body_to(pool_member.connection)
+                            is_message_end = True
+                else:
+                    await self.send_request(pool_member, data.chunk)
+
+                if is_message_end:
+                    # Следующий запрос читаем после ответа на текущий: ошибка апстрима сразу уходит клиенту,
+                    # а keepalive_ms отсчитывается от конца ответа.
+                    finished = pool_member, response_task, ticket
+                    pool_member, response_task, ticket = None, None, None
+                    await self.cleanup(*finished)
+                    if flight is not None:
+                        flight.close()
+                        flight = None
+                    client_conn.set_idle()
+                    # Завершенный запрос (задачу ответа, соединение пула, буфер запроса) не держим,
+                    # пока ждем следующий.
+                    del finished, data
+        finally:
+            for task in pipeline:
+                task.cancel()
+            try:
+                await self.cleanup(pool_member, response_task, ticket)
+            finally:
+                if flight is not None:
+                    # Запрос лидера не дошел до ответа: присоединившиеся получат ошибку.
+                    flight.close()
+
+    def can_pipeline(self, data: HTTPMessageChunk, client_conn: BaseConnection, pipeline: list[asyncio.Task]) -> bool:
+        """Конвейер - для запросов без тела с идемпотентным методом, если следующий запрос уже пришел."""
+        return (
+                self.config.limits.pipeline_depth > 1
+                and data.is_message_end
+                and data.head.method in self.IDEMPOTENT_METHODS
+                and bool(pipeline or client_conn.protocol.chunks)
+        )
+
+    @staticmethod
+    async def drain_pipeline(pipeline: list[asyncio.Task], keep: int = 0) -> None:
+        """Ждет конвейерные запросы по порядку, пока в работе не останется keep. Ошибка запроса пробрасывается."""
+        while len(pipeline) > keep:
+            await pipeline.pop(0)
+
+    async def proxy_pipelined(
+            self,
+            client_conn: BaseConnection,
+            data: HTTPMessageChunk,
+            pool: UpstreamPool,
+            start_time: float,
+            cache_key: bytes | None,
+            previous: asyncio.Task | None,
+            flight: Flight | None,
+    ) -> None:
+        """
+        Запрос без тела, прочитанный до ответа на предыдущий (HTTP pipelining).
+
+        Уходит апстриму сразу, ответ копится в буфере, пока клиент не получит ответ на previous.
+        """
+        pool_member, response_task, ticket = None, None, None
+        try:
+            ticket = await self.admission.admit()
+            if self.is_retryable(data):
+                pool_member, first_chunk = await self.fetch_idempotent(data, pool, start_time)
+            else:
+                pool_member, first_chunk = await pool.acquire(), None
+                self.set_request_deadline(pool_member, start_time)
+                if data.head.method == b'HEAD':
+                    pool_member.connection.expect_bodyless_response()
+                await self.send_request(pool_member, data.chunk)
+            response_task = asyncio.create_task(self.upstream_to_client(
+                client_conn, data.head, pool_member, ticket, start_time, cache_key, first_chunk, previous, flight
+            ))
+        finally:
+            try:
+                await self.cleanup(pool_member, response_task, ticket)
+            finally:
+                if flight is not None:
+                    flight.close()
+
+    async def get_cached_variant(self, cache_key: bytes, response: bytes, encoding: bytes) -> bytes:
+        """Сжатый вариант ответа из кеша, сжимается один раз на запись кеша."""
+        variant = self.cache.get_variant(cache_key, encoding)
+        if variant is None:
+            variant = await self.compression.compress_response(response, encoding)
+            self.cache.put_variant(cache_key, encoding, variant)
+        if variant is not response:
+            self.compression.compressed_from_cache.inc()
+        return variant
+
+    async def upstream_to_client(
+            self,
+            client_conn: BaseConnection,
+            request_head: HTTPMessageHead,
+            pool_member: PoolMember,
+            ticket: AdmissionTicket,
+            start_time: float,
+            cache_key: bytes | None = None,
+            first_chunk: HTTPMessageChunk | None = None,
+            previous: asyncio.Task | None = None,
+            flight: Flight | None = None,
+    ) -> None:
+        logger.debug("Sending response to client...")
+        keep_alive, response_head, response_parts, response_size = True, None, None, 0
+        bytes_sent, first_byte_at, compressor = 0, None, None
+        chunks = pool_member.connection.iterator()
+        if first_chunk is not None:
+            chunks = self.prepend_chunk(first_chunk, chunks)
+        # С буферизацией соединение с апстримом освобождается, как только ответ прочитан, не дожидаясь клиента.
+        # Ответ на конвейерный запрос буферизуется всегда: он ждет, пока клиент получит ответ на предыдущий.
+        buffer = None
+        if self.config.buffering.enabled or previous is not None:
+            buffer = self.buffering.buffer(client_conn, previous)
+        try:
+            async for data in chunks:
+                is_message_end = data.is_message_end
+                if data.is_message_start:
+                    keep_alive, response_head = data.head.keep_alive, data.head
+                    if pool_member.first_byte_at is None:
+                        pool_member.first_byte_at = asyncio.get_event_loop().time()
+                    client_conn.state, client_conn.upstream = "response", pool_member.upstream.name
+                    first_byte_at = pool_member.first_byte_at
+                    if cache_key is not None and self.cache.is_storable(response_head):
+                        response_parts = []
+                    encoding = self.compression.accepted_encoding(request_head)
+                    if encoding is not None and self.compression.should_compress(response_head):
+                        compressor = self.compression.compressor(encoding, keep_body=response_parts is not None)
+                    if flight is not None and not flight.accept(response_head, pool_member.upstream.name):
+                        flight = None
+                if response_parts is not None:
+                    response_parts.append(data.chunk)
+                    response_size += len(data.chunk)
+                    if response_size > self.cache.max_object_bytes:
+                        response_parts = None
+                        if compressor is not None:
+                            compressor.body_parts = None
+                chunk = data.chunk
+                if compressor is not None:
+                    # Сжатая часть может оказаться пустой: zlib копит вход до полного блока.
+                    chunk = await compressor.compress(
+                        chunk, response_head if data.is_message_start else None, is_message_end
+                    )
+                if flight is not None and chunk:
+                    flight.append(chunk)
+                if not chunk:
+                    pass
+                elif buffer is not None:
+                    await buffer.write(chunk)
+                else:
+                    await self.send_response(client_conn, chunk)
+                bytes_sent += len(chunk)
+                if (
+                        data.is_message_start
+                        and buffer is None
+                        and compressor is None
+                        and flight is None
+                        and self.should_splice(data, pool_member.connection, client_conn)
+                ):
+                    await pool_member.connection.splice_body_to(client_conn)
+                    is_message_end, response_parts = True, None
+                    bytes_sent = len(response_head.raw) + response_head.content_length
+                if is_message_end:
+                    end_time = asyncio.get_event_loop().time()
+                    upstream = pool_member.upstream
+                    upstream.request_latency.observe(end_time - start_time)
+                    upstream.ttfb.observe(first_byte_at - pool_member.acquired_at)
+                    upstream.streaming.observe(end_time - first_byte_at)
+                    pool_member.pool.observe_latency(pool_member, end_time - start_time)
+                    pool_member.pool.report_success(pool_member.upstream)
+                    ticket.complete()
+                    if flight is not None:
+                        flight.finish()
+                    await pool_member.pool.release(pool_member, is_healthy=keep_alive)
+                    if response_parts is not None:
+                        self.cache.put(cache_key, response_head, b''.join(response_parts))
+                        if compressor is not None:
+                            self.cache.put_variant(cache_key, compressor.encoding, compressor.variant())
+                    if buffer is not None:
+                        await buffer.finish()
+                    self.access_log.log(
+                        request_head,
+                        response_head.status,
+                        asyncio.get_event_loop().time() - start_time,
+                        upstream=upstream.name,
+                        bytes_sent=bytes_sent,
+                        upstream_s=first_byte_at - start_time,
+                    )
+                    return
+        except (UpstreamConnectionTimeout, UpstreamConnectionClosed, UpstreamResponseInvalid):
+            pool_member.pool.report_failure(pool_member.upstream)
+            raise
+        finally:
+            if buffer is not None:
+                buffer.close()
+        # Апстрим закрыл соединение, не дослав ответ.
+        pool_member.pool.report_failure(pool_member.upstream)
+        if response_head is None:
+            await self.send_bad_gateway_response(client_conn)
+
+    @staticmethod
+    async def prepend_chunk(
+            first_chunk: HTTPMessageChunk,
+            chunks: AsyncIterable[HTTPMessageChunk],
+    ) -> AsyncIterator[HTTPMessageChunk]:
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    def is_retryable(self, data: HTTPMessageChunk) -> bool:
+        return self.retries_enabled and data.is_message_end and data.head.method in self.IDEMPOTENT_METHODS
 
-                await pool_member.connection.write(data.chunk)
+    async def fetch_idempotent(
+            self,
+            data: HTTPMessageChunk,
+            pool: UpstreamPool,
+            start_time: float,
+    ) -> tuple[PoolMember, HTTPMessageChunk]:
+        """
+        Отправляет запрос без тела и ждет начало ответа.
+
+        Если ответа нет дольше задержки хеджирования, тот же запрос уходит на другой апстрим,
+        выигрывает первый ответ, соединение проигравшей попытки закрывается и пул переустанавливает его в фоне.
+        Ошибки соединения и таймауты повторяются на другом апстриме. Всего попыток не больше max_attempts,
+        каждая попытка сверх первой тратит бюджет повторов.
+        """
+        self.retry_budget.deposit()
+        tried: list[Upstream] = []
+        attempts: set[asyncio.Task] = set()
+        attempts_left = self.config.retries.max_attempts
+        hedge_delay_s = self.hedging.delay_s
+        last_error: Exception | None = None
+
+        def start_attempt() -> None:
+            nonlocal attempts_left
+            attempts_left -= 1
+            attempts.add(asyncio.create_task(self.attempt_idempotent(data, pool, tried, start_time)))
+
+        def spend_budget() -> bool:
+            if attempts_left <= 0:
+                return False
+            if not self.retry_budget.withdraw():
+                RETRY_BUDGET_EXHAUSTED.inc()
+                return False
+            return True
+
+        if not self.hedging.enabled:
+            # Без хеджирования попытки идут по очереди: задача на попытку и asyncio.wait не нужны.
+            while True:
+                attempts_left -= 1
+                try:
+                    return await self.attempt_idempotent(data, pool, tried, start_time)
+                except self.RETRYABLE_ERRORS as exc:
+                    if not spend_budget():
+                        raise
+                    logger.debug("Retrying request after upstream error: %r", exc)
+                    RETRIES.inc()
+
+        start_attempt()
+        first_attempt = next(iter(attempts))
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=hedge_delay_s if len(attempts) == 1 else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # Хедж отправляется один раз на запрос.
+                    hedge_delay_s = None
+                    if spend_budget():
+                        HEDGES.inc()
+                        start_attempt()
+                    continue
+
+                result = None
+                for task in done:
+                    attempts.discard(task)
+                    try:
+                        task_result = task.result()
+                    except self.RETRYABLE_ERRORS as exc:
+                        last_error = exc
+                        continue
+                    if result is not None:
+                        # Оба ответа пришли одновременно, лишнее соединение с начатым ответом не переиспользовать.
+                        await pool.release(task_result[0], is_healthy=False)
+                        continue
+                    result = task_result
+                    if task is not first_attempt:
+                        HEDGE_WINS.inc()
+                if result is not None:
+                    return result
+
+                if not attempts and spend_budget():
+                    logger.debug("Retrying request after upstream error: %r", last_error)
+                    RETRIES.inc()
+                    start_attempt()
+            raise last_error
         finally:
-            await self.cleanup(pool_member, response_task)
-
-    async def upstream_to_client(self, client_conn: BaseConnection, pool_member: PoolMember, start_time: float) -> None:
-        logger.info("Sending response to client...")
-        async for data in pool_member.connection.iterator():
-            await self.send_response(client_conn, data.chunk)
-            if data.is_message_end:
-                end_time = asyncio.get_event_loop().time()
-                REQUEST_LATENCY.labels(upstream=pool_member.connection.addr).observe(end_time - start_time)
-                await self.pool.release(pool_member, is_healthy=True)
-                return
+            for task in attempts:
+                task.cancel()
+
+    async def attempt_idempotent(
+            self,
+            data: HTTPMessageChunk,
+            pool: UpstreamPool,
+            tried: list[Upstream],
+            start_time: float,
+    ) -> tuple[PoolMember, HTTPMessageChunk]:
+        pool_member = await pool.acquire(exclude=tried)
+        self.set_request_deadline(pool_member, start_time)
+        tried.append(pool_member.upstream)
+        attempt_start = asyncio.get_event_loop().time()
+        try:
+            if data.head.method == b'HEAD':
+                pool_member.connection.expect_bodyless_response()
+            await self.send_request(pool_member, data.chunk)
+            try:
+                first_chunk = await anext(pool_member.connection.iterator(), None)
+            except (UpstreamConnectionTimeout, UpstreamConnectionClosed, UpstreamResponseInvalid):
+                pool_member.pool.report_failure(pool_member.upstream)
+                raise
+            if first_chunk is None:
+                pool_member.pool.report_failure(pool_member.upstream)
+                raise pool_member.connection.connection_closed_err
+        except BaseException:
+            await pool_member.pool.release(pool_member, is_healthy=False)
+            raise
+        pool_member.first_byte_at = asyncio.get_event_loop().time()
+        self.hedging.observe(pool_member.first_byte_at - attempt_start)
+        return pool_member, first_chunk
+
+    def set_request_deadline(self, pool_member: PoolMember, start_time: float) -> None:
+        # Ставится всегда: без request_ms срок предыдущего запроса на соединении из пула должен сняться.
+        deadline_at = start_time + self.request_timeout_s if self.request_timeout_s is not None else None
+        pool_member.connection.set_deadline(deadline_at)
+
+    async def send_request(self, pool_member: PoolMember, data: bytes | memoryview) -> None:
+        try:
+            await pool_member.connection.write(data)
+        except UpstreamConnectionClosed:
+            pool_member.pool.report_failure(pool_member.upstream)
+            raise
+
+    def get_cache_key(self, data: HTTPMessageChunk, group: str) -> bytes | None:
+        # Из кеша обслуживаем только запросы без тела.
+        if self.cache is None or not data.is_message_end:
+            return None
+        return self.cache.make_key(data.head, group)
+
+    def get_coalesce_key(self, data: HTTPMessageChunk) -> bytes | None:
+        if not data.is_message_end:
+            return None
+        return self.coalescer.make_key(data.head, self.compression.accepted_encoding(data.head))
+
+    async def follow_flight(
+            self,
+            client_conn: BaseConnection,
+            flight: Flight,
+            request_head: HTTPMessageHead,
+            start_time: float,
+    ) -> None:
+        """Отдает клиенту ответ на такой же запрос, который уже в работе, по мере его получения."""
+        client_conn.state = "coalesced"
+        bytes_sent = 0
+        async for part in flight.iter_parts():
+            await client_conn.write(part)
+            bytes_sent += len(part)
+        self.access_log.log(
+            request_head,
+            flight.status,
+            asyncio.get_event_loop().time() - start_time,
+            upstream=flight.upstream,
+            bytes_sent=bytes_sent,
+            coalesced=True,
+        )
+
+    def should_splice(self, data: HTTPMessageChunk, source: BaseConnection, destination: BaseConnection) -> bool:
+        threshold = self.config.relay.splice_threshold_bytes
+        return (
+                not data.is_message_end
+                and 0 < threshold <= data.head.content_length
+                and source.can_splice
+                and destination.can_splice
+        )
 
     async def send_response(self, client_conn: BaseConnection, response: bytes) -> None:
         try:
@@ -110,7 +766,63 @@ class ProxyServer:
     async def send_parsing_error_response(self, client_conn: BaseConnection) -> None:
         error = get_error_response(400, "Bad Request", "Invalid request")
         await self.send_response(client_conn, error)
+        self.log_error_response(client_conn, 400, error)
 
     async def send_bad_gateway_response(self, client_conn: BaseConnection) -> None:
         error = get_error_response(502, "Bad Gateway", "Internal error")
         await self.send_response(client_conn, error)
+        self.log_error_response(client_conn, 502, error)
+
+    async def send_rate_limited_response(self, client_conn: BaseConnection, close: bool = True) -> None:
+        headers = {b'Retry-After': str(self.config.rate_limit.retry_after_s).encode()}
+        if close:
+            headers[b'Connection'] = b'close'
+        error = get_error_response(429, "Too Many Requests", "Rate limit exceeded", headers)
+        await self.send_response(client_conn, error)
+        self.log_error_response(client_conn, 429, error)
+
+    async def send_not_found_response(self, client_conn: BaseConnection, close: bool = True) -> None:
+        error = get_error_response(404, "Not Found", "No route", {b'Connection': b'close'} if close else None)
+        await self.send_response(client_conn, error)
+        self.log_error_response(client_conn, 404, error)
+
+    async def send_overloaded_response(self, client_conn: BaseConnection) -> None:
+        headers = {
+            b'Retry-After': str(self.config.admission.retry_after_s).encode(),
+            b'Connection': b'close',
+        }
+        error = get_error_response(503, "Service Unavailable", "Overloaded", headers)
+        await self.send_response(client_conn, error)
+        self.log_error_response(client_conn, 503, error)
+
+    def update_metrics(self) -> None:
+        CLIENT_CONNECTIONS.set(len(self.client_connections))
+        # Задача на клиентское соединение и фоновые задачи пулов, проверок и rate limiter.
+        ACTIVE_TASKS.set(
+            len(self.client_connections)
+            + sum(len(pool.background_tasks) for pool in self.pools.values())
+            + len(self.health_tasks)
+            + (self.rate_limit_task is not None)
+        )
+        RATE_LIMIT_CLIENTS.set(self.rate_limiter.clients if self.rate_limiter is not None else 0)
+
+    async def handle_connections_snapshot(self, params: dict[str, str]) -> tuple[bytes, bytes]:
+        """Состояние клиентских соединений процесса для /debug/connections, limit - сколько самых старых отдать."""
+        limit = int(params.get("limit", 1000))
+        now = asyncio.get_event_loop().time()
+        connections = sorted(self.client_connections, key=lambda conn: conn.connected_at)[:limit]
+        states = Counter(conn.state for conn in self.client_connections)
+        return b"application/json", json.dumps({
+            "total": len(self.client_connections),
+            "states": states,
+            "connections": [conn.snapshot(now) for conn in connections],
+        }).encode()
+
+    def log_error_response(self, client_conn: ClientConnection, status: int, response: bytes) -> None:
+        started_at = client_conn.request_started_at or asyncio.get_event_loop().time()
+        self.access_log.log(
+            client_conn.request_head,
+            status,
+            asyncio.get_event_loop().time() - started_at,
+            bytes_sent=len(response),
+        )
@@ -0,0 +1,111 @@
+import asyncio
+from collections import OrderedDict
+from typing import Hashable
+
+from config import RateLimitConfig
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class RateLimiter:
+    """
+    Token bucket на каждый ключ (адрес клиента или значение заголовка): rate токенов в секунду, не больше burst.
+
+    Бакет пополняется лениво при обращении. Таблица разбита на shards упорядоченных словарей:
+    каждый растет и перехешируется отдельно, так что даже с миллионами ключей рост таблицы
+    не останавливает event loop надолго. Шард хранит не больше max_keys / shards ключей, сверх этого
+    вытесняется давно не обращавшийся. Бакеты, которые за время простоя полностью пополнились бы,
+    ничем не отличаются от новых и удаляются в sweep.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int, shards: int):
+        self.shards: list[OrderedDict[Hashable, TokenBucket]] = [OrderedDict() for _ in range(shards)]
+        self.apply_config(rate, burst, max_keys)
+
+    def apply_config(self, rate: float, burst: float, max_keys: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.shard_capacity = max(1, max_keys // len(self.shards))
+        self.refill_s = burst / rate
+
+    def acquire(self, key: Hashable, now: float) -> bool:
+        shard = self.shards[hash(key) % len(self.shards)]
+        bucket = shard.get(key)
+        if bucket is None:
+            if len(shard) >= self.shard_capacity:
+                shard.popitem(last=False)
+            shard[key] = TokenBucket(self.burst - 1, now)
+            return True
+        shard.move_to_end(key)
+        tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+        bucket.updated_at = now
+        if tokens < 1:
+            bucket.tokens = tokens
+            return False
+        bucket.tokens = tokens - 1
+        return True
+
+    def sweep(self, now: float) -> None:
+        for shard in self.shards:
+            while shard:
+                key, bucket = next(iter(shard.items()))
+                if now - bucket.updated_at < self.refill_s:
+                    break
+                del shard[key]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+
+class ClientRateLimiter:
+    """
+    Ограничения из config.rate_limit: новые соединения с одного адреса и запросы одного клиента.
+
+    Клиент запроса - значение заголовка key_header, если он задан и есть в запросе, иначе адрес.
+    """
+    SWEEP_INTERVAL_S = 1
+
+    def __init__(self, config: RateLimitConfig):
+        self.requests = RateLimiter(config.requests_per_second, config.burst, config.max_clients, config.shards)
+        self.connections: RateLimiter | None = None
+        self.apply_config(config)
+
+    def apply_config(self, config: RateLimitConfig) -> None:
+        self.config = config
+        self.key_header = config.key_header.lower().encode() if config.key_header else None
+        self.requests.apply_config(config.requests_per_second, config.burst, config.max_clients)
+        if not config.connections_per_second:
+            self.connections = None
+        elif self.connections is None:
+            self.connections = RateLimiter(
+                config.connections_per_second, config.connection_burst, config.max_clients, config.shards
+            )
+        else:
+            self.connections.apply_config(config.connections_per_second, config.connection_burst, config.max_clients)
+
+    def allow_connection(self, host: str, now: float) -> bool:
+        return self.connections is None or self.connections.acquire(host, now)
+
+    def allow_request(self, host: str, head: 'HTTPMessageHead', now: float) -> bool:
+        key = host
+        if self.key_header is not None:
+            key = head.get_header(self.key_header) or host
+        return self.requests.acquire(key, now)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL_S)
+            now = loop.time()
+            self.requests.sweep(now)
+            if self.connections is not None:
+                self.connections.sweep(now)
+
+    @property
+    def clients(self) -> int:
+        return len(self.requests)
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import logging
+import signal
+from typing import Callable
+
+from config import Config, ConfigLoader
+from metrics import register_admin_route
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigReloader:
+    """
+    Перечитывает конфиг по SIGHUP или запросу /admin/reload на порту метрик и передает его в apply.
+
+    Если конфиг не читается или не проходит валидацию, ошибка пишется в лог и остается прежний конфиг.
+    apply возвращает описание примененных изменений, оно пишется в лог и отдается в ответе /admin/reload.
+    listeners получают новый конфиг после apply (например, диагностика процесса).
+    """
+    def __init__(self, path: str, apply: Callable[[Config], dict], *listeners: Callable[[Config], None]):
+        self.path = path
+        self.apply = apply
+        self.listeners = listeners
+        self.background_tasks: set[asyncio.Task] = set()
+
+    def install(self) -> None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.on_signal)
+        register_admin_route("/admin/reload", self.handle_reload)
+
+    def on_signal(self) -> None:
+        task = asyncio.create_task(asyncio.to_thread(self.load))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.on_loaded)
+
+    def on_loaded(self, task: asyncio.Task) -> None:
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.result() is not None:
+            self.reload(task.result())
+
+    async def handle_reload(self, params: dict[str, str]) -> tuple[bytes, bytes]:
+        config = await asyncio.to_thread(self.load)
+        if config is None:
+            raise ValueError(f"Failed to load config {self.path}, see log")
+        return b"application/json", json.dumps(self.reload(config)).encode()
+
+    def load(self) -> Config | None:
+        # Файл читается в потоке, чтобы медленный диск не останавливал event loop.
+        try:
+            return ConfigLoader(self.path).get_config()
+        except Exception as exc:
+            logger.error(f"Config reload failed, keeping current config: {exc!r}")
+            return None
+
+    def reload(self, config: Config) -> dict:
+        changes = self.apply(config)
+        for listener in self.listeners:
+            listener(config)
+        logger.info(f"Config reloaded from {self.path}: {changes}")
+        return changes
@@ -0,0 +1,117 @@
+import re
+
+from config import DEFAULT_GROUP, Config, RouteConfig
+
+
+class PrefixNode:
+    __slots__ = ("children", "group")
+
+    def __init__(self):
+        self.children: dict[bytes, PrefixNode] = {}
+        self.group: str | None = None
+
+
+class HostRoutes:
+    """
+    Маршруты одного Host: точные пути в словаре, префиксы в дереве по сегментам пути, регулярные выражения списком.
+
+    Приоритет: точный путь, затем самый длинный префикс, затем первое совпавшее выражение в порядке конфига.
+    Префикс совпадает по целым сегментам: /api подходит для /api и /api/users, но не для /apiv2.
+    """
+    __slots__ = ("exact", "prefixes", "regexes")
+
+    def __init__(self):
+        self.exact: dict[bytes, str] = {}
+        self.prefixes = PrefixNode()
+        self.regexes: list[tuple[re.Pattern, str]] = []
+
+    def add(self, route: RouteConfig) -> None:
+        if route.path is not None:
+            self.exact.setdefault(route.path.encode(), route.group)
+        elif route.path_regex is not None:
+            self.regexes.append((re.compile(route.path_regex.encode()), route.group))
+        else:
+            node = self.prefixes
+            for segment in (route.path_prefix or "/").encode().split(b"/"):
+                if segment:
+                    node = node.children.setdefault(segment, PrefixNode())
+            # При одинаковых маршрутах побеждает первый в конфиге.
+            if node.group is None:
+                node.group = route.group
+
+    def match(self, path: bytes) -> str | None:
+        group = self.exact.get(path)
+        if group is not None:
+            return group
+        node = self.prefixes
+        group = node.group
+        for segment in path.split(b"/"):
+            if not segment:
+                continue
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.group is not None:
+                group = node.group
+        if group is not None:
+            return group
+        for regex, group in self.regexes:
+            if regex.search(path):
+                return group
+        return None
+
+
+class Router:
+    """
+    Выбор группы апстримов по Host и пути из уже разобранной стартовой строки запроса.
+
+    Маршруты компилируются в индекс один раз при загрузке конфига: Host ищется в словаре точных имен,
+    затем среди "*.example.com" от самого длинного суффикса к короткому, затем среди маршрутов без host.
+    Поиск стоит несколько обращений к словарям и не зависит от числа маршрутов, кроме маршрутов
+    с регулярными выражениями - они перебираются по порядку, если точный путь и префиксы не подошли.
+    Если не подошел ни один маршрут, запрос идет в default_group.
+    """
+    def __init__(self, routes: list[RouteConfig], default_group: str | None):
+        self.default_group = default_group
+        self.hosts: dict[bytes, HostRoutes] = {}
+        self.wildcards: dict[bytes, HostRoutes] = {}
+        self.any_host = HostRoutes()
+        for route in routes:
+            self.host_routes(route.host).add(route)
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'Router':
+        return cls(config.routes, DEFAULT_GROUP if config.upstreams else None)
+
+    def host_routes(self, host: str | None) -> HostRoutes:
+        if host is None:
+            return self.any_host
+        host = host.lower()
+        if host.startswith("*."):
+            # Ключ - суффикс с точкой: "*.example.com" хранится как ".example.com".
+            return self.wildcards.setdefault(host[1:].encode(), HostRoutes())
+        return self.hosts.setdefault(host.encode(), HostRoutes())
+
+    def route(self, head: 'HTTPMessageHead') -> str | None:
+        path = head.path.partition(b"?")[0]
+        host = head.get_header(b"host")
+        if host:
+            host = self.normalize_host(host)
+            routes = self.hosts.get(host)
+            if routes is not None and (group := routes.match(path)) is not None:
+                return group
+            if self.wildcards:
+                dot = host.find(b".")
+                while dot != -1:
+                    routes = self.wildcards.get(host[dot:])
+                    if routes is not None and (group := routes.match(path)) is not None:
+                        return group
+                    dot = host.find(b".", dot + 1)
+        group = self.any_host.match(path)
+        return group if group is not None else self.default_group
+
+    @staticmethod
+    def normalize_host(host: bytes) -> bytes:
+        if host.startswith(b"["):
+            return host[:host.find(b"]") + 1]
+        return host.partition(b":")[0].lower()
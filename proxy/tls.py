@@ -0,0 +1,99 @@
+import asyncio
+import ssl
+
+from config import TLSConfig, UpstreamConfig
+from metrics import TLS_HANDSHAKES, TLS_HANDSHAKE_LATENCY, LocalCounter, LocalHistogram
+
+ALPN_PROTOCOLS = ["http/1.1"]
+
+
+def create_server_context(config: TLSConfig) -> ssl.SSLContext:
+    """
+    Контекст для TLS на слушающем сокете.
+
+    Вернувшийся клиент возобновляет сессию по тикету или, без тикетов, по id из кэша сессий OpenSSL в контексте.
+    Ключ тикетов и кэш принадлежат контексту, то есть процессу: при нескольких воркерах сессия возобновится,
+    только если ядро отдаст соединение тому же воркеру.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(config.cert_file, config.key_file)
+    context.set_alpn_protocols(ALPN_PROTOCOLS)
+    if config.session_tickets:
+        context.num_tickets = config.num_tickets
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    return context
+
+
+class ResumingClientContext(ssl.SSLContext):
+    """Клиентский контекст, который начинает каждое соединение с последней сохраненной сессии."""
+    session: ssl.SSLSession | None = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        # asyncio создает SSLObject через wrap_bio без session, другого способа передать сессию у него нет.
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session or self.session)
+
+
+class UpstreamTLS:
+    """TLS к одному апстриму: контекст и сессия, общая для всех соединений пула к нему."""
+
+    def __init__(self, upstream_config: UpstreamConfig):
+        self.settings = get_upstream_tls_settings(upstream_config)
+        self.server_name = upstream_config.tls_server_name or upstream_config.host
+        context = ResumingClientContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.set_alpn_protocols(ALPN_PROTOCOLS)
+        if not upstream_config.tls_verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif upstream_config.tls_ca_file:
+            context.load_verify_locations(upstream_config.tls_ca_file)
+        else:
+            context.load_default_certs()
+        self.context = context
+
+    def save_session(self, transport: asyncio.Transport) -> None:
+        """
+        Запоминает сессию соединения для следующих подключений.
+
+        Тикет TLS 1.3 приходит уже после handshake, поэтому сессию берем, когда соединение возвращается в пул.
+        """
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is None:
+            return
+        session = ssl_object.session
+        if session is not None and (session.has_ticket or ssl_object.version() != "TLSv1.3"):
+            self.context.session = session
+
+
+def get_upstream_tls_settings(upstream_config: UpstreamConfig) -> tuple | None:
+    if not upstream_config.tls:
+        return None
+    return (
+        upstream_config.tls_verify, upstream_config.tls_ca_file, upstream_config.tls_server_name, upstream_config.host
+    )
+
+
+class HandshakeStats:
+    """Число полных и возобновленных handshake и их длительность для одной стороны: client или upstream."""
+
+    def __init__(self, side: str):
+        self.full = LocalCounter(TLS_HANDSHAKES.labels(side=side, resumed="false"))
+        self.resumed = LocalCounter(TLS_HANDSHAKES.labels(side=side, resumed="true"))
+        self.latency = LocalHistogram(TLS_HANDSHAKE_LATENCY.labels(side=side))
+
+    def observe(self, transport: asyncio.Transport, started_at: float) -> None:
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is None:
+            return
+        if ssl_object.session_reused:
+            self.resumed.inc()
+        else:
+            self.full.inc()
+        self.latency.observe(asyncio.get_event_loop().time() - started_at)
+
+    def close(self) -> None:
+        for metric in (self.full, self.resumed, self.latency):
+            metric.close()
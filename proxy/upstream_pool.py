@@ -1,11 +1,23 @@
 import asyncio
 import logging
-from collections import deque
+import math
+from collections import Counter, deque
+from dataclasses import replace
+from functools import partial
 
-from config import Config
+from balancing import STRATEGIES
+from config import Config, UpstreamConfig
+from deadline import wait_future
+from health import UpstreamHealth
 from http_utils.external.base import BaseConnection
 from http_utils.external.upstream import UpstreamConnection
-from metrics import POOL_LATENCY
+from http_utils.protocol import HTTPResponseProtocol
+from metrics import (
+    POOL_LATENCY, POOL_SIZE, POOL_IDLE, POOL_WAITERS, POOL_IN_FLIGHT, POOL_DIAL_LATENCY, REQUEST_LATENCY,
+    UPSTREAM_TIMEOUTS, UPSTREAM_TTFB, UPSTREAM_STREAMING, LocalCounter, LocalHistogram, register_collector,
+    remove_upstream_metrics, unregister_collector
+)
+from tls import HandshakeStats, UpstreamTLS, get_upstream_tls_settings
 
 
 class PoolConnectionError(Exception):
@@ -14,70 +26,374 @@ class PoolConnectionError(Exception):
 
 logger = logging.getLogger(__name__)
 
+# Один host:port может быть в нескольких группах: лейблы метрик удаляются, когда удален последний из них.
+_upstream_labels: Counter[str] = Counter()
+
+
+class Upstream:
+    """
+    Состояние одного апстрима: соединения, статистика для балансировки и здоровье.
+
+    size - все соединения апстрима: свободные, занятые запросами и устанавливаемые.
+    Свободные лежат в idle вместе со временем возврата, последнее возвращенное отдается первым,
+    так что лишние соединения остаются в начале очереди и закрываются по idle_ttl.
+    """
+    def __init__(self, upstream_config: UpstreamConfig, config: Config):
+        self.host = upstream_config.host
+        self.port = upstream_config.port
+        self.name = f"{self.host}:{self.port}"
+        self.health = UpstreamHealth(self.name, config.health)
+        self.tls: UpstreamTLS | None = None
+        self.apply_config(upstream_config, config)
+        self.idle: deque[tuple[BaseConnection, float]] = deque()
+        self.waiters: deque[asyncio.Future] = deque()
+        self.size = 0
+        self.dialing = 0
+        self.dial_tokens = config.pool.max_dial_rate
+        self.dial_tokens_at = 0.0
+        self.wakeup = asyncio.Event()
+        self.maintain_task: asyncio.Task | None = None
+        # Апстрим убран из конфига и его соединения закрыты, вернувшиеся в пул соединения тоже закрываются.
+        self.drained = False
+        self.outstanding = 0
+        self.ewma_latency_s = 0.0
+        self.ewma_updated_at = 0.0
+
+        # Метрики апстрима связываются с лейблом один раз, на пути запроса поиска по лейблам нет.
+        self.size_gauge = POOL_SIZE.labels(upstream=self.name)
+        self.idle_gauge = POOL_IDLE.labels(upstream=self.name)
+        self.waiters_gauge = POOL_WAITERS.labels(upstream=self.name)
+        self.in_flight_gauge = POOL_IN_FLIGHT.labels(upstream=self.name)
+        self.dial_latency = LocalHistogram(POOL_DIAL_LATENCY.labels(upstream=self.name))
+        self.request_latency = LocalHistogram(REQUEST_LATENCY.labels(upstream=self.name))
+        self.ttfb = LocalHistogram(UPSTREAM_TTFB.labels(upstream=self.name))
+        self.streaming = LocalHistogram(UPSTREAM_STREAMING.labels(upstream=self.name))
+        self.timeouts = LocalCounter(UPSTREAM_TIMEOUTS.labels(upstream=self.name))
+        _upstream_labels[self.name] += 1
+
+    def apply_config(self, upstream_config: UpstreamConfig, config: Config) -> None:
+        self.max_size = upstream_config.max_size or config.limits.max_conns_per_upstream
+        min_idle = config.pool.min_idle if upstream_config.min_idle is None else upstream_config.min_idle
+        self.min_idle = min(min_idle, self.max_size)
+        self.health.config = config.health
+        # Новые настройки TLS действуют для новых соединений, уже открытые дорабатывают со старыми.
+        tls_settings = get_upstream_tls_settings(upstream_config)
+        if tls_settings != (self.tls.settings if self.tls is not None else None):
+            self.tls = UpstreamTLS(upstream_config) if tls_settings is not None else None
+
+    def observe_latency(self, latency_s: float, now: float, decay_s: float) -> None:
+        """EWMA с затуханием по времени, рост задержки учитывается сразу (peak EWMA)."""
+        if latency_s >= self.ewma_latency_s:
+            self.ewma_latency_s = latency_s
+        else:
+            weight = math.exp(-(now - self.ewma_updated_at) / decay_s)
+            self.ewma_latency_s = self.ewma_latency_s * weight + latency_s * (1 - weight)
+        self.ewma_updated_at = now
+
+    def update_metrics(self) -> None:
+        self.size_gauge.set(self.size)
+        self.idle_gauge.set(len(self.idle))
+        self.waiters_gauge.set(len(self.waiters))
+        self.in_flight_gauge.set(self.outstanding)
+
+    def close_metrics(self) -> None:
+        """Апстрим удален из конфига: его метрики переносятся последний раз и удаляются из /metrics."""
+        for metric in (self.dial_latency, self.request_latency, self.ttfb, self.streaming, self.timeouts):
+            metric.close()
+        _upstream_labels[self.name] -= 1
+        if not _upstream_labels[self.name]:
+            del _upstream_labels[self.name]
+            remove_upstream_metrics(self.name)
+
 
 class PoolMember:
-    def __init__(self, upstream_queue: asyncio.Queue, connection: BaseConnection):
-        self.upstream_queue = upstream_queue
+    __slots__ = ('pool', 'upstream', 'connection', 'acquired_at', 'first_byte_at', 'is_returned', 'messages_read')
+
+    def __init__(self, pool: 'UpstreamPool', upstream: Upstream, connection: BaseConnection, acquired_at: float):
+        # Пул группы, из которой выдано соединение: в него соединение возвращается и ему сообщаются ошибки.
+        self.pool = pool
+        self.upstream = upstream
         self.connection = connection
+        self.acquired_at = acquired_at
+        self.first_byte_at: float | None = None
         self.is_returned = False
+        # Соединение переиспользуется между запросами, ответы считаем от момента выдачи из пула.
+        self.messages_read = connection.messages_read
 
     @property
     def response_is_read(self) -> bool:
-        return self.connection.messages_read == 1
+        return self.connection.messages_read > self.messages_read
 
 
-class RoundRobinUpstreamPool:
+class UpstreamPool:
     """
-    Менеджер пула соединений к апстримам.
+    Эластичный пул соединений к апстримам.
 
-    Выдача соединения идет по round-robin.
+    Апстрим для запроса выбирает стратегия балансировки из config.balancing среди апстримов,
+    не выведенных из ротации. Если у апстрима нет свободного соединения и size < max_size,
+    новое устанавливается в фоне, а запрос ждет первое освободившееся или установленное.
+    Фоновая задача апстрима (maintain_connections) закрывает соединения, простаивающие дольше
+    idle_ttl, и досоздает свободные до min_idle не чаще max_dial_rate в секунду.
     """
+    MAINTENANCE_INTERVAL_S = 1
+
     def __init__(self, config: Config):
+        self.upstreams: list[Upstream] = []
+        self.background_tasks: set[asyncio.Task] = set()
+        self.pool_latency = LocalHistogram(POOL_LATENCY)
+        self.tls_handshakes = HandshakeStats("upstream")
+        self.config = config
+        self.strategy = STRATEGIES[config.balancing.strategy](config.balancing)
+        self.apply_config(config)
+
+    def apply_config(self, config: Config) -> None:
+        if config.balancing != self.config.balancing:
+            self.strategy = STRATEGIES[config.balancing.strategy](config.balancing)
         self.config = config
-        self.upstream_addrs = config.upstreams
         self.connect_timeout_s = config.timeouts.connect_ms / 1000
-        self.upstreams: deque[asyncio.Queue[BaseConnection]] = deque()
-
-    async def prepare_connections(self) -> None:
-        for upstream_addr in self.upstream_addrs:
-            host, port = upstream_addr.host, upstream_addr.port
-            connections = asyncio.Queue()
-            for _ in range(self.config.limits.max_conns_per_upstream):
-                try:
-                    connection = await self.connect_upstream(host, port)
-                    await connections.put(connection)
-                except Exception as exc:
-                    logger.exception(exc)
-            if connections:
-                self.upstreams.append(connections)
-        if not self.upstreams:
-            raise PoolConnectionError("Failed connect to upstreams")
-
-    async def acquire(self) -> PoolMember:
-        upstream = self.upstreams.popleft()
-        self.upstreams.append(upstream)
+        self.idle_ttl_s = config.pool.idle_ttl_ms / 1000
+        self.max_dial_rate = config.pool.max_dial_rate
+        self.ewma_decay_s = config.balancing.ewma_decay_ms / 1000
+
+    def prepare_connections(self) -> None:
+        """Соединения не устанавливаются заранее: min_idle прогревается фоновыми задачами параллельно."""
+        for upstream_config in self.config.upstreams:
+            self.upstreams.append(self.add_upstream(upstream_config))
+        register_collector(self.update_metrics)
+
+    def close(self) -> None:
+        """
+        Пул удаленной группы: апстримы выводятся из ротации и закрываются после своих запросов (drain_upstream),
+        метрики пула больше не обновляются.
+        """
+        self.reload(replace(self.config, upstreams=[]))
+        unregister_collector(self.update_metrics)
+        self.pool_latency.close()
+        self.tls_handshakes.close()
 
+    def add_upstream(self, upstream_config: UpstreamConfig) -> Upstream:
+        upstream = Upstream(upstream_config, self.config)
+        upstream.maintain_task = self.spawn(self.maintain_connections(upstream))
+        return upstream
+
+    def reload(self, config: Config) -> tuple[list[str], list[str]]:
+        """
+        Применяет перечитанный конфиг, возвращает добавленные и удаленные апстримы.
+
+        Апстримы с теми же host:port сохраняют соединения и статистику, новые прогреваются в фоне.
+        Удаленные сразу выходят из ротации, их соединения закрываются после завершения запросов.
+        """
+        self.apply_config(config)
+        current = {upstream.name: upstream for upstream in self.upstreams}
+        upstreams, added = [], []
+        for upstream_config in config.upstreams:
+            upstream = current.pop(f"{upstream_config.host}:{upstream_config.port}", None)
+            if upstream is None:
+                upstream = self.add_upstream(upstream_config)
+                added.append(upstream.name)
+            else:
+                upstream.apply_config(upstream_config, config)
+                upstream.wakeup.set()
+            upstreams.append(upstream)
+        self.upstreams = upstreams
+        for upstream in current.values():
+            self.spawn(self.drain_upstream(upstream))
+        return added, list(current)
+
+    async def drain_upstream(self, upstream: Upstream) -> None:
+        """Ждет запросы удаленного апстрима не дольше timeouts.total_ms и закрывает его соединения."""
+        upstream.maintain_task.cancel()
+        loop = asyncio.get_running_loop()
+        drain_until = loop.time() + self.config.timeouts.total_ms / 1000
+        while upstream.outstanding and loop.time() < drain_until:
+            await asyncio.sleep(self.MAINTENANCE_INTERVAL_S)
+        upstream.drained = True
+        while upstream.idle:
+            connection, _ = upstream.idle.popleft()
+            connection.transport.close()
+            upstream.size -= 1
+        upstream.close_metrics()
+        logger.info(f"Upstream {upstream.name} removed, {upstream.outstanding} requests left after drain")
+
+    async def acquire(self, exclude: list[Upstream] | None = None) -> PoolMember:
+        """exclude - апстримы, которые по возможности не выбирать (уже получили этот запрос)."""
         loop = asyncio.get_event_loop()
-        try:
-            pool_start = loop.time()
-            connection = await asyncio.wait_for(upstream.get(), self.connect_timeout_s)
-            POOL_LATENCY.observe(loop.time() - pool_start)
-        except TimeoutError:
-            raise PoolConnectionError("Timeout on getting upstream from pool")
-        return PoolMember(upstream, connection)
+        pool_start = loop.time()
+        upstreams = [upstream for upstream in self.upstreams if upstream.health.is_available(pool_start)]
+        if not upstreams:
+            raise PoolConnectionError("All upstreams are ejected")
+        if exclude:
+            upstreams = [upstream for upstream in upstreams if upstream not in exclude] or upstreams
+        upstream = self.strategy.select(upstreams)
+
+        upstream.outstanding += 1
+        connection = self.pop_idle(upstream)
+        if connection is None:
+            if upstream.size < upstream.max_size:
+                self.start_dial(upstream)
+            waiter = loop.create_future()
+            upstream.waiters.append(waiter)
+            try:
+                connection = await wait_future(waiter, self.connect_timeout_s)
+            except BaseException as exc:
+                upstream.outstanding -= 1
+                if waiter in upstream.waiters:
+                    upstream.waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    # Соединение выдали, но запрос отменили раньше, чем он его забрал.
+                    self.put_idle(upstream, waiter.result())
+                if isinstance(exc, TimeoutError):
+                    raise PoolConnectionError("Timeout on getting upstream from pool")
+                raise
+        if connection.config is not self.config:
+            connection.apply_config(self.config)
+        acquired_at = loop.time()
+        self.pool_latency.observe(acquired_at - pool_start)
+        return PoolMember(self, upstream, connection, acquired_at)
 
     async def release(self, pool_member: PoolMember, is_healthy: bool):
         if pool_member.is_returned:
             return
 
-        queue, connection = pool_member.upstream_queue, pool_member.connection
-        if is_healthy:
-            await queue.put(UpstreamConnection(connection.reader, connection.writer, self.config))
-        else:
-            host, port = connection.writer.get_extra_info('socket').getpeername()
-            await queue.put(await self.connect_upstream(host, port))
+        upstream, connection = pool_member.upstream, pool_member.connection
         pool_member.is_returned = True
+        upstream.outstanding -= 1
+        # Срок запроса абсолютный: в пуле соединение его не хранит.
+        connection.set_deadline(None)
+        if is_healthy and not connection.is_closed:
+            self.put_idle(upstream, connection)
+        else:
+            await connection.close()
+            self.discard_connection(upstream)
+
+    def pop_idle(self, upstream: Upstream) -> BaseConnection | None:
+        while upstream.idle:
+            connection, _ = upstream.idle.pop()
+            if not connection.is_closed:
+                return connection
+            # Апстрим закрыл соединение, пока оно лежало в пуле.
+            connection.transport.close()
+            self.discard_connection(upstream)
+        return None
+
+    def put_idle(self, upstream: Upstream, connection: BaseConnection) -> None:
+        if upstream.tls is not None:
+            upstream.tls.save_session(connection.transport)
+        while upstream.waiters:
+            waiter = upstream.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return
+        if upstream.drained:
+            connection.transport.close()
+            upstream.size -= 1
+            return
+        upstream.idle.append((connection, asyncio.get_event_loop().time()))
+
+    def discard_connection(self, upstream: Upstream) -> None:
+        upstream.size -= 1
+        if upstream.waiters and upstream.size < upstream.max_size:
+            self.start_dial(upstream)
+        else:
+            upstream.wakeup.set()
+
+    def start_dial(self, upstream: Upstream) -> None:
+        # Счетчики меняем сразу, чтобы следующие проверки size и dialing уже учитывали это соединение.
+        upstream.size += 1
+        upstream.dialing += 1
+        self.spawn(self.add_connection(upstream))
+
+    async def add_connection(self, upstream: Upstream) -> None:
+        loop = asyncio.get_running_loop()
+        dial_start = loop.time()
+        try:
+            connection = await self.dial(upstream)
+        except Exception as exc:
+            logger.warning(f"Failed to connect to upstream {upstream.name}: {exc!r}")
+            upstream.size -= 1
+            self.report_failure(upstream)
+            # Запрос, ради которого открывали соединение, не ждет таймаута пула.
+            while upstream.waiters:
+                waiter = upstream.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(PoolConnectionError(f"Failed to connect to upstream {upstream.name}"))
+                    break
+            return
+        finally:
+            upstream.dialing -= 1
+        upstream.dial_latency.observe(loop.time() - dial_start)
+        self.put_idle(upstream, connection)
+
+    async def maintain_connections(self, upstream: Upstream) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self.reap_idle(upstream, now)
+            if upstream.health.is_available(now):
+                self.fill_idle(upstream, now)
+            upstream.wakeup.clear()
+            try:
+                await asyncio.wait_for(upstream.wakeup.wait(), self.MAINTENANCE_INTERVAL_S)
+            except TimeoutError:
+                pass
+
+    def reap_idle(self, upstream: Upstream, now: float) -> None:
+        while upstream.idle and len(upstream.idle) > upstream.min_idle:
+            connection, released_at = upstream.idle[0]
+            if now - released_at < self.idle_ttl_s and not connection.is_closed:
+                break
+            upstream.idle.popleft()
+            connection.transport.close()
+            upstream.size -= 1
+
+    def fill_idle(self, upstream: Upstream, now: float) -> None:
+        """Досоздает свободные соединения до min_idle, число попыток ограничено token bucket."""
+        upstream.dial_tokens = min(
+            self.max_dial_rate,
+            upstream.dial_tokens + (now - upstream.dial_tokens_at) * self.max_dial_rate,
+        )
+        upstream.dial_tokens_at = now
+        while (
+                len(upstream.idle) + upstream.dialing < upstream.min_idle
+                and upstream.size < upstream.max_size
+                and upstream.dial_tokens >= 1
+        ):
+            upstream.dial_tokens -= 1
+            self.start_dial(upstream)
+
+    def update_metrics(self) -> None:
+        for upstream in self.upstreams:
+            upstream.update_metrics()
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def report_success(self, upstream: Upstream) -> None:
+        upstream.health.record_success()
+
+    def report_failure(self, upstream: Upstream) -> None:
+        upstream.health.record_failure(asyncio.get_event_loop().time())
+
+    def observe_latency(self, pool_member: PoolMember, latency_s: float) -> None:
+        loop = asyncio.get_event_loop()
+        pool_member.upstream.observe_latency(latency_s, loop.time(), self.ewma_decay_s)
+
+    async def dial(self, upstream: Upstream) -> BaseConnection:
+        return await asyncio.wait_for(self.connect_upstream(upstream), self.connect_timeout_s)
 
-    async def connect_upstream(self, host: str, port: int) -> BaseConnection:
-        reader, writer = await asyncio.open_connection(host=host, port=port)
-        return UpstreamConnection(reader, writer, self.config)
+    async def connect_upstream(self, upstream: Upstream) -> BaseConnection:
+        protocol_factory = partial(HTTPResponseProtocol, read_window=self.config.relay.window_bytes)
+        tls = upstream.tls
+        _, protocol = await asyncio.get_running_loop().create_connection(
+            protocol_factory,
+            host=upstream.host,
+            port=upstream.port,
+            ssl=tls.context if tls is not None else None,
+            server_hostname=tls.server_name if tls is not None else None,
+        )
+        if tls is not None:
+            self.tls_handshakes.observe(protocol.transport, protocol.created_at)
+        return UpstreamConnection(protocol, self.config)
@@ -0,0 +1,144 @@
+import asyncio
+import glob
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+from multiprocessing.process import BaseProcess
+
+from prometheus_client import CollectorRegistry, multiprocess
+
+from config import Config
+from diagnostics import Diagnostics
+from logger import setup_logging
+from metrics import monitor_process, start_metrics_server
+from proxy_server import ProxyServer
+from reload import ConfigReloader
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_metrics_dir() -> str:
+    """
+    Готовит каталог для multiprocess-режима prometheus_client и выставляет PROMETHEUS_MULTIPROC_DIR.
+
+    Переменная должна быть выставлена до импорта prometheus_client в воркере,
+    поэтому воркеры запускаются через spawn и наследуют окружение супервизора.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="proxy-metrics-")
+    os.makedirs(path, exist_ok=True)
+    for stale_file in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale_file)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def run_worker(config: Config, index: int, config_path: str) -> None:
+    # Ctrl+C приходит всей группе процессов, воркеры останавливает супервизор.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    setup_logging(config.logging)
+    logger.info(f"Starting worker #{index} pid={os.getpid()}")
+    asyncio.run(serve_worker(config, index, config_path))
+
+
+async def serve_worker(config: Config, index: int, config_path: str) -> None:
+    server = ProxyServer(config)
+    diagnostics = Diagnostics(config.debug)
+    # SIGHUP воркеру пересылает супервизор, каждый воркер перечитывает конфиг сам.
+    ConfigReloader(config_path, server.reload, diagnostics.reload).install()
+    tasks = [
+        server.start_server(),
+        monitor_process(),
+        diagnostics.run(),
+    ]
+    if config.debug.worker_port:
+        # Метрики супервизора общие, а профиль и соединения у каждого воркера свои.
+        tasks.append(start_metrics_server(port=config.debug.worker_port + index))
+    await asyncio.gather(*tasks)
+
+
+class WorkerSupervisor:
+    """
+    Запускает config.workers процессов с собственными ProxyServer и пулом апстримов.
+
+    Все воркеры слушают один адрес через SO_REUSEPORT, соединения между ними распределяет ядро.
+    Упавшие воркеры перезапускаются. Метрики воркеров агрегируются через multiprocess-режим
+    prometheus_client и отдаются супервизором с единственного порта метрик.
+    По SIGHUP и /admin/reload супервизор проверяет конфиг и пересылает SIGHUP воркерам,
+    перезапущенные после этого воркеры стартуют уже с новым конфигом.
+    """
+    CHECK_INTERVAL_S = 0.5
+    RESTART_DELAY_S = 1.0
+
+    def __init__(self, config: Config, config_path: str):
+        self.config = config
+        self.config_path = config_path
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.processes: list[BaseProcess | None] = [None] * config.workers
+        self.stop_event = asyncio.Event()
+
+    async def run(self) -> None:
+        prepare_metrics_dir()
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop_event.set)
+        ConfigReloader(self.config_path, self.reload).install()
+
+        for index in range(self.config.workers):
+            self.spawn(index)
+
+        metrics_task = asyncio.create_task(start_metrics_server(registry))
+        try:
+            await self.supervise()
+        finally:
+            metrics_task.cancel()
+            self.terminate_workers()
+
+    def spawn(self, index: int) -> None:
+        process = self.mp_context.Process(
+            target=run_worker, args=(self.config, index, self.config_path), name=f"proxy-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def reload(self, config: Config) -> dict:
+        restart_required = ["workers"] if config.workers != self.config.workers else []
+        self.config = config
+        signalled = 0
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+                signalled += 1
+        return {"workers_signalled": signalled, "restart_required": restart_required}
+
+    async def supervise(self) -> None:
+        restart_at: dict[int, float] = {}
+        loop = asyncio.get_running_loop()
+        while not self.stop_event.is_set():
+            for index, process in enumerate(self.processes):
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.error(f"Worker #{index} pid={process.pid} exited with code {process.exitcode}")
+                    multiprocess.mark_process_dead(process.pid)
+                    self.processes[index] = None
+                    restart_at[index] = loop.time() + self.RESTART_DELAY_S
+                if loop.time() >= restart_at.get(index, 0):
+                    self.spawn(index)
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), self.CHECK_INTERVAL_S)
+            except TimeoutError:
+                pass
+
+    def terminate_workers(self) -> None:
+        alive = [process for process in self.processes if process is not None]
+        for process in alive:
+            process.terminate()
+        for process in alive:
+            process.join()
+            multiprocess.mark_process_dead(process.pid)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули прокси импортируют друг друга как пакеты верхнего уровня (from config import ...).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy'))
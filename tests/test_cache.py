@@ -0,0 +1,124 @@
+import pytest
+
+import cache as cache_module
+from cache import ResponseCache
+from config import CacheConfig
+from http_utils.http_reader import HTTPRequestParser, HTTPResponseParser
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'monotonic', clock)
+    return clock
+
+
+def request(path: bytes = b'/', headers: bytes = b'Host: a\r\n', method: bytes = b'GET'):
+    return HTTPRequestParser().feed(method + b' ' + path + b' HTTP/1.1\r\n' + headers + b'\r\n')[0].head
+
+
+def response(headers: bytes = b'Cache-Control: max-age=60\r\n', body: bytes = b'ok', status: bytes = b'200 OK'):
+    raw = b'HTTP/1.1 ' + status + b'\r\n' + headers + b'Content-Length: %d\r\n\r\n' % len(body) + body
+    return HTTPResponseParser().feed(raw)[0].head, raw
+
+
+def make_cache(**kwargs) -> ResponseCache:
+    return ResponseCache(CacheConfig(enabled=True, **kwargs))
+
+
+def test_fresh_until_max_age(clock):
+    cache = make_cache()
+    key = cache.make_key(request(), 'default')
+    head, raw = response(b'Cache-Control: public, max-age=60\r\n')
+    cache.put(key, head, raw)
+    clock.now += 59
+    assert cache.get(key) == raw
+    clock.now += 1
+    assert cache.get(key) is None
+    assert key not in cache.entries and cache.size == 0
+
+
+def test_s_maxage_wins_and_expires_with_date(clock):
+    cache = make_cache()
+    head, raw = response(b'Cache-Control: max-age=10, s-maxage=100\r\n')
+    assert cache.get_ttl(head) == 100
+    head, raw = response(b'Date: Mon, 01 Jan 2024 00:00:00 GMT\r\nExpires: Mon, 01 Jan 2024 00:00:30 GMT\r\n')
+    assert cache.get_ttl(head) == 30
+
+
+@pytest.mark.parametrize('headers', [
+    b'',
+    b'Cache-Control: no-store, max-age=60\r\n',
+    b'Cache-Control: private, max-age=60\r\n',
+    b'Cache-Control: max-age=60\r\nSet-Cookie: id=1\r\n',
+    b'Cache-Control: max-age=60\r\nVary: Cookie\r\n',
+])
+def test_not_stored(clock, headers):
+    cache = make_cache()
+    key = cache.make_key(request(), 'default')
+    head, raw = response(headers)
+    cache.put(key, head, raw)
+    assert cache.get(key) is None
+
+
+def test_vary_by_key_header_is_stored(clock):
+    cache = make_cache(vary_headers=['Accept-Encoding'])
+    gzip_key = cache.make_key(request(headers=b'Host: a\r\nAccept-Encoding: gzip\r\n'), 'default')
+    plain_key = cache.make_key(request(), 'default')
+    head, raw = response(b'Cache-Control: max-age=60\r\nVary: accept-encoding\r\n')
+    cache.put(gzip_key, head, raw)
+    assert cache.get(gzip_key) == raw
+    assert cache.get(plain_key) is None
+
+
+def test_key_includes_group_host_and_method():
+    cache = make_cache()
+    key = cache.make_key(request(), 'default')
+    assert cache.make_key(request(headers=b'Host: b\r\n'), 'default') != key
+    assert cache.make_key(request(), 'api') != key
+    assert cache.make_key(request(method=b'POST'), 'default') is None
+    assert cache.make_key(request(headers=b'Host: a\r\nAuthorization: x\r\n'), 'default') is None
+    assert cache.make_key(request(headers=b'Host: a\r\nCache-Control: no-cache\r\n'), 'default') is None
+
+
+def test_lru_eviction(clock):
+    head, raw = response(body=b'x' * 100)
+    cache = make_cache(max_bytes=len(raw) * 2)
+    keys = [cache.make_key(request(b'/%d' % index), 'default') for index in range(3)]
+    cache.put(keys[0], head, raw)
+    cache.put(keys[1], head, raw)
+    # Чтение делает первый ответ самым свежим, вытесняется второй.
+    assert cache.get(keys[0]) == raw
+    cache.put(keys[2], head, raw)
+    assert list(cache.entries) == [keys[0], keys[2]]
+    assert cache.size == len(raw) * 2
+    assert cache.evictions.value == 1
+
+
+def test_oversize_object_not_stored(clock):
+    head, raw = response(body=b'x' * 100)
+    cache = make_cache(max_object_bytes=len(raw) - 1)
+    key = cache.make_key(request(), 'default')
+    cache.put(key, head, raw)
+    assert not cache.entries
+
+
+def test_variants_counted_and_evicted_with_entry(clock):
+    head, raw = response(body=b'x' * 100)
+    cache = make_cache(max_bytes=len(raw) * 2)
+    first, second = (cache.make_key(request(b'/%d' % index), 'default') for index in range(2))
+    cache.put(first, head, raw)
+    cache.put_variant(first, b'gzip', b'z' * 10)
+    assert cache.get_variant(first, b'gzip') == b'z' * 10
+    assert cache.size == len(raw) + 10
+    cache.put(second, head, raw)
+    assert list(cache.entries) == [second]
+    assert cache.size == len(raw)
@@ -0,0 +1,63 @@
+import asyncio
+import zlib
+
+import pytest
+
+from compression import ResponseCompression, rewrite_head
+from config import CompressionConfig
+from http_utils.http_reader import HTTPResponseParser
+
+
+def response_head(headers: bytes, status: bytes = b'200 OK', body_size: int = 2048):
+    raw = b'HTTP/1.1 ' + status + b'\r\n' + headers + b'Content-Length: %d\r\n\r\n' % body_size
+    return HTTPResponseParser().feed(raw)[0].head
+
+
+def vary_headers(head: bytes) -> list[bytes]:
+    return [line[5:].strip() for line in head.split(b'\r\n') if line.lower().startswith(b'vary:')]
+
+
+@pytest.mark.parametrize('headers, vary', [
+    (b'', b'Accept-Encoding'),
+    (b'Vary: Origin\r\n', b'Origin, Accept-Encoding'),
+    (b'Vary: Origin\r\nvary: Cookie\r\n', b'Origin, Cookie, Accept-Encoding'),
+    (b'Vary: origin, accept-encoding\r\n', b'origin, accept-encoding'),
+    (b'Vary: *\r\n', b'*'),
+])
+def test_vary_merged_into_one_header(headers, vary):
+    head = rewrite_head(response_head(b'Content-Type: text/plain\r\n' + headers), b'gzip')
+    assert vary_headers(head) == [vary]
+    assert b'Content-Encoding: gzip\r\n' in head and b'Transfer-Encoding: chunked\r\n\r\n' in head
+    assert b'Content-Length' not in head
+
+
+def test_compressed_response_and_variant():
+    body = b'x' * 4096
+    raw = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nVary: Origin\r\nContent-Length: 4096\r\n\r\n' + body
+    head = HTTPResponseParser().feed(raw)[0].head
+    compressor = ResponseCompression(CompressionConfig(enabled=True)).compressor(b'gzip', keep_body=True)
+    streamed = asyncio.run(compressor.compress(raw, head, True))
+    assert vary_headers(streamed) == [b'Origin, Accept-Encoding']
+    variant = compressor.variant()
+    assert vary_headers(variant) == [b'Origin, Accept-Encoding']
+    assert zlib.decompress(variant.split(b'\r\n\r\n', 1)[1], 31) == body
+
+
+@pytest.mark.parametrize('status, headers, expected', [
+    (b'200 OK', b'', True),
+    (b'206 Partial Content', b'Content-Range: bytes 0-2047/10000\r\n', False),
+    (b'404 Not Found', b'', False),
+    (b'200 OK', b'Content-Encoding: br\r\n', False),
+    (b'200 OK', b'Cache-Control: no-transform\r\n', False),
+])
+def test_should_compress(status, headers, expected):
+    compression = ResponseCompression(CompressionConfig(enabled=True))
+    head = response_head(b'Content-Type: text/plain; charset=utf-8\r\n' + headers, status)
+    assert compression.should_compress(head) is expected
+
+
+def test_short_and_chunked_responses_not_compressed():
+    compression = ResponseCompression(CompressionConfig(enabled=True, min_length=1024))
+    assert not compression.should_compress(response_head(b'Content-Type: text/plain\r\n', body_size=100))
+    raw = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nTransfer-Encoding: chunked\r\n\r\n'
+    assert not compression.should_compress(HTTPResponseParser().feed(raw)[0].head)
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from deadline import Deadline, TimerWheel, wait_future
+
+
+class FakeLoop:
+    """Loop с ручным временем: call_at только запоминает колбэк, run_until выполняет наступившие."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.timers: list[tuple[float, object]] = []
+
+    def time(self) -> float:
+        return self.now
+
+    def call_at(self, when: float, callback):
+        self.timers.append((when, callback))
+        return object()
+
+    def run_until(self, when: float) -> None:
+        while self.timers and min(self.timers, key=lambda timer: timer[0])[0] <= when:
+            timer = min(self.timers, key=lambda timer: timer[0])
+            self.timers.remove(timer)
+            self.now = timer[0]
+            timer[1]()
+        self.now = when
+
+
+class Entry:
+    """Срок для колеса без asyncio: запоминает, когда истек."""
+
+    def __init__(self, loop: FakeLoop):
+        self.loop = loop
+        self.tick = None
+        self.expired_at = None
+
+    def expire(self) -> None:
+        self.expired_at = self.loop.now
+
+
+@pytest.fixture
+def loop():
+    return FakeLoop()
+
+
+def test_expires_on_first_tick_after_deadline(loop):
+    wheel = TimerWheel(loop)
+    entry = Entry(loop)
+    wheel.schedule(entry, loop.now + 0.055)
+    loop.run_until(loop.now + 0.05)
+    assert entry.expired_at is None
+    loop.run_until(loop.now + 0.02)
+    assert entry.expired_at == pytest.approx(100.06)
+    assert wheel.scheduled == 0 and entry.tick is None
+
+
+def test_cancelled_entry_not_expired_and_timer_stops(loop):
+    wheel = TimerWheel(loop)
+    entry = Entry(loop)
+    wheel.schedule(entry, loop.now + 0.05)
+    wheel.cancel(entry)
+    loop.run_until(loop.now + 1)
+    assert entry.expired_at is None
+    # Без взведенных сроков колесо не перевзводит call_at.
+    assert wheel.handle is None and not loop.timers
+
+
+def test_deadline_beyond_one_revolution(loop):
+    wheel = TimerWheel(loop)
+    revolution_s = wheel.SLOTS * wheel.RESOLUTION_S
+    near, far = Entry(loop), Entry(loop)
+    wheel.schedule(near, loop.now + 1)
+    wheel.schedule(far, loop.now + 1 + revolution_s)
+    assert near.tick % wheel.SLOTS == far.tick % wheel.SLOTS
+    loop.run_until(loop.now + 2)
+    assert near.expired_at is not None and far.expired_at is None
+    loop.run_until(loop.now + revolution_s)
+    assert far.expired_at == pytest.approx(101 + revolution_s)
+
+
+def test_past_deadline_expires_on_next_tick(loop):
+    wheel = TimerWheel(loop)
+    entry = Entry(loop)
+    wheel.schedule(entry, loop.now - 5)
+    loop.run_until(loop.now + wheel.RESOLUTION_S)
+    assert entry.expired_at is not None
+
+
+def test_deadline_wait_times_out():
+    async def main():
+        deadline = Deadline()
+        deadline.start(0.02)
+        future = asyncio.get_running_loop().create_future()
+        with pytest.raises(TimeoutError):
+            await deadline.wait(future)
+        assert deadline.expired
+        # Истекший срок сразу отменяет следующее ожидание.
+        second = asyncio.get_running_loop().create_future()
+        with pytest.raises(TimeoutError):
+            await deadline.wait(second)
+        assert second.cancelled()
+
+    asyncio.run(main())
+
+
+def test_deadline_restart_and_stop():
+    async def main():
+        expired = []
+        deadline = Deadline(lambda: expired.append(True))
+        deadline.start(0.02)
+        deadline.start(10)
+        await asyncio.sleep(0.05)
+        assert not expired and not deadline.expired
+        deadline.stop()
+        assert deadline.wheel.scheduled == 0
+        deadline.start(0.01)
+        await asyncio.sleep(0.05)
+        assert expired == [True]
+
+    asyncio.run(main())
+
+
+def test_wait_future_returns_result():
+    async def main():
+        future = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.01, future.set_result, 'ok')
+        assert await wait_future(future, 1) == 'ok'
+
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import pytest
+
+from http_utils.http_reader import HTTPParseError, HTTPRequestParser, HTTPResponseParser
+
+
+def feed_all(parser, *parts: bytes) -> list:
+    chunks = []
+    for part in parts:
+        chunks.extend(parser.feed(part))
+    return chunks
+
+
+def body(chunks) -> bytes:
+    return b''.join(bytes(chunk.chunk) for chunk in chunks if not chunk.is_message_start)
+
+
+def test_head_split_inside_crlf():
+    request = b'GET /a HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc'
+    for split in range(1, len(request)):
+        parser = HTTPRequestParser()
+        chunks = feed_all(parser, request[:split], request[split:])
+        assert chunks[0].is_message_start and chunks[0].head.path == b'/a'
+        assert chunks[0].head.get_header(b'host') == b'x'
+        assert body(chunks) == b'abc'
+        assert chunks[-1].is_message_end
+        assert not parser.in_message
+
+
+def test_pipelined_requests_in_one_feed():
+    parser = HTTPRequestParser()
+    chunks = parser.feed(
+        b'GET /1 HTTP/1.1\r\n\r\n'
+        b'POST /2 HTTP/1.1\r\nContent-Length: 2\r\n\r\nok'
+        b'GET /3 HTTP/1.1\r\n'
+    )
+    assert [chunk.head.path for chunk in chunks if chunk.is_message_start] == [b'/1', b'/2']
+    assert [chunk.is_message_end for chunk in chunks] == [True, False, True]
+    # Начало третьего запроса остается в парсере до следующих байтов.
+    assert parser.in_message
+    chunks = parser.feed(b'\r\n')
+    assert chunks[0].head.path == b'/3' and chunks[0].is_message_end
+
+
+def test_body_split_across_feeds():
+    parser = HTTPResponseParser()
+    chunks = feed_all(parser, b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nab', b'c', b'deHTTP/1.1 204 No Content\r\n\r\n')
+    assert body(chunks[:4]) == b'abcde'
+    assert chunks[3].is_message_end
+    assert chunks[4].head.status == 204 and chunks[4].is_message_end
+
+
+def test_oversize_head_rejected():
+    parser = HTTPRequestParser()
+    parser.feed(b'GET / HTTP/1.1\r\n')
+    with pytest.raises(HTTPParseError):
+        parser.feed(b'X-Big: ' + b'a' * parser.MAX_HEAD_SIZE)
+
+
+def test_oversize_complete_head_rejected():
+    parser = HTTPRequestParser()
+    with pytest.raises(HTTPParseError):
+        parser.feed(b'GET / HTTP/1.1\r\nX-Big: ' + b'a' * parser.MAX_HEAD_SIZE + b'\r\n\r\n')
+
+
+def test_invalid_content_length():
+    with pytest.raises(HTTPParseError):
+        HTTPRequestParser().feed(b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n')
+
+
+def test_chunked_with_trailers():
+    message = (
+        b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+        b'5;ext=1\r\nhello\r\n'
+        b'A\r\n0123456789\r\n'
+        b'0\r\nX-Checksum: 1\r\nX-Other: 2\r\n\r\n'
+    )
+    raw_body = message[message.index(b'\r\n\r\n') + 4:]
+    for split in range(1, len(message)):
+        parser = HTTPResponseParser()
+        chunks = feed_all(parser, message[:split], message[split:] + b'HTTP/1.1 304 Not Modified\r\n\r\n')
+        head = chunks[0].head
+        assert head.chunked and head.content_length == 0
+        ends = [index for index, chunk in enumerate(chunks) if chunk.is_message_end]
+        # Тело отдается как есть, вместе с размерами чанков и трейлерами.
+        assert body(chunks[:ends[0] + 1]) == raw_body
+        assert chunks[ends[1]].head.status == 304
+        assert not parser.in_message
+
+
+def test_chunked_request_is_not_complete_with_head():
+    parser = HTTPRequestParser()
+    chunks = parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: gzip, chunked\r\n\r\n0\r\n')
+    assert not any(chunk.is_message_end for chunk in chunks)
+    assert parser.feed(b'\r\n')[-1].is_message_end
+
+
+@pytest.mark.parametrize('size_line', [b'+5', b'-1', b'1_0', b'', b'xyz'])
+def test_invalid_chunk_size(size_line):
+    parser = HTTPRequestParser()
+    parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n')
+    with pytest.raises(HTTPParseError):
+        parser.feed(size_line + b'\r\n')
+
+
+def test_missing_crlf_after_chunk_data():
+    parser = HTTPRequestParser()
+    with pytest.raises(HTTPParseError):
+        parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nabcd\r\n')
+
+
+@pytest.mark.parametrize('headers', [
+    b'Transfer-Encoding: chunked\r\nContent-Length: 3\r\n',
+    b'Transfer-Encoding: gzip\r\n',
+])
+def test_ambiguous_framing_rejected(headers):
+    with pytest.raises(HTTPParseError):
+        HTTPRequestParser().feed(b'POST / HTTP/1.1\r\n' + headers + b'\r\n')
+
+
+def test_bodyless_responses():
+    parser = HTTPResponseParser()
+    parser.expect_no_body = True
+    chunks = parser.feed(
+        b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n'
+        b'HTTP/1.1 304 Not Modified\r\nTransfer-Encoding: chunked\r\n\r\n'
+    )
+    assert [chunk.is_message_end for chunk in chunks] == [True, True]
+    assert not parser.in_message
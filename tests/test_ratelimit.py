@@ -0,0 +1,67 @@
+from config import RateLimitConfig
+from http_utils.http_reader import HTTPRequestParser
+from ratelimit import ClientRateLimiter, RateLimiter
+
+
+def test_burst_then_refill():
+    limiter = RateLimiter(rate=10, burst=3, max_keys=100, shards=4)
+    assert [limiter.acquire('a', 0) for _ in range(4)] == [True, True, True, False]
+    # За 0.1 с при 10 токенах в секунду набирается один токен.
+    assert limiter.acquire('a', 0.05) is False
+    assert limiter.acquire('a', 0.1) is True
+    assert limiter.acquire('a', 0.1) is False
+
+
+def test_refill_capped_by_burst():
+    limiter = RateLimiter(rate=10, burst=2, max_keys=100, shards=1)
+    limiter.acquire('a', 0)
+    assert [limiter.acquire('a', 100) for _ in range(3)] == [True, True, False]
+
+
+def test_keys_are_independent():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=100, shards=4)
+    assert limiter.acquire('a', 0) and limiter.acquire('b', 0)
+    assert not limiter.acquire('a', 0)
+
+
+def test_shard_evicts_least_recently_used():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=4, shards=2)
+    # hash(int) == int: четные ключи попадают в шард 0, емкость шарда 2.
+    limiter.acquire(0, 0)
+    limiter.acquire(2, 0)
+    limiter.acquire(0, 0.5)
+    limiter.acquire(4, 0.5)
+    assert list(limiter.shards[0]) == [0, 4]
+    assert len(limiter) == 2
+    # Вытесненный ключ начинает с полного бакета.
+    assert limiter.acquire(2, 0.5)
+
+
+def test_sweep_drops_refilled_buckets():
+    limiter = RateLimiter(rate=10, burst=5, max_keys=100, shards=1)
+    limiter.acquire('old', 0)
+    limiter.acquire('new', 0.4)
+    limiter.sweep(0.5)
+    assert list(limiter.shards[0]) == ['new']
+    limiter.sweep(1)
+    assert len(limiter) == 0
+
+
+def test_apply_config_keeps_buckets():
+    limiter = RateLimiter(rate=1, burst=1, max_keys=100, shards=1)
+    limiter.acquire('a', 0)
+    limiter.apply_config(rate=100, burst=1, max_keys=100)
+    assert limiter.acquire('a', 0.01)
+    assert len(limiter) == 1
+
+
+def test_client_key_header():
+    limiter = ClientRateLimiter(RateLimitConfig(enabled=True, requests_per_second=1, burst=1, key_header='X-API-Key'))
+    with_key = HTTPRequestParser().feed(b'GET / HTTP/1.1\r\nX-API-Key: k\r\n\r\n')[0].head
+    without_key = HTTPRequestParser().feed(b'GET / HTTP/1.1\r\n\r\n')[0].head
+    assert limiter.allow_request('10.0.0.1', with_key, 0)
+    assert not limiter.allow_request('10.0.0.2', with_key, 0)
+    assert limiter.allow_request('10.0.0.1', without_key, 0)
+    assert limiter.clients == 2
+    # connections_per_second: 0 - соединения не ограничиваются.
+    assert all(limiter.allow_connection('10.0.0.1', 0) for _ in range(100))
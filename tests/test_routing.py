@@ -0,0 +1,71 @@
+import pytest
+
+from config import RouteConfig
+from http_utils.http_reader import HTTPRequestParser
+from routing import Router
+
+
+def route(router: Router, path: bytes, host: bytes | None = None) -> str | None:
+    headers = b'Host: ' + host + b'\r\n' if host is not None else b''
+    return router.route(HTTPRequestParser().feed(b'GET ' + path + b' HTTP/1.1\r\n' + headers + b'\r\n')[0].head)
+
+
+@pytest.fixture
+def router() -> Router:
+    return Router([
+        RouteConfig('api', path_prefix='/api'),
+        RouteConfig('users', path_prefix='/api/users/'),
+        RouteConfig('first', path_prefix='/dup'),
+        RouteConfig('second', path_prefix='/dup'),
+        RouteConfig('login', path='/api/users/login'),
+        RouteConfig('images', path_regex=r'\.(png|jpg)$'),
+        RouteConfig('host', host='example.com'),
+        RouteConfig('host-api', host='Example.com', path_prefix='/api'),
+        RouteConfig('wild', host='*.example.com'),
+        RouteConfig('deep', host='*.eu.example.com', path_prefix='/'),
+    ], 'default')
+
+
+@pytest.mark.parametrize('path, group', [
+    (b'/api', 'api'),
+    (b'/api/', 'api'),
+    (b'/api/orders?id=1', 'api'),
+    (b'/api/users', 'users'),
+    (b'/api/users/42', 'users'),
+    (b'/api/users/login', 'login'),
+    (b'/api/users/login/x', 'users'),
+    (b'/apiv2', 'default'),
+    (b'/dup/x', 'first'),
+    (b'/static/a.png', 'images'),
+    (b'/api/a.png', 'api'),
+    (b'/', 'default'),
+])
+def test_path_routes(router, path, group):
+    assert route(router, path) == group
+
+
+@pytest.mark.parametrize('host, path, group', [
+    (b'example.com', b'/', 'host'),
+    (b'EXAMPLE.com:8080', b'/api/x', 'host-api'),
+    (b'a.example.com', b'/x', 'wild'),
+    (b'a.b.example.com', b'/x', 'wild'),
+    (b'x.eu.example.com', b'/x', 'deep'),
+    (b'example.org', b'/api/x', 'api'),
+    (b'notexample.com', b'/x', 'default'),
+    (b'[::1]:8080', b'/api', 'api'),
+])
+def test_host_routes(router, host, path, group):
+    assert route(router, path, host) == group
+
+
+def test_host_without_matching_path_falls_back():
+    router = Router([RouteConfig('host-api', host='example.com', path_prefix='/api'),
+                     RouteConfig('any', path_prefix='/')], None)
+    assert route(router, b'/other', b'example.com') == 'any'
+    assert route(router, b'/api', b'example.com') == 'host-api'
+
+
+def test_no_default_group():
+    router = Router([RouteConfig('api', path_prefix='/api')], None)
+    assert route(router, b'/other') is None
+    assert route(router, b'/api/x') == 'api'
@@ -0,0 +1,71 @@
+import asyncio
+import socket
+
+import pytest
+import yaml
+
+from config import ConfigLoader
+from http_utils.external.client import ClientConnection
+from http_utils.protocol import HTTPRequestProtocol
+from http_utils.splice import SPLICE_SUPPORTED
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump({
+        'listen': '127.0.0.1:0',
+        'upstreams': [{'host': '127.0.0.1', 'port': 1}],
+        'timeouts': {'connect_ms': 1000, 'read_ms': 1000, 'write_ms': 1000, 'total_ms': 5000, 'keepalive_ms': 1000},
+        'limits': {'max_client_conns': 10, 'max_conns_per_upstream': 5},
+    }))
+    return ConfigLoader(str(path)).get_config()
+
+
+async def accept(sock: socket.socket, config) -> ClientConnection:
+    _, protocol = await asyncio.get_running_loop().connect_accepted_socket(HTTPRequestProtocol, sock)
+    return ClientConnection(protocol, config)
+
+
+async def wait_for(condition) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError('condition not reached')
+
+
+@pytest.mark.skipif(not SPLICE_SUPPORTED, reason='os.splice is not available')
+def test_splice_stops_at_pipelined_request(config):
+    """Конец тела пришел одним чтением с началом следующего запроса: его тело не уходит в splice текущего."""
+    async def main():
+        client, proxy_side = socket.socketpair()
+        upstream, upstream_side = socket.socketpair()
+        source, destination = await accept(proxy_side, config), await accept(upstream_side, config)
+        requests = source.iterator()
+        body = b'a' * 4096
+
+        client.sendall(b'POST /first HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body[:100])
+        head = await anext(requests)
+        assert head.head.path == b'/first' and not head.is_message_end
+        client.sendall(body[100:] + b'POST /second HTTP/1.1\r\nContent-Length: 3\r\n\r\nx')
+        await wait_for(lambda: source.protocol.chunks and any(chunk.is_message_start for chunk in source.protocol.chunks))
+
+        await source.splice_body_to(destination)
+        client.sendall(b'yz')
+        upstream.setblocking(False)
+        await asyncio.sleep(0.05)
+        assert upstream.recv(65536) == body[100:]
+
+        second = await anext(requests)
+        assert second.head.path == b'/second'
+        # Заголовки и пришедшие куски тела отдаются одним чанком.
+        message = bytes(second.chunk)
+        while not second.is_message_end:
+            second = await anext(requests)
+            message += bytes(second.chunk)
+        assert message.endswith(b'\r\n\r\nxyz')
+        for sock in (client, upstream):
+            sock.close()
+
+    asyncio.run(main())